@@ -1,21 +1,38 @@
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 import configparser
+import contextvars
+from functools import lru_cache
+import logging
+import random
+import threading
 
 from langchain_core.messages import AIMessage, AnyMessage, HumanMessage, SystemMessage
 from langchain_core.runnables import RunnableConfig
 from langgraph.graph import START, END, StateGraph
 from langgraph.graph.message import add_messages
-from langgraph.prebuilt import ToolNode
+from langgraph.graph.state import CompiledStateGraph
 from typing_extensions import Annotated, TypedDict, Optional
-import streamlit as st
 
 from paths import PROJECT_ROOT
-from tools import get_all_tools
 from schemas.geometry import BoundingBox, PointMarker
-from utils.agent_utils import get_chat_history, get_llm
+from utils.agent_utils import create_tool_node, get_chat_history, get_llm, get_llm_within_deadline
+from utils.instrumentation import get_trace_summary, traced
+from utils.session_store import get_session_store
 
 cfg = configparser.ConfigParser()
 cfg.read(f'{PROJECT_ROOT}/config.ini')
 
+logger = logging.getLogger(__name__)
+
+# Share of questions answered with tools that also get an alternative answer without tools
+AB_SAMPLE_RATE = cfg.getfloat('AB_TESTING', 'sample_rate', fallback=1.0)
+# Alternatives are generated on their own workers, questions are not sampled while this many are pending
+AB_MAX_WORKERS = cfg.getint('AB_TESTING', 'max_workers', fallback=2)
+AB_MAX_PENDING = cfg.getint('AB_TESTING', 'max_pending', fallback=8)
+# How long callers showing the comparison wait for the alternative after the answer is done
+AB_WAIT_S = cfg.getfloat('AB_TESTING', 'wait_s', fallback=10.0)
+
 SYSTEM_MESSAGE = """
 You are a helpful assistant working with geographical data. Some questions will be tied to an area defined by bounding box coordinates.
 These coordinates represent a geographical area on the map. You do not need to ask for the coordinates; allways assume you already know the coordinates of the area you are working with.
@@ -33,60 +50,131 @@ class AgentState(TypedDict):
         messages: List of current chat messages
         bounding_box: Bounding box instance representing a geographical area of interest.
         hotel_site_marker: Coordinates of a potential hotel site marker.
-        alternative_response: Alternative model response generated without tools
+        alternative_sampled: Whether the question was sampled for an alternative response generated without tools
     """
     messages: Annotated[list[AnyMessage], add_messages]
     bounding_box: BoundingBox
     hotel_site_marker: PointMarker
-    alternative_response: Optional[AIMessage]
-
-llm = get_llm()
-
-llm_with_tools = llm.bind_tools(get_all_tools())
+    alternative_sampled: Optional[bool]
+
+
+class PendingAlternative:
+    """Alternative response generated in the background, attached to the final answer of the run when both are done."""
+    def __init__(self, future: Future):
+        self.future = future
+        self.alternative = None
+        self.attached = threading.Event()
+
+    def attach(self, answer: AIMessage, chat_history):
+        try:
+            alternative = self.future.result()
+            answer.alternative_id = alternative.id
+            alternative.alternative_id = answer.id
+            alternative.run_id = answer.run_id
+            chat_history.add_alternative(alternative)
+            chat_history.update_message(answer)
+            self.alternative = alternative
+        except Exception:
+            logger.exception("Alternative response could not be attached")
+        finally:
+            self.attached.set()
+
+_alternative_executor = ThreadPoolExecutor(max_workers=AB_MAX_WORKERS, thread_name_prefix="ab-alternative")
+_alternative_slots = threading.BoundedSemaphore(AB_MAX_PENDING)
+_pending_alternatives: OrderedDict[str, PendingAlternative] = OrderedDict()
+_pending_lock = threading.Lock()
+
+def start_alternative(state: AgentState, config: RunnableConfig) -> bool:
+    """
+    Samples the question for A/B comparison and starts generating the alternative response in the background.
+    Questions are not sampled while the alternative budget is exhausted, so A/B collection never delays answers.
+    """
+    if random.random() >= AB_SAMPLE_RATE or not _alternative_slots.acquire(blocking=False):
+        return False
+
+    state = dict(state)
+
+    def run():
+        try:
+            return call_without_tools(state)
+        finally:
+            _alternative_slots.release()
+
+    future = _alternative_executor.submit(contextvars.copy_context().run, run)
+    with _pending_lock:
+        _pending_alternatives[str(config["configurable"]["run_id"])] = PendingAlternative(future)
+        while len(_pending_alternatives) > 4 * AB_MAX_PENDING:
+            _pending_alternatives.popitem(last=False)
+    return True
+
+def wait_for_alternative(run_id, timeout: float = AB_WAIT_S) -> AIMessage | None:
+    """Alternative response of a finished run once it is attached to the answer, None if not sampled or not ready in time."""
+    with _pending_lock:
+        pending = _pending_alternatives.get(str(run_id))
+    if pending is None or not pending.attached.wait(timeout):
+        return None
+    with _pending_lock:
+        _pending_alternatives.pop(str(run_id), None)
+    return pending.alternative
+
+def alternative_pending(run_id) -> bool:
+    """Whether the alternative response of the run is still being generated, without waiting for it."""
+    with _pending_lock:
+        pending = _pending_alternatives.get(str(run_id))
+        if pending is not None and pending.attached.is_set():
+            _pending_alternatives.pop(str(run_id), None)
+            return False
+    return pending is not None
 
 def should_continue(state: AgentState, config: RunnableConfig):
     msgs = state["messages"]
     last_message = msgs[-1]
     if last_message.tool_calls:
-        if state.get("alternative_response", None) is None:
-            return ["alternative", "tools"]
         return "tools"
 
-    get_chat_history().add_messages(msgs)
+    # Attributes are set before the messages are persisted
     last_message.run_id = config["configurable"]["run_id"]
-    for m in msgs:
-        st.session_state["all_messages"][m.id] = m
-    alternative = state.get("alternative_response", None)
-    if  alternative is not None:
-        last_message.alternative_id = alternative.id
-        alternative.alternative_id = last_message.id
-        alternative.run_id = config["configurable"]["run_id"]
-        st.session_state["all_messages"][alternative.id] = alternative
+    last_message.timings = get_trace_summary()
+    chat_history = get_chat_history(get_session_store(config))
+    chat_history.add_messages(msgs)
+    with _pending_lock:
+        pending = _pending_alternatives.get(str(last_message.run_id))
+    if pending is not None:
+        # The answer is not held back, the alternative is attached to it whenever it finishes
+        pending.future.add_done_callback(lambda _: pending.attach(last_message, chat_history))
     return END
 
+@traced("node.agent")
 def call_model(state: AgentState, config: RunnableConfig):
-    chat_history = get_chat_history()
+    chat_history = get_chat_history(get_session_store(config))
     msgs = [SystemMessage(content=SYSTEM_MESSAGE)] + list(chat_history.messages) + state["messages"]
-    response = llm_with_tools.invoke(msgs)
+    response = get_llm_within_deadline(config).invoke(msgs)
+    # Only questions answered with tools are compared with an answer without them
+    if response.tool_calls and state.get("alternative_sampled") is None:
+        return {"messages": [response], "alternative_sampled": start_alternative(state, config)}
     return {"messages": [response]}
 
-def call_without_tools(state: AgentState, config: RunnableConfig):
+@traced("node.alternative")
+def call_without_tools(state: AgentState) -> AIMessage:
     bbox_text = f"The bounding box is defined by the following coordinates (lat1, lon1, lat2, lon2):\n" \
                 f"{state['bounding_box'].to_string_latlon()}\n"
     user_msg = HumanMessage(content=bbox_text + state["messages"][0].content)
 
     msgs = [user_msg]
-    response = llm.invoke(msgs)
-    return {"alternative_response": response}
+    return get_llm().invoke(msgs)
 
-workflow = StateGraph(AgentState)
+@lru_cache(maxsize=1)
+def get_comparison_geo_agent() -> CompiledStateGraph:
+    """
+    Builds and compiles the agent graph on first use, so importing this module stays cheap.
+    """
+    workflow = StateGraph(AgentState)
 
-workflow.add_node("agent", call_model)
-workflow.add_node("tools", ToolNode(get_all_tools()))
-workflow.add_node("alternative", call_without_tools)
+    workflow.add_node("agent", call_model)
+    workflow.add_node("tools", traced("node.tools")(create_tool_node()))
 
-workflow.add_edge(START, "agent")
-workflow.add_conditional_edges("agent", should_continue, ["tools", "alternative", END])
-workflow.add_edge("tools", "agent")
+    workflow.add_edge(START, "agent")
+    workflow.add_conditional_edges("agent", should_continue, ["tools", END])
+    workflow.add_edge("tools", "agent")
 
-comparison_geo_agent = workflow.compile()
\ No newline at end of file
+    return workflow.compile()
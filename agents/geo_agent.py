@@ -1,17 +1,18 @@
 import configparser
+from functools import lru_cache
 
 from langchain_core.messages import AIMessage, AnyMessage, HumanMessage, SystemMessage
 from langchain_core.runnables import RunnableConfig
 from langgraph.graph import START, END, StateGraph
 from langgraph.graph.message import add_messages
-from langgraph.prebuilt import ToolNode
+from langgraph.graph.state import CompiledStateGraph
 from typing_extensions import Annotated, TypedDict, Optional
-import streamlit as st
 
 from paths import PROJECT_ROOT
-from tools import get_all_tools
 from schemas.geometry import BoundingBox, PointMarker
-from utils.agent_utils import get_chat_history, get_llm
+from utils.agent_utils import create_tool_node, get_chat_history, get_llm_within_deadline
+from utils.instrumentation import get_trace_summary, traced
+from utils.session_store import get_session_store
 
 cfg = configparser.ConfigParser()
 cfg.read(f'{PROJECT_ROOT}/config.ini')
@@ -37,33 +38,37 @@ class AgentState(TypedDict):
     bounding_box: BoundingBox
     hotel_site_marker: PointMarker
 
-llm = get_llm()
-
-llm_with_tools = llm.bind_tools(get_all_tools())
-
 def should_continue(state: AgentState, config: RunnableConfig):
     msgs = state["messages"]
     last_message = msgs[-1]
     if last_message.tool_calls:
         return "tools"
 
-    get_chat_history().add_messages(msgs)
+    # Attributes are set before the messages are persisted
     last_message.run_id = config["configurable"]["run_id"]
+    last_message.timings = get_trace_summary()
+    get_chat_history(get_session_store(config)).add_messages(msgs)
     return END
 
+@traced("node.agent")
 def call_model(state: AgentState, config: RunnableConfig):
-    chat_history = get_chat_history()
+    chat_history = get_chat_history(get_session_store(config))
     msgs = [SystemMessage(content=SYSTEM_MESSAGE)] + list(chat_history.messages) + state["messages"]
-    response = llm_with_tools.invoke(msgs)
+    response = get_llm_within_deadline(config).invoke(msgs)
     return {"messages": [response]}
 
-workflow = StateGraph(AgentState)
+@lru_cache(maxsize=1)
+def get_geo_agent() -> CompiledStateGraph:
+    """
+    Builds and compiles the agent graph on first use, so importing this module stays cheap.
+    """
+    workflow = StateGraph(AgentState)
 
-workflow.add_node("agent", call_model)
-workflow.add_node("tools", ToolNode(get_all_tools()))
+    workflow.add_node("agent", call_model)
+    workflow.add_node("tools", traced("node.tools")(create_tool_node()))
 
-workflow.add_edge(START, "agent")
-workflow.add_conditional_edges("agent", should_continue, ["tools", END])
-workflow.add_edge("tools", "agent")
+    workflow.add_edge(START, "agent")
+    workflow.add_conditional_edges("agent", should_continue, ["tools", END])
+    workflow.add_edge("tools", "agent")
 
-geo_agent = workflow.compile()
\ No newline at end of file
+    return workflow.compile()
@@ -1,4 +1,5 @@
 import configparser
+import logging
 import time
 import uuid
 
@@ -9,22 +10,33 @@ from langgraph.graph.state import CompiledStateGraph
 import streamlit as st
 from streamlit_folium import st_folium
 
-from agents.geo_agent import geo_agent
-from agents.comparison_geo_agent import comparison_geo_agent
+from agents.comparison_geo_agent import alternative_pending, get_comparison_geo_agent
 from visualizations.drawmap import DrawMap
 from paths import PROJECT_ROOT
 from utils.streamlit_utils import *
 from schemas.geometry import BoundingBox, PointMarker
 from utils.agent_utils import clear_chat_history
+from utils.deadline import new_deadline
+from utils.instrumentation import start_metrics_server, trace
+from utils.place_index import get_place_index
+from utils.warmup import get_warmup, start_warmup
 
 load_dotenv()
 cfg = configparser.ConfigParser()
 cfg.read(f'{PROJECT_ROOT}/config.ini')
+start_metrics_server(cfg.getint('INSTRUMENTATION', 'metrics_port', fallback=0))
+# Runs once per server process, models and indexes are loaded in the background
+start_warmup()
+
+logger = logging.getLogger(__name__)
 
 if "inputs_disabled" not in st.session_state:
     st.session_state["inputs_disabled"] = False
-if "all_messages" not in st.session_state:
-    st.session_state["all_messages"] = {}
+if "session_id" not in st.session_state:
+    # The chat history is persisted under the session id kept in the URL, so it survives page reloads and restarts
+    if "session" not in st.query_params:
+        st.query_params["session"] = uuid.uuid4().hex
+    st.session_state["session_id"] = st.query_params["session"]
 
 st.set_page_config(
     page_title="PoliRuralPlus Chat Assistant",
@@ -36,6 +48,31 @@ st.set_page_config(
 def disable_inputs():
     st.session_state["inputs_disabled"] = True
 
+def find_place(prompt):
+    """Municipality named in the prompt, None also while the warmup is still building the place index or if it failed."""
+    if get_warmup().status.get("place_index", {}).get("state") not in ("done", "skipped"):
+        return None
+    try:
+        return get_place_index().find_in_text(prompt)
+    except Exception as e:
+        logger.warning("Place lookup failed: %s", e)
+        return None
+
+def show_pending_alternative():
+    """Polls for the alternative response of the last answer, the app reruns to show the A/B comparison once it is attached."""
+    run_id = st.session_state.get("pending_alternative")
+    if run_id is None:
+        return
+
+    @st.fragment(run_every=1)
+    def poll():
+        if alternative_pending(run_id):
+            st.caption("Preparing another answer for comparison...")
+            return
+        del st.session_state["pending_alternative"]
+        st.rerun()
+    poll()
+
 def show_login_form():
     st.title("Login")
 
@@ -59,6 +96,7 @@ def show_chat_app():
     st.title("🌿 PoliRuralPlus Chat Assistant")
 
     with st.sidebar:
+        show_warmup_status()
         st.subheader("Chat management")
         
         tools_on = st.toggle(label="Show tool calls details", disabled=st.session_state["inputs_disabled"])
@@ -93,13 +131,20 @@ def show_chat_app():
         add_pill_to_chat_input(selected)
 
     write_conversation()
+    show_pending_alternative()
     if prompt := st.chat_input(placeholder="Ask me anything...", disabled=st.session_state["inputs_disabled"], on_submit=disable_inputs):
-        if st.session_state["selected_area_wkt"] is None:
-            st.toast("Please draw a rectangle on the map to select the area of interest.", icon="🗺️")
+        # Without a drawn rectangle, a place mentioned in the question selects the area
+        place = find_place(prompt) if st.session_state["selected_area_wkt"] is None else None
+        if st.session_state["selected_area_wkt"] is None and place is None:
+            st.toast("Please draw a rectangle on the map or name a municipality to select the area of interest.", icon="🗺️")
             st.toast("You must have one area of interest selected at a time.", icon="🗺️")
             time.sleep(2)
         else:
-            bbox = BoundingBox(wkt=st.session_state["selected_area_wkt"])
+            if place is not None:
+                bbox = place.bounding_box
+                st.toast(f"Using the area of {place.name}.", icon="🗺️")
+            else:
+                bbox = BoundingBox(wkt=st.session_state["selected_area_wkt"])
             hotel_site_marker = PointMarker(wkt=st.session_state["hotel_site_wkt"]) if st.session_state["hotel_site_wkt"] else None
             
             run_id = uuid.uuid4() # For langsmith
@@ -107,6 +152,7 @@ def show_chat_app():
                 "run_id": run_id,
                 "configurable": {
                     "run_id": run_id, # Used for feedback, accessible from graph nodes
+                    "deadline": new_deadline(), # Time budget of the question, applies to all tools and fetches
                 },
                 "metadata": {
                     "bounding_box_wkt": bbox.wkt,
@@ -120,8 +166,8 @@ def show_chat_app():
                 "hotel_site_marker": hotel_site_marker,
             }
 
-            agent: CompiledStateGraph = comparison_geo_agent
-            with st.spinner("Give me a second, I am thinking..."):
+            agent: CompiledStateGraph = get_comparison_geo_agent()
+            with st.spinner("Give me a second, I am thinking..."), trace(run_id):
                 last_message_id = 0
                 for chunk in agent.stream(
                     input=input,
@@ -132,7 +178,11 @@ def show_chat_app():
                         message = chunk["messages"][i]
                         write_message(message)
                     last_message_id = len(chunk["messages"])
-                
+
+            # The answer is already shown, the A/B comparison replaces it once the alternative is attached
+            if chunk.get("alternative_sampled"):
+                st.session_state["pending_alternative"] = str(run_id)
+
         st.session_state["inputs_disabled"] = False
         st.rerun()
 
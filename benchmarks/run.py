@@ -0,0 +1,191 @@
+"""
+Micro-benchmarks of the raster and forecast processing hot paths on synthetic inputs.
+
+Usage:
+    python -m benchmarks.run                                  # run and print results
+    python -m benchmarks.run --save benchmarks/baselines/baseline.json
+    python -m benchmarks.run --compare benchmarks/baselines/baseline.json --threshold 1.25
+    python -m benchmarks.run -k color_counts --repeat 10
+
+In comparison mode the exit code is 1 when any benchmark is slower than `threshold` x its baseline median.
+"""
+import argparse
+import json
+import platform
+import statistics
+import sys
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable
+
+import numpy as np
+from shapely.geometry import box
+
+from benchmarks import synthetic
+from schemas.geometry import BoundingBox, PointMarker
+from tools.openmeteo_tool import aggregate_daily_responses, aggregate_hourly_responses
+from utils import instrumentation
+from utils.cpu_pool import set_offload_enabled
+from utils.tool_utils import (
+    ELEVATION_EDGES,
+    LU_PALETTE,
+    classify_pixels,
+    count_unique_colors,
+    find_region_tourism_data,
+    find_square_for_marker,
+    get_strip_rows,
+    merge_color_counts,
+    reduce_elevation_strip,
+    sum_population_strips,
+)
+
+DEFAULT_BASELINE = "benchmarks/baselines/baseline.json"
+
+@dataclass
+class Benchmark:
+    name: str
+    sizes: list[int]
+    setup: Callable[[int], tuple]
+    func: Callable[..., Any]
+
+    def case_name(self, size: int) -> str:
+        return f"{self.name}[{size}]"
+
+def _tourism_setup(n):
+    gdf, df = synthetic.tourism_regions(n)
+    # Small area in the middle of the grid
+    center = 12.0 + n * 0.05 / 2, 48.5 + n * 0.05 / 2
+    bbox = BoundingBox(wkt=box(center[0], center[1], center[0] + 0.02, center[1] + 0.02).wkt)
+    return bbox, gdf, df
+
+def _hotel_setup(n):
+    squares = synthetic.hotel_squares(n)
+    # Marker in the last square is the worst case of the linear scan
+    marker = PointMarker(wkt=f"POINT ({12.0 + (n - 0.5) * 0.05} {48.5 + (n - 0.5) * 0.05})")
+    return squares, marker
+
+def _merge_setup(n):
+    # Counts of two halves of a raster, as merged between strips
+    pixels = np.asarray(synthetic.olu_raster(n).convert("RGB"))
+    return (*count_unique_colors(pixels[:n // 2]), *count_unique_colors(pixels[n // 2:]))
+
+def _population_setup(n):
+    # Strips as yielded by `iter_map_strips` for the GeoTIFF population grid
+    raster = np.asarray(synthetic.population_raster(n))
+    rows = get_strip_rows("EUROSTAT_2021", n)
+    return ([raster[top:top + rows] for top in range(0, n, rows)],)
+
+BENCHMARKS = [
+    Benchmark("count_unique_colors_lu", [256, 1024, 1500], lambda n: (np.asarray(synthetic.olu_raster(n).convert("RGB")),), count_unique_colors),
+    Benchmark("count_unique_colors_lc", [256, 1024, 1500], lambda n: (np.asarray(synthetic.lc_raster(n).convert("RGB")),), count_unique_colors),
+    Benchmark("merge_color_counts", [256, 1024, 1500], _merge_setup, merge_color_counts),
+    Benchmark("classify_pixels", [256, 1024, 1500], lambda n: (np.asarray(synthetic.olu_raster(n).convert("RGB")), LU_PALETTE), classify_pixels),
+    Benchmark("reduce_elevation_strip", [256, 1024, 1500], lambda n: (synthetic.dem_grid(n), ELEVATION_EDGES), reduce_elevation_strip),
+    Benchmark("sum_population_strips", [256, 1024, 1500], _population_setup, sum_population_strips),
+    Benchmark("aggregate_hourly_responses", [1, 7, 16], lambda n: (synthetic.openmeteo_hourly_responses(n),), aggregate_hourly_responses),
+    Benchmark("aggregate_daily_responses", [1, 7, 16], lambda n: (synthetic.openmeteo_daily_responses(n),), aggregate_daily_responses),
+    Benchmark("find_square_for_marker", [10, 50, 100], _hotel_setup, find_square_for_marker),
+    Benchmark("find_region_tourism_data", [10, 40, 80], _tourism_setup, find_region_tourism_data),
+]
+
+def time_case(func, args, repeat: int, min_time: float) -> dict:
+    """
+    Times `func(*args)`, looping each sample until it takes at least `min_time` seconds.
+    Returns per-call timings in seconds.
+    """
+    func(*args)  # warmup
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            func(*args)
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or loops >= 1_000_000:
+            break
+        loops *= 2 if elapsed == 0 else max(2, min(10, int(min_time / elapsed) + 1))
+
+    samples = [elapsed / loops]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(loops):
+            func(*args)
+        samples.append((time.perf_counter() - start) / loops)
+    return {
+        "median_s": statistics.median(samples),
+        "min_s": min(samples),
+        "stdev_s": statistics.stdev(samples) if len(samples) > 1 else 0.0,
+        "repeat": repeat,
+        "loops": loops,
+    }
+
+def run_benchmarks(pattern: str | None, repeat: int, min_time: float) -> dict:
+    results = {}
+    for bench in BENCHMARKS:
+        if pattern and pattern not in bench.name:
+            continue
+        for size in bench.sizes:
+            args = bench.setup(size)
+            results[bench.case_name(size)] = time_case(bench.func, args, repeat, min_time)
+            print(f"{bench.case_name(size):<40} {results[bench.case_name(size)]['median_s'] * 1000:>12.3f} ms")
+    return results
+
+def environment() -> dict:
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+    }
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """Returns names of benchmarks whose median is more than `threshold` x the baseline median."""
+    regressions = []
+    print(f"\n{'benchmark':<40} {'baseline [ms]':>14} {'current [ms]':>14} {'ratio':>8}")
+    for name, result in results.items():
+        base = baseline["results"].get(name)
+        if base is None:
+            print(f"{name:<40} {'-':>14} {result['median_s'] * 1000:>14.3f} {'new':>8}")
+            continue
+        ratio = result["median_s"] / base["median_s"] if base["median_s"] > 0 else float("inf")
+        flag = "  REGRESSION" if ratio > threshold else ""
+        print(f"{name:<40} {base['median_s'] * 1000:>14.3f} {result['median_s'] * 1000:>14.3f} {ratio:>8.2f}{flag}")
+        if ratio > threshold:
+            regressions.append(name)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks of the raster and forecast processing hot paths.")
+    parser.add_argument("-k", dest="pattern", help="Run only benchmarks whose name contains this string")
+    parser.add_argument("--repeat", type=int, default=5, help="Number of timing samples per case")
+    parser.add_argument("--min-time", type=float, default=0.2, help="Minimum duration of one sample in seconds")
+    parser.add_argument("--save", nargs="?", const=DEFAULT_BASELINE, help="Store results as a JSON baseline")
+    parser.add_argument("--compare", nargs="?", const=DEFAULT_BASELINE, help="Compare results with a JSON baseline")
+    parser.add_argument("--threshold", type=float, default=1.25, help="Slowdown ratio reported as a regression")
+    args = parser.parse_args()
+
+    instrumentation.set_enabled(False)
+    # Time the reductions themselves, not the pickling to pool workers
+    set_offload_enabled(False)
+    results = run_benchmarks(args.pattern, args.repeat, args.min_time)
+    report = {"environment": environment(), "results": results}
+
+    if args.save:
+        Path(args.save).parent.mkdir(parents=True, exist_ok=True)
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nBaseline saved to {args.save}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) over {args.threshold}x: {', '.join(regressions)}")
+            sys.exit(1)
+        print("\nNo regressions.")
+
+if __name__ == "__main__":
+    main()
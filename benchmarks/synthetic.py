@@ -0,0 +1,120 @@
+"""
+Deterministic synthetic inputs for the benchmarks. Every generator takes a size and a seed,
+so the same inputs are produced on every run and machine.
+"""
+import json
+
+import numpy as np
+from PIL import Image
+
+from utils.map_service_utils import LC_rgb_mapping, LU_rgb_mapping, elevation_ranges
+
+def olu_raster(size: int, rgb_mapping: dict = LU_rgb_mapping, noise_ratio: float = 0.02, seed: int = 0) -> Image.Image:
+    """
+    RGB raster of blocky palette zones, with a small share of off-palette pixels
+    like the anti-aliased edges returned by the WMS.
+    """
+    rng = np.random.default_rng(seed)
+    palette = np.array(sorted(set(rgb_mapping.values())), dtype=np.uint8)
+    block = max(1, size // 32)
+    n_blocks = -(-size // block)
+    zones = rng.integers(0, len(palette), size=(n_blocks, n_blocks))
+    pixels = palette[np.kron(zones, np.ones((block, block), dtype=int))[:size, :size]]
+
+    noise = rng.random((size, size)) < noise_ratio
+    pixels[noise] = rng.integers(0, 256, size=(noise.sum(), 3), dtype=np.uint8)
+    return Image.fromarray(pixels, mode="RGB")
+
+def lc_raster(size: int, seed: int = 0) -> Image.Image:
+    return olu_raster(size, LC_rgb_mapping, seed=seed)
+
+def dem_grid(size: int, seed: int = 0) -> np.ndarray:
+    """Smooth float32 elevation surface spanning the lowland to mountain zones."""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:size, 0:size] / max(size - 1, 1)
+    surface = 200 + 900 * np.sin(3 * x) * np.cos(2 * y) ** 2 + 60 * rng.standard_normal((size, size))
+    return np.clip(surface, 0, elevation_ranges[-1][0] - 1).astype(np.float32)
+
+def population_raster(size: int, cell: int = 8, seed: int = 0) -> Image.Image:
+    """Float raster where every population grid cell is repeated over `cell` x `cell` pixels."""
+    rng = np.random.default_rng(seed)
+    n_cells = -(-size // cell)
+    cells = rng.gamma(1.5, 200, size=(n_cells, n_cells)).round().astype(np.float32)
+    return Image.fromarray(np.kron(cells, np.ones((cell, cell), dtype=np.float32))[:size, :size], mode="F")
+
+
+class _Variable:
+    def __init__(self, values):
+        self._values = values
+
+    def ValuesAsNumpy(self):
+        return self._values
+
+
+class _VariablesWithTime:
+    def __init__(self, values: np.ndarray, start: int, interval: int):
+        self._values = values
+        self._start = start
+        self._interval = interval
+
+    def Variables(self, i):
+        return _Variable(self._values[i])
+
+    def Time(self):
+        return self._start
+
+    def TimeEnd(self):
+        return self._start + self._values.shape[1] * self._interval
+
+    def Interval(self):
+        return self._interval
+
+
+class FakeOpenmeteoResponse:
+    """Mimics the parts of the openmeteo_requests response API used by the forecast aggregation."""
+    def __init__(self, n_variables: int, n_steps: int, interval: int, rng: np.random.Generator, start: int = 1_735_689_600):
+        self._data = _VariablesWithTime(rng.random((n_variables, n_steps), dtype=np.float32) * 30, start, interval)
+
+    def Hourly(self):
+        return self._data
+
+    def Daily(self):
+        return self._data
+
+def openmeteo_hourly_responses(forecast_days: int, n_points: int = 16, seed: int = 0) -> list[FakeOpenmeteoResponse]:
+    rng = np.random.default_rng(seed)
+    return [FakeOpenmeteoResponse(9, 24 * forecast_days, 3600, rng) for _ in range(n_points)]
+
+def openmeteo_daily_responses(forecast_days: int, n_points: int = 16, seed: int = 0) -> list[FakeOpenmeteoResponse]:
+    rng = np.random.default_rng(seed)
+    return [FakeOpenmeteoResponse(10, forecast_days, 86400, rng) for _ in range(n_points)]
+
+def hotel_squares(n: int, lat0: float = 48.5, lon0: float = 12.0, step: float = 0.05) -> list[str]:
+    """`n` x `n` grid of squares in the `lat1_lon1_lat2_lon2` index format of the hotel features."""
+    return [
+        f"{lat0 + i * step:.4f}_{lon0 + j * step:.4f}_{lat0 + (i + 1) * step:.4f}_{lon0 + (j + 1) * step:.4f}"
+        for i in range(n) for j in range(n)
+    ]
+
+def tourism_regions(n: int, seed: int = 0, lat0: float = 48.5, lon0: float = 12.0, step: float = 0.05):
+    """
+    Grid of `n` x `n` regions with visitor statistics, plus the matching municipality codelist.
+    """
+    import geopandas as gpd
+    import pandas as pd
+    from shapely.geometry import box
+
+    rng = np.random.default_rng(seed)
+    records = []
+    for i in range(n):
+        for j in range(n):
+            fid = 500000 + i * n + j
+            props = {str(year): {"all_guests": str(int(rng.integers(0, 50_000)))} for year in range(2012, 2024)}
+            records.append({
+                "fid": fid,
+                "properties": json.dumps(props),
+                "geometry": box(lon0 + j * step, lat0 + i * step, lon0 + (j + 1) * step, lat0 + (i + 1) * step),
+            })
+    gdf = gpd.GeoDataFrame(records, crs="EPSG:4326")
+    df = pd.DataFrame({"text": [f"Obec {r['fid']}" for r in records]}, index=pd.Index([int(r["fid"]) for r in records], name="chodnota"))
+    return gdf, df
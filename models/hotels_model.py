@@ -1,14 +1,16 @@
 import os
 
-from catboost import CatBoostRegressor
 import pandas as pd
-from sklearn.model_selection import train_test_split
-from sklearn.metrics import mean_squared_error, mean_absolute_error, r2_score
 import streamlit as st
 
 from paths import DATA_DIR, SAVED_MODELS_DIR
 
 def train_hotels_model(data, test_size=0.2, rd_seed=42, iters=5000, lr=0.01, depth=5, eval=False):
+    # Heavy dependencies are imported only when the model is actually trained
+    from catboost import CatBoostRegressor
+    from sklearn.model_selection import train_test_split
+    from sklearn.metrics import mean_squared_error, mean_absolute_error, r2_score
+
     # Prepare data
     X = data.drop(columns=['lodging'])
     y = data['lodging']
@@ -62,6 +64,8 @@ def train_hotels_model(data, test_size=0.2, rd_seed=42, iters=5000, lr=0.01, dep
 
 @st.cache_resource
 def load_model():
+    from catboost import CatBoostRegressor
+
     if not os.path.exists(f"{SAVED_MODELS_DIR}/hotels_cbm"):
         hotels_data = pd.read_csv(f"{DATA_DIR}/hotels.csv", index_col=0)
         model = train_hotels_model(hotels_data)
@@ -5,4 +5,4 @@ DATA_DIR = PROJECT_ROOT / 'data'
 SAVED_MODELS_DIR = PROJECT_ROOT / 'saved_models'
 RESOURCES_DIR = PROJECT_ROOT / 'resources'
 ASSETS_DIR = PROJECT_ROOT / 'assets'
-
+LOGS_DIR = PROJECT_ROOT / 'logs'
@@ -1,7 +1,6 @@
 from pydantic import BaseModel, field_validator
 
-import geopandas as gpd
-from shapely.geometry import Polygon, Point
+from shapely.geometry import Polygon, Point, box
 from shapely.errors import WKTReadingError
 from shapely.wkt import loads
 
@@ -20,6 +19,11 @@ class BoundingBox(BaseModel):
         except WKTReadingError:
             raise ValueError("Invalid WKT string")
 
+    @classmethod
+    def from_bounds(cls, minx: float, miny: float, maxx: float, maxy: float) -> "BoundingBox":
+        """Creates a rectangular bounding box from bounds in (minx, miny, maxx, maxy) order"""
+        return cls(wkt=box(minx, miny, maxx, maxy).wkt)
+
     @property
     def geom(self) -> Polygon:
         return loads(self.wkt)        
@@ -31,6 +35,8 @@ class BoundingBox(BaseModel):
     @property
     def area(self) -> float:
         """Calculate the area of the bounding box in km^2 using most appropriate UTM CRS"""
+        import geopandas as gpd
+
         gdf = gpd.GeoDataFrame({"geometry": [self.geom]}, crs="EPSG:4326")
         utm_crs = gdf.estimate_utm_crs()
         gdf = gdf.to_crs(utm_crs)
@@ -0,0 +1,106 @@
+"""
+Builds the municipality summary table used to answer bounding boxes matching a single municipality.
+
+For every municipality geometry of data/visitors.geojson, the statistics the tools compute for its
+envelope (land use and land cover pixel counts, elevation stats and zones, population) and the latest
+tourism totals are computed in a process pool and written to a parquet file, one row per municipality.
+
+Usage:
+    python -m scripts.build_municipality_table --workers 8
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from utils.map_service_utils import LC_rgb_mapping, LU_rgb_mapping, elevation_ranges
+from utils.cpu_pool import set_offload_enabled
+from utils.municipality_table import MUNICIPALITY_TABLE_PATH, color_column, set_enabled
+
+def summarize_municipality(code: int, name: str, bounds: tuple, properties: str) -> dict:
+    # Runs in a worker process, the tool helpers are imported there
+    from schemas.geometry import BoundingBox
+    from utils.tool_utils import get_elevation_stats, get_land_counts, get_population
+
+    bounding_box = BoundingBox.from_bounds(*bounds)
+    row = {"code": code, "name": name, "minx": bounds[0], "miny": bounds[1], "maxx": bounds[2], "maxy": bounds[3]}
+
+    for prefix, alt_params, rgb_mapping in [("lu", {}, LU_rgb_mapping), ("lc", {"layers": "olu_obj_lc"}, LC_rgb_mapping)]:
+        rgb_counts, n_pixels = get_land_counts(bounding_box, "OLU_EU", alt_params, rgb_mapping)
+        row[f"{prefix}_n_pixels"] = n_pixels
+        row.update({color_column(prefix, rgb): count for rgb, count in rgb_counts})
+
+    stats = get_elevation_stats(bounding_box)
+    row.update({
+        "elevation_mean": float(stats["mean"]),
+        "elevation_min": float(stats["min"]),
+        "elevation_max": float(stats["max"]),
+        "elevation_n_pixels": stats["n_pixels"],
+    })
+    row.update({f"zone_{i}": stats["zone_counts"][name] for i, (_, _, name) in enumerate(elevation_ranges)})
+
+    row["population"] = get_population(bounding_box)
+
+    guests = {
+        int(year): int(float(values["all_guests"]))
+        for year, values in json.loads(properties).items()
+        if _is_number(values.get("all_guests"))
+    }
+    row["tourism_year"] = max(guests) if guests else None
+    row["tourism_guests"] = guests[max(guests)] if guests else None
+    return row
+
+def _is_number(value) -> bool:
+    try:
+        float(value)
+        return True
+    except (TypeError, ValueError):
+        return False
+
+def init_worker():
+    # Workers must compute from rasters, not answer from the table being replaced. They already run
+    # one per core, so they reduce rasters inline instead of each starting its own process pool.
+    set_enabled(False)
+    set_offload_enabled(False)
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute tool statistics for every municipality.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Worker processes")
+    parser.add_argument("--limit", type=int, help="Only the first N municipalities, for testing")
+    parser.add_argument("-o", "--output", default=str(MUNICIPALITY_TABLE_PATH))
+    args = parser.parse_args()
+
+    from utils.tool_utils import load_tourism_data
+
+    gdf, df = load_tourism_data()
+    gdf = gdf.iloc[:args.limit] if args.limit else gdf
+    jobs = [
+        (int(region.fid), str(df.loc[int(region.fid)].text) if int(region.fid) in df.index else "", region.geometry.bounds, region.properties)
+        for region in gdf.itertuples()
+    ]
+
+    start = time.perf_counter()
+    rows, failed = [], 0
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker) as executor:
+        futures = {executor.submit(summarize_municipality, *job): job[0] for job in jobs}
+        for i, future in enumerate(as_completed(futures), start=1):
+            try:
+                rows.append(future.result())
+            except Exception as e:
+                failed += 1
+                print(f"\nMunicipality {futures[future]} failed: {e}")
+            print(f"\r{i}/{len(jobs)} municipalities", end="", flush=True)
+    print()
+
+    # Colors missing in a municipality have no pixels
+    table = pd.DataFrame(rows).sort_values("code").reset_index(drop=True)
+    count_columns = [c for c in table.columns if c.startswith(("lu_", "lc_", "zone_"))]
+    table[count_columns] = table[count_columns].fillna(0).astype("int64")
+    table.to_parquet(args.output, index=False)
+    print(f"{len(table)} municipalities ({failed} failed) in {time.perf_counter() - start:.1f} s -> {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Builds the local memory-mapped raster store used by `get_map` for static layers.
+
+Every layer is downloaded from the WMS in tile aligned blocks over the configured region
+(or imported from a raster file already on disk), written into a tiled memmap and
+completed with 2x overviews. Areas outside of the region keep using the WMS.
+
+Usage:
+    python -m scripts.ingest_rasters --region czechia --layers land_use land_cover dem population
+    python -m scripts.ingest_rasters --layers dem --from-file dem.tif --bounds 12.09,48.55,18.87,51.06
+"""
+import argparse
+import math
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from schemas.geometry import BoundingBox
+from utils.map_service_utils import LC_rgb_mapping, LU_rgb_mapping, map_config
+from utils.raster_store import RasterLayer, cfg, get_store_root, layer_key
+from utils.tool_utils import ELEVATION_EDGES, get_wms_map
+
+# Layer name -> (endpoint, alt_params, pixel size in degrees)
+STATIC_LAYERS = {
+    "land_use": ("OLU_EU", {"layers": "olu_obj_lu"}, 0.0002),
+    "land_cover": ("OLU_EU", {"layers": "olu_obj_lc"}, 0.0002),
+    "dem": ("DEM_MASL", {}, 0.0005),
+    "population": ("EUROSTAT_2021", {"layers": "total_population_eurostat_griddata_2021"}, 0.002),
+}
+for _endpoint, _name in [
+    ("climate_era5_temperature_last_5yrs_month_avg", "temperature_era5"),
+    ("climate_ipcc_rcp45_temperature_2050s_month_avg", "temperature_2050s"),
+]:
+    for _time in map_config[_endpoint]["alternatives"]["TIME"]:
+        STATIC_LAYERS[f"{_name}_{_time[4:6]}"] = (_endpoint, {"TIME": _time}, 0.005)
+
+# Class layers get per-tile histograms of their palette
+CLASS_MAPPINGS = {"land_use": LU_rgb_mapping, "land_cover": LC_rgb_mapping}
+
+# Continuous layers get summed area tables, with the grid cell area for per-cell totals
+SUMMED_AREA_LAYERS = {"dem": None, "population": 1.0}
+SUMMED_AREA_LAYERS.update({name: None for name in STATIC_LAYERS if name.startswith("temperature_")})
+
+# The DEM gets per-tile histograms of the elevation zones and tile ranges
+VALUE_HISTOGRAM_LAYERS = {"dem": ELEVATION_EDGES}
+
+DEFAULT_LAYERS = ["land_use", "land_cover", "dem", "population"]
+
+def parse_bounds(value: str) -> tuple[float, float, float, float]:
+    minx, miny, maxx, maxy = map(float, value.split(","))
+    return minx, miny, maxx, maxy
+
+def create_layer(name: str, bounds, pixel_size: float, tile_size: int) -> RasterLayer:
+    endpoint, alt_params, _ = STATIC_LAYERS[name]
+    minx, miny, maxx, maxy = bounds
+    shape = (math.ceil((maxy - miny) / pixel_size - 1e-6), math.ceil((maxx - minx) / pixel_size - 1e-6))
+    # Snap the bounds to whole pixels
+    bounds = (minx, maxy - shape[0] * pixel_size, minx + shape[1] * pixel_size, maxy)
+    is_rgb = map_config[endpoint]["data"]["format"] == "png"
+    path = get_store_root() / layer_key(endpoint, alt_params)
+    if path.exists():
+        shutil.rmtree(path)
+    return RasterLayer.create(
+        path, endpoint, alt_params, bounds, shape,
+        bands=3 if is_rgb else 1, dtype="uint8" if is_rgb else "float32", tile_size=tile_size,
+    )
+
+def to_array(image: Image.Image, bands: int, dtype: str) -> np.ndarray:
+    if bands == 3:
+        return np.asarray(image.convert("RGB"))
+    return np.asarray(image, dtype=dtype)[..., np.newaxis]
+
+def download_layer(layer: RasterLayer, block_tiles: int, workers: int):
+    """Fills level 0 block by block, blocks are aligned to whole tiles so writes never overlap."""
+    endpoint, alt_params = layer.meta["endpoint"], layer.meta["alt_params"]
+    height, width = layer.shape(0)
+    px, py = layer.pixel_size(0)
+    minx, _, _, maxy = layer.bounds
+    block = block_tiles * layer.tile_size
+
+    def fetch(offset):
+        r0, c0 = offset
+        rows, cols = min(block, height - r0), min(block, width - c0)
+        bbox = BoundingBox.from_bounds(minx + c0 * px, maxy - (r0 + rows) * py, minx + (c0 + cols) * px, maxy - r0 * py)
+        image = get_wms_map(bbox, endpoint, alt_params, width=cols, height=rows)
+        layer.write_window(r0, c0, to_array(image, layer.meta["bands"], layer.meta["dtype"]))
+
+    offsets = [(r0, c0) for r0 in range(0, height, block) for c0 in range(0, width, block)]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for i, _ in enumerate(executor.map(fetch, offsets), start=1):
+            print(f"\r  {i}/{len(offsets)} blocks", end="", flush=True)
+    print()
+
+def import_layer(layer: RasterLayer, path: str):
+    """Imports a raster file that exactly covers the layer bounds, resampled to the layer resolution."""
+    height, width = layer.shape(0)
+    image = Image.open(path)
+    if image.size != (width, height):
+        image = image.resize((width, height), Image.Resampling.NEAREST)
+    layer.write_window(0, 0, to_array(image, layer.meta["bands"], layer.meta["dtype"]))
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest static WMS layers into the local raster store.")
+    parser.add_argument("--layers", nargs="+", default=DEFAULT_LAYERS, choices=[*STATIC_LAYERS, "all"])
+    parser.add_argument("--region", default="czechia", help="Region from the RASTER_STORE config section")
+    parser.add_argument("--bounds", type=parse_bounds, help="minx,miny,maxx,maxy overriding the region")
+    parser.add_argument("--pixel-size", type=float, help="Pixel size in degrees overriding the layer default")
+    parser.add_argument("--from-file", help="Import a raster file covering the bounds instead of downloading")
+    parser.add_argument("--block-tiles", type=int, default=3, help="Tiles per side of one GetMap request")
+    parser.add_argument("--workers", type=int, default=4, help="Concurrent GetMap requests")
+    args = parser.parse_args()
+
+    layers = list(STATIC_LAYERS) if "all" in args.layers else args.layers
+    if args.from_file and len(layers) != 1:
+        parser.error("--from-file imports exactly one layer")
+    bounds = args.bounds or parse_bounds(cfg.get('RASTER_STORE', f'region_{args.region}'))
+    tile_size = cfg.getint('RASTER_STORE', 'tile_size', fallback=512)
+
+    for name in layers:
+        start = time.perf_counter()
+        pixel_size = args.pixel_size or STATIC_LAYERS[name][2]
+        layer = create_layer(name, bounds, pixel_size, tile_size)
+        print(f"{name}: {layer.shape(0)[1]}x{layer.shape(0)[0]} px -> {layer.path}")
+        if args.from_file:
+            import_layer(layer, args.from_file)
+        else:
+            download_layer(layer, args.block_tiles, args.workers)
+        layer.build_overviews()
+        if name in SUMMED_AREA_LAYERS:
+            layer.build_summed_area_table(SUMMED_AREA_LAYERS[name])
+        if name in CLASS_MAPPINGS:
+            layer.build_class_histograms(np.array(sorted(set(CLASS_MAPPINGS[name].values())), dtype=np.uint8))
+        if name in VALUE_HISTOGRAM_LAYERS:
+            layer.build_value_histograms(VALUE_HISTOGRAM_LAYERS[name])
+        print(f"  {len(layer.levels)} levels in {time.perf_counter() - start:.1f} s")
+
+if __name__ == "__main__":
+    main()
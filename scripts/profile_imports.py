@@ -0,0 +1,79 @@
+"""
+Import-time report for the app modules.
+
+Runs every target module in a fresh interpreter with `-X importtime` and prints
+per-module self and cumulative import times in milliseconds.
+
+Usage:
+    python -m scripts.profile_imports
+    python -m scripts.profile_imports tools agents.geo_agent --top 30 --json import_times.json
+"""
+import argparse
+import json
+import subprocess
+import sys
+
+from paths import PROJECT_ROOT
+
+DEFAULT_TARGETS = [
+    "agents.comparison_geo_agent",
+    "agents.geo_agent",
+    "tools",
+    "utils.streamlit_utils",
+    "visualizations.drawmap",
+]
+
+def profile_module(module: str) -> list[dict]:
+    """
+    Imports the module in a subprocess and parses the `-X importtime` output.
+    Returns a list of {module, self_ms, cumulative_ms, depth} records in import order.
+    """
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=PROJECT_ROOT,
+        capture_output=True,
+        text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{proc.stderr.strip()[-2000:]}")
+
+    records = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        records.append({
+            "module": name.strip(),
+            "self_ms": int(self_us) / 1000,
+            "cumulative_ms": int(cumulative_us) / 1000,
+            "depth": (len(name) - len(name.lstrip())) // 2,
+        })
+    return records
+
+def format_report(module: str, records: list[dict], top: int) -> str:
+    total_ms = sum(r["self_ms"] for r in records)
+    lines = [f"## {module} - {total_ms:.1f} ms total, {len(records)} modules", ""]
+    lines.append(f"{'self [ms]':>10} {'cumulative [ms]':>16}  module")
+    for r in sorted(records, key=lambda r: r["cumulative_ms"], reverse=True)[:top]:
+        lines.append(f"{r['self_ms']:>10.1f} {r['cumulative_ms']:>16.1f}  {r['module']}")
+    return "\n".join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-module import time report.")
+    parser.add_argument("modules", nargs="*", default=DEFAULT_TARGETS, help="Modules to import (default: app entry points)")
+    parser.add_argument("--top", type=int, default=20, help="Number of slowest modules to list per target")
+    parser.add_argument("--json", dest="json_path", help="Write the full per-module report to this JSON file")
+    args = parser.parse_args()
+
+    report = {}
+    for module in args.modules:
+        records = profile_module(module)
+        report[module] = records
+        print(format_report(module, records, args.top), end="\n\n")
+
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
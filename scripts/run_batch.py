@@ -0,0 +1,167 @@
+"""
+Headless batch evaluation of the geo agents.
+
+Cases are read from a JSONL file with one case per line:
+    {"id": "case-1", "question": "...", "bbox_wkt": "POLYGON ((...))", "marker_wkt": "POINT (...)"}
+`id` and `marker_wkt` are optional. A plain text file with one question per line
+(e.g. resources/example_questions.txt) is accepted too, in which case `--bbox-wkt` is used for every case.
+
+Every case runs in its own in-memory session and the results (latency, token usage, timings,
+tool calls, answer) are written to the output JSONL as soon as each case finishes.
+
+Usage:
+    python -m scripts.run_batch cases.jsonl -o results.jsonl --parallel 4 --agent geo
+"""
+import argparse
+import json
+import re
+import statistics
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from dotenv import load_dotenv
+from langchain_core.messages import HumanMessage
+
+from schemas.geometry import BoundingBox, PointMarker
+from utils.deadline import new_deadline
+from utils.instrumentation import trace
+from utils.session_store import InMemorySessionStore
+
+def get_agent(name: str):
+    if name == "geo":
+        from agents.geo_agent import get_geo_agent
+        return get_geo_agent()
+    if name == "comparison":
+        from agents.comparison_geo_agent import get_comparison_geo_agent
+        return get_comparison_geo_agent()
+    raise ValueError(f"Unknown agent: {name}")
+
+def load_cases(path: str, default_bbox_wkt: str | None, default_marker_wkt: str | None) -> list[dict]:
+    cases = []
+    with open(path, encoding="utf-8") as f:
+        for i, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("{"):
+                case = json.loads(line)
+            else:
+                # Plain question list, strip the emoji used by the example pills
+                case = {"question": re.sub(r'^:[a-z_]+: ', '', line)}
+            case.setdefault("id", f"case-{i}")
+            case.setdefault("bbox_wkt", default_bbox_wkt)
+            case.setdefault("marker_wkt", default_marker_wkt)
+            if case["bbox_wkt"] is None:
+                raise ValueError(f"Case {case['id']} has no bounding box, use --bbox-wkt to set a default one.")
+            cases.append(case)
+    return cases
+
+def collect_usage(messages) -> dict:
+    usage = {"input_tokens": 0, "output_tokens": 0, "total_tokens": 0, "llm_calls": 0, "tool_calls": 0, "tool_names": []}
+    for m in messages:
+        if m.type != "ai":
+            continue
+        usage["llm_calls"] += 1
+        for tc in m.tool_calls:
+            usage["tool_calls"] += 1
+            usage["tool_names"].append(tc["name"])
+        token_usage = getattr(m, "usage_metadata", None) or {}
+        for key in ("input_tokens", "output_tokens", "total_tokens"):
+            usage[key] += token_usage.get(key, 0)
+    return usage
+
+def summarize_spans(spans: list[dict]) -> dict:
+    """Total duration per span name, e.g. how much of the case was spent in the LLM or in WMS downloads."""
+    totals = {}
+    for record in spans:
+        totals[record["name"]] = round(totals.get(record["name"], 0) + record["duration_ms"], 1)
+    return totals
+
+def run_case(agent_name: str, case: dict) -> dict:
+    agent = get_agent(agent_name)
+    session = InMemorySessionStore()
+    bbox = BoundingBox(wkt=case["bbox_wkt"])
+    hotel_site_marker = PointMarker(wkt=case["marker_wkt"]) if case.get("marker_wkt") else None
+
+    run_id = uuid.uuid4()
+    config = {
+        "run_id": run_id,
+        "configurable": {
+            "run_id": run_id,
+            "session_store": session,
+            "deadline": new_deadline(),
+        },
+        "metadata": {
+            "bounding_box_wkt": bbox.wkt,
+            "user": "batch",
+            "hotel_site_marker_wkt": hotel_site_marker.wkt if hotel_site_marker else None,
+            "case_id": case["id"],
+        },
+    }
+    input = {
+        "messages": [HumanMessage(content=case["question"])],
+        "bounding_box": bbox,
+        "hotel_site_marker": hotel_site_marker,
+    }
+
+    result = {"id": case["id"], "question": case["question"], "agent": agent_name, "run_id": str(run_id)}
+    start = time.perf_counter()
+    try:
+        with trace(run_id) as spans:
+            state = agent.invoke(input=input, config=config)
+        result["timings_ms"] = summarize_spans(spans)
+        messages = state["messages"]
+        if state.get("alternative_sampled"):
+            from agents.comparison_geo_agent import wait_for_alternative
+            alternative = wait_for_alternative(run_id)
+            if alternative is not None:
+                messages = messages + [alternative]
+        result.update(collect_usage(messages))
+        result["answer"] = state["messages"][-1].content
+        result["error"] = None
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["latency_s"] = round(time.perf_counter() - start, 3)
+    return result
+
+def print_summary(results: list[dict], wall_s: float):
+    latencies = sorted(r["latency_s"] for r in results if r["error"] is None)
+    errors = sum(r["error"] is not None for r in results)
+    print(f"Cases: {len(results)}, errors: {errors}, wall time: {wall_s:.2f} s, throughput: {len(results) / wall_s:.2f} cases/s")
+    if latencies:
+        p95 = latencies[min(len(latencies) - 1, int(round(0.95 * (len(latencies) - 1))))]
+        print(f"Latency [s] - mean: {statistics.mean(latencies):.2f}, p50: {statistics.median(latencies):.2f}, p95: {p95:.2f}, max: {latencies[-1]:.2f}")
+        print(f"Total tokens: {sum(r.get('total_tokens', 0) for r in results)}, tool calls: {sum(r.get('tool_calls', 0) for r in results)}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Run geo agent cases headlessly and report latency, tokens and tool calls.")
+    parser.add_argument("cases", help="JSONL file with cases, or a text file with one question per line")
+    parser.add_argument("-o", "--output", default="batch_results.jsonl", help="Output JSONL file")
+    parser.add_argument("-p", "--parallel", type=int, default=4, help="Number of cases executed concurrently")
+    parser.add_argument("--agent", choices=["geo", "comparison"], default="geo")
+    parser.add_argument("--bbox-wkt", help="Default bounding box WKT for cases without one")
+    parser.add_argument("--marker-wkt", help="Default hotel site marker WKT for cases without one")
+    args = parser.parse_args()
+
+    load_dotenv()
+    cases = load_cases(args.cases, args.bbox_wkt, args.marker_wkt)
+    # Compile the graph before the workers start
+    get_agent(args.agent)
+
+    results = []
+    start = time.perf_counter()
+    with open(args.output, "w", encoding="utf-8") as out, ThreadPoolExecutor(max_workers=args.parallel) as pool:
+        futures = [pool.submit(run_case, args.agent, case) for case in cases]
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            out.write(json.dumps(result, ensure_ascii=False) + "\n")
+            out.flush()
+            status = "ERROR " + result["error"] if result["error"] else "ok"
+            print(f"[{len(results)}/{len(cases)}] {result['id']} {result['latency_s']:.2f} s {status}")
+
+    print_summary(results, time.perf_counter() - start)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,273 @@
+"""
+Local stand-in for the WMS/WFS mapservers and the Open-Meteo forecast API, for offline and load testing.
+
+Routes:
+    /olu/cgi-bin/mapserv   olu.lesprojekt.cz  (GetMap)
+    /gis/cgi-bin/mapserv   gis.lesprojekt.cz  (GetMap, GetFeature)
+    /v1/forecast           api.open-meteo.com
+
+Responses are served from recorded fixtures when available, otherwise they are generated procedurally
+(deterministic for the same request). Open-Meteo flatbuffers responses used by the weather forecast tool
+can only be replayed from recordings. With `--record`, requests are proxied to the real upstreams
+and the responses are stored as fixtures.
+
+Point the tools at the stub with:
+    OLU_MAPSERV_URL=http://localhost:8090/olu/cgi-bin/mapserv
+    GIS_MAPSERV_URL=http://localhost:8090/gis/cgi-bin/mapserv
+    OPENMETEO_URL=http://localhost:8090/v1/forecast
+
+Usage:
+    python -m scripts.upstream_stub [--port 8090] [--record] [--latency-ms 200 --jitter-ms 100] [--error-rate 0.05]
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+from datetime import datetime, timedelta, timezone
+from io import BytesIO
+from pathlib import Path
+
+import aiohttp
+import numpy as np
+from aiohttp import web
+from PIL import Image
+
+from paths import DATA_DIR
+from utils.map_service_utils import GIS_MAPSERV_URL, LC_rgb_mapping, LU_rgb_mapping, OLU_MAPSERV_URL, OPENMETEO_URL
+
+UPSTREAMS = {
+    "olu": OLU_MAPSERV_URL,
+    "gis": GIS_MAPSERV_URL,
+    "openmeteo": OPENMETEO_URL,
+}
+MAX_RASTER_SIZE = 4096
+SPOI_CATEGORIES = ["restaurant", "cafe", "hotel", "museum", "church", "castle", "viewpoint", "pharmacy", "supermarket", "bus_stop"]
+
+def request_seed(*parts) -> int:
+    return int.from_bytes(hashlib.sha1("|".join(map(str, parts)).encode()).digest()[:4], "little")
+
+def lower_params(request: web.Request) -> dict:
+    return {k.lower(): v for k, v in request.query.items()}
+
+# Procedural responses
+def _cell_hash(a, b, salt: int = 0):
+    """Deterministic pseudo-random non-negative integers for integer grid cells."""
+    h = (a.astype(np.int64) * 73856093) ^ (b.astype(np.int64) * 19349663) ^ (salt * 83492791)
+    return (h ^ (h >> 13)) & 0x7FFFFFFF
+
+def _elevation(lon, lat):
+    return np.clip(420 + 260 * np.sin(lon * 21) + 220 * np.cos(lat * 27) + 90 * np.sin(lon * 97 + lat * 61), 0, None)
+
+def _palette_field(lon, lat, rgb_mapping: dict, salt: int, year: int | None = None):
+    palette = np.array(sorted(set(rgb_mapping.values())), dtype=np.uint8)
+    cell_x, cell_y = np.floor(lon / 0.004), np.floor(lat / 0.003)
+    zones = _cell_hash(cell_x, cell_y, salt) % len(palette)
+    if year is not None:
+        # Zones progressively change their class over the years of the time series
+        changed = _cell_hash(cell_x, cell_y, salt + 2) % 40 < (year - 2015)
+        zones = np.where(changed, _cell_hash(cell_x, cell_y, salt + 3) % len(palette), zones)
+    pixels = palette[zones]
+    # A few off-palette pixels, like the anti-aliased edges of the real service
+    fine = _cell_hash(np.floor(lon / 0.0002), np.floor(lat / 0.00015), salt + 1)
+    noise = fine % 50 == 0
+    pixels[noise] = np.stack([fine[noise] % 256, (fine[noise] >> 8) % 256, (fine[noise] >> 16) % 256], axis=-1)
+    return pixels
+
+def make_raster(params: dict) -> tuple[bytes, str]:
+    """
+    Renders the layer as a function of coordinates, so neighbouring or overlapping requests (e.g. strips
+    or tiles of one area) return consistent pixels.
+    """
+    layer = params.get("layers", "")
+    width = min(int(params.get("width", 256)), MAX_RASTER_SIZE)
+    height = min(int(params.get("height", 256)), MAX_RASTER_SIZE)
+    # WMS 1.3.0 with EPSG:4326 uses lat,lon axis order
+    lat1, lon1, lat2, lon2 = map(float, params.get("bbox", "49.3,12.7,49.4,12.8").split(",")[:4])
+    lon = lon1 + (np.arange(width) + 0.5) * (lon2 - lon1) / width
+    lat = lat2 - (np.arange(height) + 0.5) * (lat2 - lat1) / height
+    lon, lat = np.meshgrid(lon, lat)
+
+    if layer == "olu_obj_lu":
+        image = Image.fromarray(_palette_field(lon, lat, LU_rgb_mapping, 0), mode="RGB")
+    elif layer == "olu_bbox_ts":
+        year = int(str(params.get("time", "2023"))[:4])
+        image = Image.fromarray(_palette_field(lon, lat, LU_rgb_mapping, 0, year), mode="RGB")
+    elif layer == "olu_obj_lc":
+        image = Image.fromarray(_palette_field(lon, lat, LC_rgb_mapping, 7), mode="RGB")
+    elif layer == "DEM_ORIG":
+        image = Image.fromarray(_elevation(lon, lat).astype(np.float32), mode="F")
+    elif layer == "DEM":
+        shade = np.clip(_elevation(lon, lat) / 6, 0, 255).astype(np.uint8)
+        image = Image.fromarray(np.stack([shade, 255 - shade, np.full_like(shade, 96)], axis=-1), mode="RGB")
+    elif layer.startswith(("t2m_", "tas_")):
+        month = int(str(params.get("time", "20200101"))[4:6] or 1)
+        seasonal = 9 - 10 * np.cos(2 * np.pi * (month - 1) / 12) + (1.5 if layer.startswith("tas_") else 0)
+        image = Image.fromarray((seasonal + 2 - 0.0065 * _elevation(lon, lat)).astype(np.float32), mode="F")
+    elif "population" in layer:
+        # Population of roughly 1km grid cells
+        cells = _cell_hash(np.floor(lon / 0.014), np.floor(lat / 0.009), 3)
+        image = Image.fromarray((cells % 2000).astype(np.float32), mode="F")
+    else:
+        raise web.HTTPBadRequest(text=f"Unknown layer: {layer}")
+
+    buffer = BytesIO()
+    if params.get("format", "png") == "gtiff":
+        image.save(buffer, format="TIFF")
+        return buffer.getvalue(), "image/tiff"
+    image.save(buffer, format="PNG")
+    return buffer.getvalue(), "image/png"
+
+def make_features(params: dict) -> tuple[bytes, str]:
+    # WFS 1.1.0 with EPSG:4326 srsname, bbox as sent by get_spoi_data: lon1,lat1,lon2,lat2
+    lon1, lat1, lon2, lat2 = map(float, params.get("bbox", "12.7,49.3,12.8,49.4").split(",")[:4])
+    rng = np.random.default_rng(request_seed("spoi", params.get("bbox")))
+    # Roughly 30 POIs per 0.01 deg^2, capped to keep responses reasonable
+    n_total = int(min(20_000, 30 * abs(lon2 - lon1) * abs(lat2 - lat1) / 0.0001) + rng.integers(0, 10))
+    lons = rng.uniform(lon1, lon2, n_total)
+    lats = rng.uniform(lat1, lat2, n_total)
+    categories = rng.integers(0, len(SPOI_CATEGORIES), n_total)
+
+    start = int(params.get("startindex", 0))
+    stop = n_total if "maxfeatures" not in params else min(n_total, start + int(params["maxfeatures"]))
+    features = [
+        {
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [round(lons[i], 6), round(lats[i], 6)]},
+            "properties": {
+                "cat": f"http://gis.lesprojekt.cz/schema#{SPOI_CATEGORIES[categories[i]]}",
+                "label": f"{SPOI_CATEGORIES[categories[i]].replace('_', ' ').title()} {i}",
+            },
+        }
+        for i in range(start, stop)
+    ]
+    return json.dumps({"type": "FeatureCollection", "features": features}).encode(), "application/json"
+
+def make_forecast(params: dict) -> tuple[bytes, str]:
+    latitude = float(params.get("latitude", "49.75").split(",")[0])
+    longitude = float(params.get("longitude", "13.39").split(",")[0])
+    forecast_days = int(params.get("forecast_days", 7))
+    rng = np.random.default_rng(request_seed(latitude, longitude, forecast_days))
+    today = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+
+    data = {"latitude": latitude, "longitude": longitude, "timezone": "UTC"}
+    if "current" in params:
+        data["current"] = {"time": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M"), "temperature_2m": round(float(10 + 5 * rng.standard_normal()), 1)}
+    if "hourly" in params and forecast_days > 0:
+        hours = np.arange(24 * forecast_days)
+        data["hourly"] = {"time": [(today + timedelta(hours=int(h))).strftime("%Y-%m-%dT%H:%M") for h in hours]}
+        for variable in params["hourly"].split(","):
+            values = 10 + 6 * np.sin(2 * np.pi * (hours - 9) / 24) + rng.standard_normal(len(hours))
+            data["hourly"][variable] = np.round(values, 1).tolist()
+    if "daily" in params and forecast_days > 0:
+        data["daily"] = {"time": [(today + timedelta(days=d)).strftime("%Y-%m-%d") for d in range(forecast_days)]}
+        for variable in params["daily"].split(","):
+            data["daily"][variable] = np.round(10 + 5 * rng.standard_normal(forecast_days), 1).tolist()
+    return json.dumps(data).encode(), "application/json"
+
+
+class UpstreamStub:
+    def __init__(self, fixtures_dir: Path, record: bool, strict: bool, latency_ms: float, jitter_ms: float, error_rate: float, error_status: int):
+        self.fixtures_dir = fixtures_dir
+        self.record = record
+        self.strict = strict
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.client: aiohttp.ClientSession | None = None
+
+    def fixture_path(self, upstream: str, request: web.Request) -> Path:
+        key = "&".join(f"{k.lower()}={v}" for k, v in sorted(request.query.items()))
+        return self.fixtures_dir / upstream / f"{hashlib.sha1(key.encode()).hexdigest()}.json"
+
+    def load_fixture(self, path: Path) -> web.Response | None:
+        if not path.exists():
+            return None
+        meta = json.loads(path.read_text())
+        body = path.with_suffix(".bin").read_bytes()
+        return web.Response(body=body, status=meta["status"], content_type=meta["content_type"])
+
+    async def record_fixture(self, upstream: str, request: web.Request, path: Path) -> web.Response:
+        if self.client is None:
+            self.client = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=120))
+        async with self.client.get(UPSTREAMS[upstream], params=list(request.query.items())) as response:
+            body = await response.read()
+            content_type = response.content_type
+            status = response.status
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.with_suffix(".bin").write_bytes(body)
+        path.write_text(json.dumps({"status": status, "content_type": content_type, "query": list(request.query.items())}))
+        return web.Response(body=body, status=status, content_type=content_type)
+
+    async def inject_faults(self) -> web.Response | None:
+        """Sleeps for the configured latency and returns an error response for the configured share of requests."""
+        delay = self.latency_ms + random.uniform(0, self.jitter_ms)
+        if delay > 0:
+            await asyncio.sleep(delay / 1000)
+        if random.random() < self.error_rate:
+            return web.Response(status=self.error_status, text="Injected error")
+        return None
+
+    async def serve(self, upstream: str, request: web.Request, generate) -> web.Response:
+        error = await self.inject_faults()
+        if error is not None:
+            return error
+
+        path = self.fixture_path(upstream, request)
+        if self.record:
+            return await self.record_fixture(upstream, request, path)
+        response = self.load_fixture(path)
+        if response is not None:
+            return response
+        if self.strict or generate is None:
+            return web.Response(status=404, text=f"No recorded fixture for this request ({path.name})")
+        body, content_type = generate(lower_params(request))
+        return web.Response(body=body, content_type=content_type)
+
+    async def mapserv(self, request: web.Request) -> web.Response:
+        upstream = request.match_info["upstream"]
+        service_request = lower_params(request).get("request", "").lower()
+        generate = {"getmap": make_raster, "getfeature": make_features}.get(service_request)
+        if generate is None and not self.record:
+            return web.Response(status=400, text=f"Unsupported request: {service_request}")
+        return await self.serve(upstream, request, generate)
+
+    async def forecast(self, request: web.Request) -> web.Response:
+        # Flatbuffers responses (openmeteo_requests client) are replay-only
+        generate = None if lower_params(request).get("format") == "flatbuffers" else make_forecast
+        return await self.serve("openmeteo", request, generate)
+
+    async def close(self, app):
+        if self.client is not None:
+            await self.client.close()
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/{upstream:olu|gis}/cgi-bin/mapserv", self.mapserv)
+        app.router.add_get("/v1/forecast", self.forecast)
+        app.on_cleanup.append(self.close)
+        return app
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for WMS, WFS and Open-Meteo upstreams.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--fixtures", type=Path, default=DATA_DIR / "upstream_fixtures", help="Directory with recorded responses")
+    parser.add_argument("--record", action="store_true", help="Proxy requests to the real upstreams and record the responses")
+    parser.add_argument("--strict", action="store_true", help="Serve only recorded responses, never generate them")
+    parser.add_argument("--latency-ms", type=float, default=0, help="Latency added to every response")
+    parser.add_argument("--jitter-ms", type=float, default=0, help="Random extra latency up to this value")
+    parser.add_argument("--error-rate", type=float, default=0, help="Share of requests answered with an error")
+    parser.add_argument("--error-status", type=int, default=503, help="HTTP status of injected errors")
+    args = parser.parse_args()
+
+    stub = UpstreamStub(args.fixtures, args.record, args.strict, args.latency_ms, args.jitter_ms, args.error_rate, args.error_status)
+    base = f"http://{args.host}:{args.port}"
+    print(f"OLU_MAPSERV_URL={base}/olu/cgi-bin/mapserv")
+    print(f"GIS_MAPSERV_URL={base}/gis/cgi-bin/mapserv")
+    print(f"OPENMETEO_URL={base}/v1/forecast")
+    web.run_app(stub.create_app(), host=args.host, port=args.port)
+
+if __name__ == "__main__":
+    main()
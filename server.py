@@ -0,0 +1,340 @@
+"""
+HTTP service exposing the geo agents to other applications.
+
+Endpoints:
+    POST   /sessions/{session_id}/messages  Ask a question, new messages are streamed back as server-sent events.
+                                            Body: {"question": ..., "bbox_wkt": ..., "marker_wkt": ..., "agent": "geo" | "comparison"}
+    GET    /sessions/{session_id}/messages  Chat history of the session
+    GET    /sessions/{session_id}/artifacts/{artifact_id}
+                                            Structured data of a tool message, referenced by its "artifact" field
+    DELETE /sessions/{session_id}           Drop the session
+    GET    /health                          Liveness, worker pool, warmup and upstream circuit status
+    GET    /ready                           200 once the warmup finished, 503 before
+    GET    /metrics                         Service and span timing metrics in Prometheus text format
+
+Usage:
+    python server.py [--host 0.0.0.0] [--port 8080]
+"""
+import argparse
+import asyncio
+import configparser
+import json
+import time
+import uuid
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web
+from dotenv import load_dotenv
+from langchain_core.messages import AnyMessage, HumanMessage
+from pydantic import ValidationError
+
+from paths import PROJECT_ROOT
+from schemas.geometry import BoundingBox, PointMarker
+from utils.agent_utils import clear_chat_history, get_artifact_store, get_chat_history
+from utils.cpu_pool import shutdown_cpu_pool
+from utils.deadline import new_deadline
+from utils.instrumentation import render_prometheus, trace
+from utils.session_store import InMemorySessionBackend, SessionBackend
+from utils.upstream_guard import get_upstream_status
+from utils.warmup import start_warmup
+
+cfg = configparser.ConfigParser()
+cfg.read(f'{PROJECT_ROOT}/config.ini')
+
+def get_agent(name: str):
+    if name == "geo":
+        from agents.geo_agent import get_geo_agent
+        return get_geo_agent()
+    if name == "comparison":
+        from agents.comparison_geo_agent import get_comparison_geo_agent
+        return get_comparison_geo_agent()
+    raise ValueError(f"Unknown agent: {name}")
+
+def serialize_message(message: AnyMessage) -> dict:
+    data = {
+        "id": message.id,
+        "type": message.type,
+        "content": message.content,
+    }
+    if message.type == "ai":
+        data["tool_calls"] = [{"name": tc["name"], "args": tc["args"]} for tc in message.tool_calls]
+        if getattr(message, "alternative_id", None):
+            data["alternative_id"] = message.alternative_id
+        if getattr(message, "timings", None):
+            data["timings"] = message.timings
+    if message.type == "tool":
+        data["name"] = message.name
+        if isinstance(getattr(message, "artifact", None), dict):
+            data["artifact"] = message.artifact
+    return data
+
+def format_sse(event: str, data: dict) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n".encode()
+
+
+class AgentService:
+    """
+    Runs agent requests on a bounded worker pool. Requests wait in a bounded queue when all workers
+    are busy and are rejected once the queue is full, so load spikes do not pile up unbounded work.
+    """
+    def __init__(self, sessions: SessionBackend, max_workers: int, max_queue: int):
+        self.sessions = sessions
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="agent")
+        # A session's lock lives only while a request holds or waits on it, so client-chosen ids cannot pile up locks
+        self.session_locks: weakref.WeakValueDictionary[str, asyncio.Lock] = weakref.WeakValueDictionary()
+        self.running = 0
+        self.queued = 0
+        self.started_at = time.time()
+        self.counters = {
+            "requests_total": 0,
+            "rejected_total": 0,
+            "errors_total": 0,
+            "completed_total": 0,
+            "latency_seconds_sum": 0.0,
+        }
+
+    @property
+    def in_flight(self) -> int:
+        return self.running + self.queued
+
+    def try_admit(self) -> bool:
+        self.counters["requests_total"] += 1
+        if self.in_flight >= self.max_workers + self.max_queue:
+            self.counters["rejected_total"] += 1
+            return False
+        self.queued += 1
+        return True
+
+    def run_agent(self, agent_name: str, session_id: str, input: dict, emit) -> tuple[uuid.UUID, bool]:
+        """
+        Runs in a worker thread, `emit` pushes (event, data) pairs back to the event loop.
+        Returns the run id and whether an alternative response was sampled for it.
+        """
+        session = self.sessions.get(session_id)
+        run_id = uuid.uuid4()
+        config = {
+            "run_id": run_id,
+            "configurable": {
+                "run_id": run_id,
+                "session_store": session,
+                "deadline": new_deadline(),
+            },
+            "metadata": {
+                "bounding_box_wkt": input["bounding_box"].wkt,
+                "user": f"service:{session_id}",
+                "hotel_site_marker_wkt": input["hotel_site_marker"].wkt if input["hotel_site_marker"] else None,
+            },
+        }
+        last_message_id = 0
+        last_chunk = None
+        with trace(run_id):
+            for chunk in get_agent(agent_name).stream(input=input, config=config, stream_mode="values"):
+                for message in chunk["messages"][last_message_id:]:
+                    emit("message", serialize_message(message))
+                last_message_id = len(chunk["messages"])
+                last_chunk = chunk
+        return run_id, bool(last_chunk and last_chunk.get("alternative_sampled"))
+
+    async def stream_answer(self, request: web.Request, session_id: str, agent_name: str, input: dict) -> web.StreamResponse:
+        loop = asyncio.get_running_loop()
+        events: asyncio.Queue = asyncio.Queue()
+
+        def emit(event, data):
+            loop.call_soon_threadsafe(events.put_nowait, (event, data))
+
+        response = web.StreamResponse(headers={
+            "Content-Type": "text/event-stream",
+            "Cache-Control": "no-cache",
+        })
+        lock = self.session_locks.get(session_id)
+        if lock is None:
+            lock = self.session_locks[session_id] = asyncio.Lock()
+        start = time.perf_counter()
+        future = None
+        acquired = False
+        result = None
+        try:
+            await response.prepare(request)
+            # Requests of the same session are serialized to keep the chat history consistent
+            async with lock:
+                self.queued -= 1
+                self.running += 1
+                acquired = True
+                try:
+                    future = loop.run_in_executor(self.executor, self.run_agent, agent_name, session_id, input, emit)
+                    await self.forward_events(events, future, response)
+                    result = future.result()
+                    self.counters["completed_total"] += 1
+                except Exception as e:
+                    self.counters["errors_total"] += 1
+                    await response.write(format_sse("error", {"error": f"{type(e).__name__}: {e}"}))
+                finally:
+                    if future is None or future.done():
+                        self.running -= 1
+                    else:
+                        # Client went away, the worker still finishes the run and keeps the history consistent
+                        future.add_done_callback(lambda _: self.release_worker())
+                    self.counters["latency_seconds_sum"] += time.perf_counter() - start
+
+            # The answer is streamed as soon as it is ready, a sampled alternative follows once attached.
+            # The worker and the session are already released, the wait does not take an agent worker.
+            if result is not None:
+                run_id, alternative_sampled = result
+                if alternative_sampled:
+                    from agents.comparison_geo_agent import wait_for_alternative
+                    alternative = await asyncio.to_thread(wait_for_alternative, run_id)
+                    if alternative is not None:
+                        await response.write(format_sse("alternative", serialize_message(alternative)))
+                await response.write(format_sse("done", {"run_id": str(run_id)}))
+        finally:
+            if not acquired:
+                self.queued -= 1
+                self.counters["latency_seconds_sum"] += time.perf_counter() - start
+
+        await response.write_eof()
+        return response
+
+    def release_worker(self):
+        self.running -= 1
+
+    async def forward_events(self, events: asyncio.Queue, future: asyncio.Future, response: web.StreamResponse):
+        """Writes events emitted by the worker until it finishes, re-raising its exception if any."""
+        while True:
+            get_event = asyncio.ensure_future(events.get())
+            done, _ = await asyncio.wait({get_event, future}, return_when=asyncio.FIRST_COMPLETED)
+            if get_event in done:
+                event, data = get_event.result()
+                await response.write(format_sse(event, data))
+                continue
+            get_event.cancel()
+            while not events.empty():
+                event, data = events.get_nowait()
+                await response.write(format_sse(event, data))
+            future.result()
+            return
+
+    def render_metrics(self) -> str:
+        lines = []
+        for name, value in self.counters.items():
+            metric = f"geo_agent_{name}"
+            lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric} {value}")
+        for name, value in (("running", self.running), ("queued", self.queued), ("sessions", len(self.sessions))):
+            metric = f"geo_agent_{name}"
+            lines.append(f"# TYPE {metric} gauge")
+            lines.append(f"{metric} {value}")
+        return "\n".join(lines) + "\n"
+
+
+routes = web.RouteTableDef()
+
+@routes.post("/sessions/{session_id}/messages")
+async def post_message(request: web.Request):
+    service: AgentService = request.app["service"]
+    session_id = request.match_info["session_id"]
+    try:
+        body = await request.json()
+        agent_name = body.get("agent", "geo")
+        if agent_name not in ("geo", "comparison"):
+            raise ValueError(f"Unknown agent: {agent_name}")
+        input = {
+            "messages": [HumanMessage(content=body["question"])],
+            "bounding_box": BoundingBox(wkt=body["bbox_wkt"]),
+            "hotel_site_marker": PointMarker(wkt=body["marker_wkt"]) if body.get("marker_wkt") else None,
+        }
+    except (KeyError, ValueError, ValidationError, json.JSONDecodeError) as e:
+        return web.json_response({"error": f"Invalid request: {e}"}, status=400)
+
+    if not service.try_admit():
+        return web.json_response({"error": "Service is busy, try again later."}, status=503, headers={"Retry-After": "5"})
+    return await service.stream_answer(request, session_id, agent_name, input)
+
+@routes.get("/sessions/{session_id}/messages")
+async def get_messages(request: web.Request):
+    service: AgentService = request.app["service"]
+    session_id = request.match_info["session_id"]
+    # Histories are persisted, sessions evicted from memory or lost by a restart are restored from the database
+    history = get_chat_history(service.sessions.get(session_id))
+    if len(history) == 0:
+        service.sessions.delete(session_id)
+        return web.json_response({"error": "Unknown session"}, status=404)
+    return web.json_response({"messages": [serialize_message(m) for m in history.messages]}, dumps=lambda d: json.dumps(d, default=str))
+
+@routes.get("/sessions/{session_id}/artifacts/{artifact_id}")
+async def get_artifact(request: web.Request):
+    service: AgentService = request.app["service"]
+    artifacts = get_artifact_store(service.sessions.get(request.match_info["session_id"]))
+    artifact = artifacts.get(request.match_info["artifact_id"])
+    if artifact is None:
+        return web.json_response({"error": "Unknown artifact"}, status=404)
+    return web.json_response({
+        "kind": artifact.kind,
+        "meta": artifact.meta,
+        "arrays": {name: array.tolist() for name, array in artifact.arrays.items()},
+    })
+
+@routes.delete("/sessions/{session_id}")
+async def delete_session(request: web.Request):
+    service: AgentService = request.app["service"]
+    session_id = request.match_info["session_id"]
+    clear_chat_history(service.sessions.get(session_id))
+    service.sessions.delete(session_id)
+    return web.Response(status=204)
+
+@routes.get("/health")
+async def health(request: web.Request):
+    service: AgentService = request.app["service"]
+    return web.json_response({
+        "status": "ok",
+        "uptime_s": round(time.time() - service.started_at, 1),
+        "workers": service.max_workers,
+        "running": service.running,
+        "queued": service.queued,
+        "max_queue": service.max_queue,
+        "sessions": len(service.sessions),
+        "upstreams": get_upstream_status(),
+        "warmup": request.app["warmup"].report(),
+    })
+
+@routes.get("/ready")
+async def ready(request: web.Request):
+    ready = request.app["warmup"].ready
+    return web.json_response({"ready": ready}, status=200 if ready else 503)
+
+@routes.get("/metrics")
+async def metrics(request: web.Request):
+    service: AgentService = request.app["service"]
+    return web.Response(text=service.render_metrics() + render_prometheus(), content_type="text/plain")
+
+async def stop_cpu_pool(app: web.Application):
+    shutdown_cpu_pool()
+
+def create_app(sessions: SessionBackend | None = None) -> web.Application:
+    server_cfg = cfg['SERVER']
+    service = AgentService(
+        sessions=sessions or InMemorySessionBackend(max_sessions=server_cfg.getint('max_sessions')),
+        max_workers=server_cfg.getint('max_workers'),
+        max_queue=server_cfg.getint('max_queue'),
+    )
+    app = web.Application()
+    app["service"] = service
+    # Models, indexes and compiled graphs are loaded in the background while the server already accepts requests
+    app["warmup"] = start_warmup()
+    app.add_routes(routes)
+    app.on_cleanup.append(stop_cpu_pool)
+    return app
+
+def main():
+    parser = argparse.ArgumentParser(description="Geo agent HTTP service.")
+    parser.add_argument("--host", default=cfg['SERVER']['host'])
+    parser.add_argument("--port", type=int, default=cfg['SERVER'].getint('port'))
+    args = parser.parse_args()
+
+    load_dotenv()
+    web.run_app(create_app(), host=args.host, port=args.port)
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,8 @@
 from .eurostat_tool import EurostatPopulationTool
 from .hotel_suitability_tool import HotelSuitabilityTool
-from .land_tools import LandCoverTool, LandUseTool, ElevationTool
+from .land_tools import LandCoverTool, LandUseTool, LandUseChangeTool, ElevationTool
 from .openmeteo_tool import WeatherForecastTool
-from .spoi_tool import SpoiTool
+from .spoi_tool import SpoiProximityTool, SpoiTool
 from .temperature_tools import TemperatureAnalysisTool, TemperatureLongPredictionTool, TemperatureForecastTool
 from .tourism_tool import TourismTool
 
@@ -13,8 +13,10 @@ def get_all_tools():
         HotelSuitabilityTool(),
         LandCoverTool(),
         LandUseTool(),
+        LandUseChangeTool(),
         ElevationTool(),
         SpoiTool(),
+        SpoiProximityTool(),
         TemperatureAnalysisTool(),
         TemperatureLongPredictionTool(),
         TemperatureForecastTool(),
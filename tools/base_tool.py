@@ -0,0 +1,64 @@
+import configparser
+from math import ceil
+from typing import Callable, Literal
+
+from langchain_core.tools import BaseTool
+
+from paths import PROJECT_ROOT
+from utils.artifact_store import Artifact
+from utils.deadline import collect_degradations, get_degradations
+
+cfg = configparser.ConfigParser()
+cfg.read(f'{PROJECT_ROOT}/config.ini')
+
+# Tool outputs above this estimated number of tokens are replaced by a summary, 0 disables the budget
+TOKEN_BUDGET = cfg.getint('TOOLS', 'token_budget', fallback=600)
+CHARS_PER_TOKEN = 4
+
+def estimate_tokens(text: str) -> int:
+    return ceil(len(text) / CHARS_PER_TOKEN)
+
+def truncate_to_budget(text: str, budget: int) -> str:
+    """Keeps whole leading lines of the text within the budget."""
+    lines, used = [], 0
+    for line in text.split("\n"):
+        used += estimate_tokens(line + "\n")
+        if used > budget:
+            lines.append("...")
+            break
+        lines.append(line)
+    return "\n".join(lines)
+
+
+class BudgetedTool(BaseTool):
+    """
+    Tool returning its text for the LLM together with an artifact with the structured data behind it.
+    Outputs over the token budget are replaced by the first summary that fits. The full data stays in the artifact,
+    tools without a structured artifact keep the full text. Results degraded to meet the question deadline say so.
+    """
+    response_format: Literal["content", "content_and_artifact"] = "content_and_artifact"
+    token_budget: int = TOKEN_BUDGET
+
+    def run(self, *args, **kwargs):
+        with collect_degradations():
+            return super().run(*args, **kwargs)
+
+    def fit(self, full: str, *summaries: Callable[[], str], artifact: Artifact | None = None) -> tuple[str, Artifact | None]:
+        """
+        Returns (content, artifact). Summaries are built lazily, from the most detailed one,
+        the last one is truncated if none fits.
+        """
+        content, artifact = self._fit_budget(full, summaries, artifact)
+        notes = get_degradations()
+        return (content + "\n\nNote: " + " ".join(notes) if notes else content), artifact
+
+    def _fit_budget(self, full: str, summaries, artifact: Artifact | None) -> tuple[str, Artifact | None]:
+        if not self.token_budget or estimate_tokens(full) <= self.token_budget:
+            return full, artifact
+        artifact = artifact if artifact is not None else Artifact("text", meta={"full_output": full})
+        content = full
+        for summarize in summaries:
+            content = summarize()
+            if estimate_tokens(content) <= self.token_budget:
+                return content, artifact
+        return truncate_to_budget(content, self.token_budget), artifact
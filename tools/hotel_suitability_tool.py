@@ -1,30 +1,52 @@
+import logging
 from typing import Optional, Type
 
-from langchain_core.tools import BaseTool
 from pydantic import BaseModel
 
 from models import hotels_model
+from tools.base_tool import BudgetedTool
 from tools.input_schemas.hotel_schemas import HotelSuitabilitySchema
-from schemas.geometry import PointMarker
+from schemas.geometry import BoundingBox, PointMarker
+from utils.instrumentation import span, traced_tool_run
+from utils.spoi_index import get_proximity_features
 from utils.tool_utils import find_square_for_marker
 
+logger = logging.getLogger(__name__)
 
-class HotelSuitabilityTool(BaseTool):
+
+class HotelSuitabilityTool(BudgetedTool):
     name: str = "estimate_hotel_suitability"
     description: str = "Using data about hotels and other establishments, estimate the number of hotels that could be suitable for the marked site provided during runtime."
     args_schema: Optional[Type[BaseModel]] = HotelSuitabilitySchema
 
-    def _run(self, hotel_site_marker: PointMarker):
+    @traced_tool_run
+    def _run(self, hotel_site_marker: PointMarker, bounding_box: BoundingBox | None = None):
         if hotel_site_marker is None:
-            return "No hotel site marker specified."
+            return self.fit("No hotel site marker specified.")
 
-        features = hotels_model.load_features()
-        model = hotels_model.load_model()
+        with span("io.load_hotels_model"):
+            features = hotels_model.load_features()
+            model = hotels_model.load_model()
 
         square_list = features.index.tolist()[1:]
         site_square = find_square_for_marker(square_list, hotel_site_marker)
         if site_square is None:
-            return "There is no available data for the marked site."
+            return self.fit("There is no available data for the marked site.")
 
         square_features = features.loc[site_square]
-        return f"Estimated number of hotels suitable for marked site: {model.predict(square_features):.2f}"
\ No newline at end of file
+        estimate = f"Estimated number of hotels suitable for marked site: {model.predict(square_features):.2f}"
+        if bounding_box is None or not bounding_box.geom.contains(hotel_site_marker.geom):
+            return self.fit(estimate)
+
+        # Amenities around the exact site complement the grid square features of the model
+        try:
+            proximity = get_proximity_features(bounding_box, hotel_site_marker)
+        except Exception as e:
+            logger.warning("Proximity features of the hotel site are not available: %s", e)
+            return self.fit(estimate + "\n\n" + "Note: Points of interest around the site could not be retrieved, the estimate is based on the grid square features only.")
+        nearest = ", ".join(f"{cat} {dist:.0f} m" for cat, dist in proximity["nearest_m"].items())
+        return self.fit(
+            estimate\
+            + "\n\n" + f"Points of interest within {proximity['radius_m']} m of the site: {proximity['total_within_radius']}"\
+            + ("\n" + f"Nearest amenities: {nearest}" if nearest else "")
+        )
\ No newline at end of file
@@ -2,7 +2,8 @@ from langgraph.prebuilt import InjectedState
 from pydantic import BaseModel, Field
 from typing_extensions import Annotated
 
-from schemas.geometry import PointMarker
+from schemas.geometry import BoundingBox, PointMarker
 
 class HotelSuitabilitySchema(BaseModel):
+    bounding_box: Annotated[BoundingBox, InjectedState("bounding_box")] = Field(..., description="Map bounding box coordinates.")
     hotel_site_marker: Annotated[PointMarker, InjectedState("hotel_site_marker")] = Field(..., description="Coordinates of a potential hotel site marker.")
\ No newline at end of file
@@ -0,0 +1,16 @@
+from langgraph.prebuilt import InjectedState
+from pydantic import BaseModel, Field
+from typing_extensions import Annotated
+
+from schemas.geometry import BoundingBox
+from utils.map_service_utils import map_config
+
+# Years of the OLU_CZ land use time series
+OLU_CZ_YEARS = [int(time[:4]) for time in map_config["OLU_CZ"]["alternatives"]["TIME"]]
+FIRST_YEAR, LAST_YEAR = min(OLU_CZ_YEARS), max(OLU_CZ_YEARS)
+
+
+class LandUseChangeInput(BaseModel):
+    bounding_box: Annotated[BoundingBox, InjectedState("bounding_box")] = Field(..., description="Map bounding box coordinates.")
+    start_year: int = Field(FIRST_YEAR, ge=FIRST_YEAR, le=LAST_YEAR, description=f"First year of the comparison, between {FIRST_YEAR} and {LAST_YEAR}.")
+    end_year: int = Field(LAST_YEAR, ge=FIRST_YEAR, le=LAST_YEAR, description=f"Last year of the comparison, between {FIRST_YEAR} and {LAST_YEAR}.")
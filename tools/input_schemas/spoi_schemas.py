@@ -0,0 +1,15 @@
+from typing import Optional
+
+from langgraph.prebuilt import InjectedState
+from pydantic import BaseModel, Field
+from typing_extensions import Annotated
+
+from schemas.geometry import BoundingBox, PointMarker
+
+
+class SpoiProximityInput(BaseModel):
+    bounding_box: Annotated[BoundingBox, InjectedState("bounding_box")] = Field(..., description="Map bounding box coordinates.")
+    hotel_site_marker: Annotated[PointMarker, InjectedState("hotel_site_marker")] = Field(..., description="Coordinates of a potential hotel site marker.")
+    radius_m: int = Field(500, description="Radius around the marker in meters for counting points of interest.")
+    k: int = Field(5, description="Number of nearest points of interest to list.")
+    category: Optional[str] = Field(None, description="Only list the nearest points of interest of this category, e.g. restaurant.")
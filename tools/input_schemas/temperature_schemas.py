@@ -1,13 +1,27 @@
 from langgraph.prebuilt import InjectedState
 from pydantic import BaseModel, Field
-from typing_extensions import Annotated
+from typing import Optional
+
+from typing_extensions import Annotated, Literal
 
 from schemas.geometry import BoundingBox
 
+# Month number 1-12, with or without the leading zero
+Month = Annotated[str, Field(pattern=r"^(0?[1-9]|1[0-2])$")]
+
 
 class TemperatureAnalysisInput(BaseModel):
     bounding_box: Annotated[BoundingBox, InjectedState("bounding_box")] = Field(..., description="Map bounding box coordinates.")
-    month: str = Field(..., description="Month in the format of MM.")
+    month: Optional[Month] = Field(None, description="Month in the format of MM.")
+    months: Optional[list[Month]] = Field(None, description="Several months in the format of MM, answered in one call.")
+    season: Optional[Literal["winter", "spring", "summer", "autumn"]] = Field(
+        None,
+        description="Meteorological season, used instead of months. Winter is December to February."
+    )
+    compare: bool = Field(
+        False,
+        description="Also return the other period (last 5 years vs 2050s) and the temperature change between them."
+    )
 
 
 class TemeperatureForecastInput(BaseModel):
@@ -1,26 +1,51 @@
 from typing import Optional, Type
 
 import numpy as np
-from langchain_core.tools import BaseTool
 from pydantic import BaseModel
-from typing import Optional, Type
 
+from tools.base_tool import BudgetedTool
 from tools.input_schemas.base_schemas import BaseGeomInput
+from tools.input_schemas.land_schemas import LandUseChangeInput
 from schemas.geometry import BoundingBox
-from utils.tool_utils import get_map, get_color_counts, count_elevation_zones
+from utils.artifact_store import Artifact, downsample_raster
+from utils.deadline import degraded_size
+from utils.instrumentation import traced_tool_run
+from utils.tool_utils import (
+    LU_PALETTE, OLU_CZ_YEARS, RASTER_SIZE, get_elevation_stats, get_land_counts, get_land_use_change, get_land_use_classes, map_concurrently
+)
 from utils.map_service_utils import LC_rgb_mapping, LU_rgb_mapping, rgb_LC_mapping, rgb_LU_mapping
 
+# Largest zones listed in a summarized output
+SUMMARY_TOP_ZONES = 10
+
+def summarize_zones(title: str, names: list[str], ratios: list[float], bbox_area: float, unit: str) -> str:
+    """Largest zones only, the remaining ones are reported together."""
+    order = np.argsort(ratios)[::-1]
+    lines = [f"{names[i]} - Area: {ratios[i]*bbox_area:.2f} {unit} ({ratios[i]*100:.1f}%)" for i in order[:SUMMARY_TOP_ZONES]]
+    if len(order) > SUMMARY_TOP_ZONES:
+        rest = sum(ratios[i] for i in order[SUMMARY_TOP_ZONES:])
+        lines.append(f"{len(order) - SUMMARY_TOP_ZONES} other zones - Area: {rest*bbox_area:.2f} {unit} ({rest*100:.1f}%)")
+    return f"{title} information, largest zones:\n" + "\n".join(lines)
+
+def class_counts_artifact(rgb_counts, names: list[str], n_pixels: int, bounding_box: BoundingBox) -> Artifact:
+    return Artifact(
+        "class_counts",
+        arrays={
+            "counts": np.array([cnt for _, cnt in rgb_counts], dtype=np.int64),
+            "colors": np.array([rgb for rgb, _ in rgb_counts], dtype=np.uint8).reshape(-1, 3),
+        },
+        meta={"names": names, "n_pixels": int(n_pixels), "bounds": bounding_box.geom.bounds},
+    )
 
-class LandCoverTool(BaseTool):
+
+class LandCoverTool(BudgetedTool):
     name: str = "land_cover_tool"
     description: str = "Get processed land cover information for a given area."
     args_schema: Optional[Type[BaseModel]] = BaseGeomInput
 
+    @traced_tool_run
     def _run(self, bounding_box: BoundingBox):
-        image = get_map(bounding_box, "OLU_EU", {"layers": "olu_obj_lc"})
-        
-        n_pixels = len(image.getdata())
-        rgb_counts = get_color_counts(image, LC_rgb_mapping)
+        rgb_counts, n_pixels = get_land_counts(bounding_box, "OLU_EU", {"layers": "olu_obj_lc"}, LC_rgb_mapping)
         
         land_uses = [rgb_LC_mapping[rgb] for rgb,_ in rgb_counts]
         land_ratios = [cnt/n_pixels for _,cnt in rgb_counts]
@@ -39,23 +64,25 @@ class LandCoverTool(BaseTool):
             else:
                 zones_data.append(f"{lu} - Area: {ratio*bbox_area:.2f} {unit} ({ratio*100:.2f}%)")
 
-        return f"Map Area: {bbox_area:.2f} {unit}\n\n"\
+        return self.fit(
+            f"Map Area: {bbox_area:.2f} {unit}\n\n"\
             + "Land cover information:\n"\
             + "\n".join(zones_data)\
             + "\n\n" + "Land cover information for small zones:\n"\
-            + "\n".join(small_zones_data)
+            + "\n".join(small_zones_data),
+            lambda: f"Map Area: {bbox_area:.2f} {unit}\n\n" + summarize_zones("Land cover", land_uses, land_ratios, bbox_area, unit),
+            artifact=class_counts_artifact(rgb_counts, land_uses, n_pixels, bounding_box),
+        )
 
 
-class LandUseTool(BaseTool):
+class LandUseTool(BudgetedTool):
     name: str = "land_use_tool"
     description: str = "Get processed land use information for a given area."
     args_schema: Optional[Type[BaseModel]] = BaseGeomInput
 
+    @traced_tool_run
     def _run(self, bounding_box: BoundingBox):
-        image = get_map(bounding_box, "OLU_EU")
-        
-        n_pixels = len(image.getdata())
-        rgb_counts = get_color_counts(image, LU_rgb_mapping)
+        rgb_counts, n_pixels = get_land_counts(bounding_box, "OLU_EU", {}, LU_rgb_mapping)
         
         land_uses = [rgb_LU_mapping[rgb] for rgb,_ in rgb_counts]
         land_ratios = [cnt/n_pixels for _,cnt in rgb_counts]
@@ -74,29 +101,105 @@ class LandUseTool(BaseTool):
             else:
                 zones_data.append(f"{lu} - Area: {ratio*bbox_area:.2f} {unit} ({ratio*100:.2f}%)")
 
-        return f"Map Area: {bbox_area:.2f} {unit}\n\n"\
+        return self.fit(
+            f"Map Area: {bbox_area:.2f} {unit}\n\n"\
             + "Land use information:\n"\
             + "\n".join(zones_data)\
             + "\n\n" + "Land use information for small zones:\n"\
-            + "\n".join(small_zones_data)
+            + "\n".join(small_zones_data),
+            lambda: f"Map Area: {bbox_area:.2f} {unit}\n\n" + summarize_zones("Land use", land_uses, land_ratios, bbox_area, unit),
+            artifact=class_counts_artifact(rgb_counts, land_uses, n_pixels, bounding_box),
+        )
     
 
-class ElevationTool(BaseTool):
+class ElevationTool(BudgetedTool):
     name: str = "elevation_tool"
     description: str = "Get processed data from digital elevation model."
     args_schema: Optional[Type[BaseModel]] = BaseGeomInput
 
+    @traced_tool_run
     def _run(self, bounding_box: BoundingBox):
-        image = get_map(bounding_box, "DEM_MASL")
-        elevations = np.array(image)
-        zones_data = count_elevation_zones(elevations)
+        stats = get_elevation_stats(bounding_box)
         
-        n_pixels = len(image.getdata())
         bbox_area = bounding_box.area
-        zones_ratios = {k: v / n_pixels for k, v in zones_data.items()}
+        zones_ratios = {k: v / stats["n_pixels"] for k, v in stats["zone_counts"].items()}
         
-        return f"Average elevation: {elevations.mean():.2f} meters\n"\
-            + f"Max elevation: {elevations.max()} meters\n"\
-            + f"Min elevation: {elevations.min()} meters\n\n"\
+        return self.fit(
+            f"Average elevation: {stats['mean']:.2f} meters\n"\
+            + f"Max elevation: {stats['max']} meters\n"\
+            + f"Min elevation: {stats['min']} meters\n\n"\
             + "Elevation zones:\n"\
-            + "\n".join([f"{k}: {v * bbox_area:.2f} km squared ({v*100:.2f}%)" for k, v in zones_ratios.items() if v != 0])
\ No newline at end of file
+            + "\n".join([f"{k}: {v * bbox_area:.2f} km squared ({v*100:.2f}%)" for k, v in zones_ratios.items() if v != 0]),
+            artifact=Artifact(
+                "class_counts",
+                arrays={"counts": np.array(list(stats["zone_counts"].values()), dtype=np.float64)},
+                meta={"names": list(stats["zone_counts"]), "n_pixels": int(stats["n_pixels"]), "bounds": bounding_box.geom.bounds,
+                      "mean": float(stats["mean"]), "min": float(stats["min"]), "max": float(stats["max"])},
+            ),
+        )
+
+
+class LandUseChangeTool(BudgetedTool):
+    name: str = "land_use_change_tool"
+    description: str = "Get land use changes between two years (2015-2023) for a given area, including the main transitions between land uses and their yearly trend."
+    args_schema: Optional[Type[BaseModel]] = LandUseChangeInput
+
+    @traced_tool_run
+    def _run(self, bounding_box: BoundingBox, start_year: int = 2015, end_year: int = 2023):
+        start_year, end_year = sorted((start_year, end_year))
+        if start_year not in OLU_CZ_YEARS or end_year not in OLU_CZ_YEARS:
+            return self.fit(f"Land use time series is available for years {min(OLU_CZ_YEARS)}-{max(OLU_CZ_YEARS)}, choose years within this range.")
+        years = list(range(start_year, end_year + 1))
+        # One size for all years, so that the snapshots stay comparable when maps are degraded near the deadline
+        width, height = degraded_size(RASTER_SIZE, RASTER_SIZE)
+        series = map_concurrently(lambda year: get_land_use_classes(bounding_box.wkt, year, width, height), years)
+        counts, transitions, trends = get_land_use_change(series, years)
+
+        n_pixels = series[0].size
+        names = [rgb_LU_mapping[tuple(int(c) for c in rgb)] for rgb in LU_PALETTE]
+        changed_ratio = 1 - transitions.trace() / n_pixels
+
+        bbox_area = bounding_box.area
+        unit = "km squared"
+        if bbox_area < 1:
+            bbox_area *= 1000_000
+            unit = "m squared"
+
+        class_lines = []
+        for i in np.argsort(-counts[-1]):
+            start, end = counts[0, i] / n_pixels, counts[-1, i] / n_pixels
+            if max(start, end) < 0.005:
+                continue
+            class_lines.append(
+                f"{names[i]}: {start*100:.2f}% -> {end*100:.2f}% ({(end - start)*100:+.2f} pp, trend {trends[i]*100:+.3f} pp/year)"
+            )
+
+        off_diagonal = transitions.astype(np.float64)
+        np.fill_diagonal(off_diagonal, 0)
+        transition_lines = []
+        for flat in np.argsort(-off_diagonal, axis=None)[:5]:
+            src, dst = np.unravel_index(flat, off_diagonal.shape)
+            ratio = off_diagonal[src, dst] / n_pixels
+            if ratio == 0:
+                break
+            transition_lines.append(f"{names[src]} -> {names[dst]}: {ratio*bbox_area:.2f} {unit} ({ratio*100:.2f}%)")
+
+        return self.fit(
+            f"Map Area: {bbox_area:.2f} {unit}\n"\
+            + f"Land use changed between {start_year} and {end_year} on {changed_ratio*bbox_area:.2f} {unit} ({changed_ratio*100:.2f}%)\n\n"\
+            + f"Land use shares {start_year} -> {end_year}:\n"\
+            + "\n".join(class_lines)\
+            + "\n\n" + "Largest land use transitions:\n"\
+            + ("\n".join(transition_lines) or "No changes"),
+            artifact=Artifact(
+                "raster",
+                arrays={
+                    "classes": downsample_raster(series[-1]),
+                    "palette": np.asarray(LU_PALETTE, dtype=np.uint8),
+                    "counts": counts,
+                    "transitions": transitions,
+                    "trends": trends,
+                },
+                meta={"names": names, "years": years, "n_pixels": int(n_pixels), "bounds": bounding_box.geom.bounds},
+            ),
+        )
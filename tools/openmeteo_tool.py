@@ -1,18 +1,21 @@
-import openmeteo_requests
 import pandas as pd
 import numpy as np
 
-from langchain_core.tools import BaseTool
 from pydantic import BaseModel
 from typing import Optional, Type, Literal
 
+from tools.base_tool import BudgetedTool
 from tools.input_schemas.openmeteo_schemas import OpenmeteoForecastInput
 from schemas.geometry import BoundingBox
+from utils.artifact_store import Artifact
+from utils.instrumentation import span, traced, traced_tool_run
+from utils.map_service_utils import OPENMETEO_URL, resolve_upstream_url
+from utils.deadline import request_timeout
+from utils.upstream_guard import FORECAST_FRESH_S, FORECAST_MAX_STALE_S, fetch_guarded, get_upstream
 
 GRID_SIZE = 4
-OPENMETEO_URL = "https://api.open-meteo.com/v1/forecast"
 
-class WeatherForecastTool(BaseTool):
+class WeatherForecastTool(BudgetedTool):
     name: str = "weather_forecast"
     description: str = (
         "A tool for retrieving weather forecast data based on a given bounding box. "
@@ -23,6 +26,7 @@ class WeatherForecastTool(BaseTool):
     )
     args_schema: Optional[Type[BaseModel]] = OpenmeteoForecastInput
 
+    @traced_tool_run
     def _run(self, bounding_box: BoundingBox, forecast_days: int, forecast_type: Literal["hourly", "daily"]):
         lat1, lon1, lat2, lon2 = bounding_box.bounds_latlon()
 
@@ -34,12 +38,73 @@ class WeatherForecastTool(BaseTool):
         forecast_days = max(1, min(forecast_days, 16))
         if forecast_type == "hourly":
             hourly_data = get_hourly_data(grid_points, forecast_days)
-            return f"Hourly weather data for the next {forecast_days} days:\n"\
-                + hourly_data.to_markdown(index=False) + "\n\n"
+            header = f"Hourly weather data for the next {forecast_days} days:\n"
+            return self.fit(
+                header + hourly_data.to_markdown(index=False) + "\n\n",
+                lambda: f"Daily aggregates of hourly weather data for the next {forecast_days} days:\n"
+                    + aggregate_hourly_by_day(hourly_data).to_markdown(index=False, floatfmt=".1f")
+                    + "\n\n" + describe_extremes(hourly_data, "%Y-%m-%d %H:%M"),
+                lambda: f"Summary of hourly weather data for the next {forecast_days} days:\n"
+                    + describe_extremes(hourly_data, "%Y-%m-%d %H:%M"),
+                artifact=forecast_artifact(hourly_data, "hourly"),
+            )
         elif forecast_type == "daily":
             daily_data = get_daily_data(grid_points, forecast_days)
-            return f"Daily weather data for the next {forecast_days} days:\n"\
-                + daily_data.to_markdown(index=False)
+            header = f"Daily weather data for the next {forecast_days} days:\n"
+            return self.fit(
+                header + daily_data.to_markdown(index=False),
+                lambda: header + daily_data.to_markdown(index=False, floatfmt=".1f"),
+                lambda: f"Summary of daily weather data for the next {forecast_days} days:\n"
+                    + describe_extremes(daily_data, "%Y-%m-%d"),
+                artifact=forecast_artifact(daily_data, "daily"),
+            )
+
+def forecast_artifact(data: pd.DataFrame, resolution: str) -> Artifact:
+    """Forecast variables as float32 arrays with the times in seconds since the epoch."""
+    arrays = {column: data[column].to_numpy(dtype=np.float32) for column in data.columns.drop("date")}
+    arrays["time"] = data["date"].astype("int64").to_numpy() // 10**9
+    return Artifact("forecast", arrays=arrays, meta={"resolution": resolution, "variables": list(data.columns.drop("date"))})
+
+@traced("cpu.aggregate.openmeteo_hourly_by_day")
+def aggregate_hourly_by_day(hourly_data: pd.DataFrame) -> pd.DataFrame:
+    """Daily aggregates of the hourly area summary."""
+    return hourly_data.groupby(hourly_data["date"].dt.date).agg(
+        temperature_2m_min = ("temperature_2m", "min"),
+        temperature_2m_mean = ("temperature_2m", "mean"),
+        temperature_2m_max = ("temperature_2m", "max"),
+        relative_humidity_2m = ("relative_humidity_2m", "mean"),
+        precipitation_probability_max = ("precipitation_probability", "max"),
+        precipitation_sum = ("precipitation", "sum"),
+        wind_speed_10m_max = ("wind_speed_10m", "max"),
+        wind_gusts_10m_max = ("wind_gusts_10m", "max"),
+        soil_temperature_0cm = ("soil_temperature_0cm", "mean"),
+        soil_moisture_0_to_1cm = ("soil_moisture_0_to_1cm", "mean"),
+    ).reset_index()
+
+def describe_extremes(data: pd.DataFrame, time_format: str) -> str:
+    """Mean, extremes with their time and the linear trend per day of every forecast variable."""
+    days = (data["date"] - data["date"].iloc[0]).dt.total_seconds().to_numpy() / 86400
+    lines = []
+    for column in data.columns.drop("date"):
+        # Averaged directions and the trend of durations are not meaningful
+        if "direction" in column:
+            continue
+        values = data[column].to_numpy(dtype=np.float64)
+        valid = ~np.isnan(values)
+        if not valid.any():
+            continue
+        i_min, i_max = np.nanargmin(values), np.nanargmax(values)
+        line = f"{column}: mean {np.nanmean(values):.1f}, "\
+            + f"min {values[i_min]:.1f} ({data['date'].iloc[i_min].strftime(time_format)}), "\
+            + f"max {values[i_max]:.1f} ({data['date'].iloc[i_max].strftime(time_format)})"
+        if valid.sum() > 1 and np.ptp(days[valid]) > 0 and "duration" not in column:
+            line += f", trend {np.polyfit(days[valid], values[valid], 1)[0]:+.2f}/day"
+        lines.append(line)
+    return "\n".join(lines)
+
+def forecast_key(grid_points) -> tuple:
+    # Grid points of the same area differ only by float noise
+    return tuple((round(lat, 4), round(lon, 4)) for lat, lon in grid_points)
 
 def get_hourly_data(grid_points, forecast_days) -> pd.DataFrame:
     params = {
@@ -50,9 +115,27 @@ def get_hourly_data(grid_points, forecast_days) -> pd.DataFrame:
         "timezone": "UTC"
     }
 
-    openmeteo = openmeteo_requests.Client()
-    responses = openmeteo.weather_api(OPENMETEO_URL, params=params)
+    import openmeteo_requests
+
+    url = resolve_upstream_url(OPENMETEO_URL)
+    upstream = get_upstream(url)
 
+    def fetch():
+        with span("http.openmeteo", host=upstream.host, cache_hit=False):
+            openmeteo = openmeteo_requests.Client()
+            responses = openmeteo.weather_api(url, params=params, timeout=request_timeout(upstream.timeout))
+        return aggregate_hourly_responses(responses)
+
+    return fetch_guarded(
+        url, ("hourly", url, forecast_key(grid_points), forecast_days), fetch,
+        fresh_s=FORECAST_FRESH_S, max_stale_s=FORECAST_MAX_STALE_S, nbytes=lambda df: int(df.memory_usage(deep=True).sum()),
+    )
+
+@traced("cpu.aggregate.openmeteo_hourly")
+def aggregate_hourly_responses(responses) -> pd.DataFrame:
+    """
+    Averages hourly data of all grid point responses into one area summary. Precipitation is summed.
+    """
     all_df = pd.DataFrame()
     # Process all locations
     for response in responses:
@@ -113,9 +196,27 @@ def get_daily_data(grid_points, forecast_days) -> pd.DataFrame:
         "timezone": "UTC"
     }
 
-    openmeteo = openmeteo_requests.Client()
-    responses = openmeteo.weather_api(OPENMETEO_URL, params=params)
+    import openmeteo_requests
+
+    url = resolve_upstream_url(OPENMETEO_URL)
+    upstream = get_upstream(url)
+
+    def fetch():
+        with span("http.openmeteo", host=upstream.host, cache_hit=False):
+            openmeteo = openmeteo_requests.Client()
+            responses = openmeteo.weather_api(url, params=params, timeout=request_timeout(upstream.timeout))
+        return aggregate_daily_responses(responses)
+
+    return fetch_guarded(
+        url, ("daily", url, forecast_key(grid_points), forecast_days), fetch,
+        fresh_s=FORECAST_FRESH_S, max_stale_s=FORECAST_MAX_STALE_S, nbytes=lambda df: int(df.memory_usage(deep=True).sum()),
+    )
 
+@traced("cpu.aggregate.openmeteo_daily")
+def aggregate_daily_responses(responses) -> pd.DataFrame:
+    """
+    Averages daily data of all grid point responses into one area summary. Precipitation is summed.
+    """
     all_df = pd.DataFrame()
 
     for response in responses:
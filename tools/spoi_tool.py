@@ -1,19 +1,84 @@
 from typing import Optional, Type
 
-from langchain_core.tools import BaseTool
+import numpy as np
 from pydantic import BaseModel
 
+from tools.base_tool import BudgetedTool
 from tools.input_schemas.base_schemas import BaseGeomInput
-from schemas.geometry import BoundingBox
-from utils.tool_utils import get_spoi_data
+from tools.input_schemas.spoi_schemas import SpoiProximityInput
+from schemas.geometry import BoundingBox, PointMarker
+from utils.artifact_store import Artifact
+from utils.instrumentation import traced_tool_run
+from utils.spoi_index import get_spoi_index
 
+# Example labels shown for every category of a summarized area
+SAMPLES_PER_CATEGORY = 3
+# Categories listed when even the per category summary is over the token budget
+SUMMARY_TOP_CATEGORIES = 15
 
-class SpoiTool(BaseTool):
+
+class SpoiTool(BudgetedTool):
     name: str = "get_smart_points_of_interest"
     description: str = "Get processed data about points of interest in the selected area."
     args_schema: Optional[Type[BaseModel]] = BaseGeomInput
 
+    @traced_tool_run
     def _run(self, bounding_box: BoundingBox):
-        spoi_data = get_spoi_data(bounding_box)
-        return f"Number of points of interest: {len(spoi_data['features'])}"\
-            + "\n\n" + "\n".join([f"{poi['properties']['cat'][str.rfind(poi['properties']['cat'], '#')+1:]} - {poi['properties']['label']}" for poi in spoi_data['features']])
\ No newline at end of file
+        spoi = get_spoi_index(bounding_box.wkt).spoi
+        categories, category_ids, labels = spoi["categories"], spoi["category_ids"], spoi["labels"]
+        n_pois = len(labels)
+        total = f"at least {n_pois}" if spoi["truncated"] else str(n_pois)
+
+        counts = np.bincount(category_ids, minlength=len(categories))
+        order = np.argsort(-counts, kind="stable")
+        order = order[counts[order] > 0]
+
+        def by_category(top: int | None, samples: int) -> str:
+            category_lines = []
+            for cat in order[:top]:
+                examples = [labels[i] for i in np.flatnonzero(category_ids == cat)[:samples]]
+                category_lines.append(f"{categories[cat]}: {counts[cat]}" + (f" (e.g. {', '.join(examples)})" if examples else ""))
+            if top is not None and len(order) > top:
+                category_lines.append(f"{len(order) - top} other categories: {counts[order[top:]].sum()}")
+            return f"Number of points of interest: {total}"\
+                + "\n\n" + "Points of interest by category:\n"\
+                + "\n".join(category_lines)
+
+        return self.fit(
+            f"Number of points of interest: {total}"\
+                + "\n\n" + "\n".join([f"{categories[cat]} - {label}" for cat, label in zip(category_ids, labels)]),
+            lambda: by_category(None, SAMPLES_PER_CATEGORY),
+            lambda: by_category(SUMMARY_TOP_CATEGORIES, 0),
+            artifact=Artifact(
+                "points",
+                arrays={"coords": spoi["coords"].astype(np.float32), "category_ids": category_ids},
+                meta={"categories": categories, "labels": labels, "truncated": spoi["truncated"]},
+            ),
+        )
+
+
+class SpoiProximityTool(BudgetedTool):
+    name: str = "get_points_of_interest_near_marker"
+    description: str = "Get points of interest near the marked site: nearest points of interest, their number within a radius and distance to the nearest amenity of every category."
+    args_schema: Optional[Type[BaseModel]] = SpoiProximityInput
+
+    @traced_tool_run
+    def _run(self, bounding_box: BoundingBox, hotel_site_marker: PointMarker, radius_m: int = 500, k: int = 5, category: Optional[str] = None):
+        if hotel_site_marker is None:
+            return self.fit("No hotel site marker specified.")
+        if not bounding_box.geom.contains(hotel_site_marker.geom):
+            return self.fit("The marked site is outside of the selected area.")
+
+        index = get_spoi_index(bounding_box.wkt)
+        within = index.count_within(hotel_site_marker, radius_m)
+        nearest = index.nearest(hotel_site_marker, k, category)
+        distances = index.distance_to_nearest(hotel_site_marker)
+
+        return self.fit(
+            f"Points of interest within {radius_m} m of the marked site: {sum(within.values())}"\
+            + ("\n" + ", ".join(f"{cat}: {cnt}" for cat, cnt in within.items()) if within else "")\
+            + "\n\n" + f"Nearest points of interest{f' ({category})' if category else ''}:\n"\
+            + ("\n".join(f"{label} ({cat}) - {dist:.0f} m" for cat, label, dist in nearest) or "None in the selected area")\
+            + "\n\n" + "Distance to the nearest point of interest by category:\n"\
+            + "\n".join(f"{cat}: {dist:.0f} m" for cat, dist in distances.items())
+        )
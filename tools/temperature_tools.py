@@ -1,48 +1,144 @@
+from collections import OrderedDict
 from datetime import datetime
+import threading
 from typing import Optional, Type
 import requests
 
 import numpy as np
 import pandas as pd
-from langchain_core.tools import BaseTool
 from pydantic import BaseModel
 
+from tools.base_tool import BudgetedTool
 from tools.input_schemas.temperature_schemas import TemperatureAnalysisInput, TemeperatureForecastInput
 from schemas.geometry import BoundingBox
-from utils.tool_utils import get_map
-
-
-class TemperatureAnalysisTool(BaseTool):
+from utils.artifact_store import Artifact
+from utils.instrumentation import span, traced_tool_run
+from utils.map_service_utils import OPENMETEO_URL, map_config, resolve_upstream_url
+from utils.tool_utils import get_raster_mean, map_concurrently
+from utils.deadline import get_degradations, request_timeout
+from utils.upstream_guard import FORECAST_FRESH_S, FORECAST_MAX_STALE_S, fetch_guarded, get_upstream
+
+CLIMATE_ENDPOINTS = {
+    "last_5yrs": "climate_era5_temperature_last_5yrs_month_avg",
+    "2050s": "climate_ipcc_rcp45_temperature_2050s_month_avg",
+}
+SEASONS = {
+    "winter": ["12", "01", "02"],
+    "spring": ["03", "04", "05"],
+    "summer": ["06", "07", "08"],
+    "autumn": ["09", "10", "11"],
+}
+# Bounding boxes whose monthly means are kept
+MONTHLY_CACHE_SIZE = 128
+
+_monthly_means: OrderedDict[tuple[str, str], dict[str, float]] = OrderedDict()
+_monthly_means_lock = threading.Lock()
+
+def resolve_months(month: str | None = None, months: list[str] | None = None, season: str | None = None) -> list[str]:
+    """Selected months as MM strings, a season takes precedence over months. Empty if nothing is selected."""
+    if season is not None:
+        return SEASONS[season]
+    selected = months or ([month] if month else [])
+    return list(dict.fromkeys(f"{int(m):02d}" for m in selected))
+
+def get_monthly_temperatures(bounding_box: BoundingBox, endpoint: str, months: list[str]) -> dict[str, float]:
+    """
+    Mean temperature of the bounding box per month. Means are cached per bounding box and layer,
+    the months not cached yet are fetched concurrently.
+    """
+    key = (bounding_box.wkt, endpoint)
+    with _monthly_means_lock:
+        cached = dict(_monthly_means.get(key, {}))
+    missing = [m for m in months if m not in cached]
+    with span("cache.monthly_temperatures", layer=endpoint, cache_hit=not missing):
+        if missing:
+            times = {time[4:6]: time for time in map_config[endpoint]["alternatives"]["TIME"]}
+            values = map_concurrently(lambda m: get_raster_mean(bounding_box, endpoint, {"TIME": times[m]}), missing)
+            cached.update(zip(missing, values))
+            # Means of maps degraded near the deadline are not kept
+            if get_degradations():
+                return {m: cached[m] for m in months}
+            with _monthly_means_lock:
+                _monthly_means.setdefault(key, {}).update(zip(missing, values))
+                _monthly_means.move_to_end(key)
+                while len(_monthly_means) > MONTHLY_CACHE_SIZE:
+                    _monthly_means.popitem(last=False)
+    return {m: cached[m] for m in months}
+
+def describe_monthly_temperatures(bounding_box: BoundingBox, months: list[str], period: str, compare: bool, season: str | None) -> str:
+    periods = list(CLIMATE_ENDPOINTS) if compare else [period]
+    results = dict(zip(periods, map_concurrently(
+        lambda p: get_monthly_temperatures(bounding_box, CLIMATE_ENDPOINTS[p], months), periods
+    )))
+
+    def describe(values: dict[str, float], label: str) -> str:
+        if not compare:
+            return f"{label}: {values[period]:.2f} °C"
+        recent, future = values["last_5yrs"], values["2050s"]
+        return f"{label}: last 5 years {recent:.2f} °C, 2050s {future:.2f} °C, change {future - recent:+.2f} °C"
+
+    header = {
+        "last_5yrs": "Average temperature calculated from the last five years",
+        "2050s": "Predicted average temperature in 2050s",
+    }[period] if not compare else "Average temperature in the last five years compared to the 2050s prediction"
+    lines = [
+        describe({p: results[p][m] for p in periods}, datetime.strptime(m, "%m").strftime("%B"))
+        for m in months
+    ]
+    if len(months) > 1:
+        label = f"Average over {season}" if season else "Average over the selected months"
+        lines.append(describe({p: float(np.mean(list(results[p].values()))) for p in periods}, label))
+    return f"{header}:\n" + "\n".join(lines)
+
+
+class TemperatureAnalysisTool(BudgetedTool):
     name: str = "get_monthly_average_temperature_last_5yrs"
-    description: str = "Get monthly average temperature data calculated from the last five years."
+    description: str = (
+        "Get monthly average temperature data calculated from the last five years. "
+        "Accepts one month, several months or a season, and can compare them with the 2050s prediction."
+    )
     args_schema: Optional[Type[BaseModel]] = TemperatureAnalysisInput
 
-    def _run(self, bounding_box: BoundingBox, month: str) -> str:
-        image = get_map(bounding_box, "climate_era5_temperature_last_5yrs_month_avg", {"TIME": f"2020{month}01"})
-        
-        month_name = datetime.strptime(month, "%m").strftime("%B")
-        return f"Average temperature in {month_name}: {np.array(image).mean():.2f} °C"
+    @traced_tool_run
+    def _run(self, bounding_box: BoundingBox, month: str | None = None, months: list[str] | None = None, season: str | None = None, compare: bool = False) -> tuple[str, dict | None]:
+        selected = resolve_months(month, months, season)
+        if not selected:
+            return self.fit("No period selected, provide a month, a list of months or a season.")
+        if len(selected) == 1 and not compare:
+            temperature = get_monthly_temperatures(bounding_box, CLIMATE_ENDPOINTS["last_5yrs"], selected)[selected[0]]
+            month_name = datetime.strptime(selected[0], "%m").strftime("%B")
+            return self.fit(f"Average temperature in {month_name}: {temperature:.2f} °C")
+        return self.fit(describe_monthly_temperatures(bounding_box, selected, "last_5yrs", compare, season))
 
 
-class TemperatureLongPredictionTool(BaseTool):
+class TemperatureLongPredictionTool(BudgetedTool):
     name: str = "get_monthly_average_temperature_prediction_2050s"
-    description: str = "Get long term forecast of monthly average temperature viable for 2050s."
+    description: str = (
+        "Get long term forecast of monthly average temperature viable for 2050s. "
+        "Accepts one month, several months or a season, and can compare them with the last five years."
+    )
     args_schema: Optional[Type[BaseModel]] = TemperatureAnalysisInput
 
-    def _run(self, bounding_box: BoundingBox, month: str) -> str:
-        image = get_map(bounding_box, "climate_ipcc_rcp45_temperature_2050s_month_avg", {"TIME": f"2030{month}01"})
-    
-        month_name = datetime.strptime(month, "%m").strftime("%B")
-        return f"Predicted average temperature in {month_name} in 2050s: {np.array(image).mean():.2f} °C"
+    @traced_tool_run
+    def _run(self, bounding_box: BoundingBox, month: str | None = None, months: list[str] | None = None, season: str | None = None, compare: bool = False) -> tuple[str, dict | None]:
+        selected = resolve_months(month, months, season)
+        if not selected:
+            return self.fit("No period selected, provide a month, a list of months or a season.")
+        if len(selected) == 1 and not compare:
+            temperature = get_monthly_temperatures(bounding_box, CLIMATE_ENDPOINTS["2050s"], selected)[selected[0]]
+            month_name = datetime.strptime(selected[0], "%m").strftime("%B")
+            return self.fit(f"Predicted average temperature in {month_name} in 2050s: {temperature:.2f} °C")
+        return self.fit(describe_monthly_temperatures(bounding_box, selected, "2050s", compare, season))
     
 
-class TemperatureForecastTool(BaseTool):
+class TemperatureForecastTool(BudgetedTool):
     name: str = "predict_temperature"
     description: str = "Predict daily minimum, maximum, and mean temperatures for a selected area starting from today's date. Provide forecasts for up to 16 days."
     args_schema: Optional[Type[BaseModel]] = TemeperatureForecastInput
 
+    @traced_tool_run
     def _run(self, bounding_box: BoundingBox, forecast_days: int):
-        api_url = "https://api.open-meteo.com/v1/forecast"
+        api_url = resolve_upstream_url(OPENMETEO_URL)
 
         center = bounding_box.center
 
@@ -56,14 +152,26 @@ class TemperatureForecastTool(BaseTool):
             "timezone": "UTC",
         }
 
-        response = requests.get(api_url, params=params)
+        upstream = get_upstream(api_url)
+
+        def fetch():
+            with span("http.openmeteo", host=upstream.host) as record:
+                response = requests.get(api_url, params=params, timeout=request_timeout(upstream.timeout))
+                response.raise_for_status()
+                record.update(status=response.status_code, bytes=len(response.content), cache_hit=False)
+            return response.json()
+
+        data = fetch_guarded(
+            api_url, (api_url, tuple((k, str(v)) for k, v in params.items())), fetch,
+            fresh_s=FORECAST_FRESH_S, max_stale_s=FORECAST_MAX_STALE_S, nbytes=lambda data: len(str(data)),
+        )
 
         if forecast_days == 0:
-            current_data = response.json()['current']
+            current_data = data['current']
             formatted_time = datetime.strptime(current_data['time'], '%Y-%m-%dT%H:%M').strftime('%Y-%m-%d')
-            return f"Current temperature ({formatted_time}): {current_data['temperature_2m']:.2f} °C"
+            return self.fit(f"Current temperature ({formatted_time}): {current_data['temperature_2m']:.2f} °C")
 
-        df = pd.DataFrame(response.json()["hourly"])
+        df = pd.DataFrame(data["hourly"])
         df['time'] = pd.to_datetime(df['time'])
         df.set_index('time', inplace=True)
         df_daily = df.resample('D').agg({
@@ -71,8 +179,24 @@ class TemperatureForecastTool(BaseTool):
         })
         df_daily.columns = ['daily_min', 'daily_max', 'daily_mean']
 
-        return f"Temperature predictions for the next {forecast_days} days, including today:\n"\
+        coldest, warmest = df_daily['daily_min'].idxmin(), df_daily['daily_max'].idxmax()
+        return self.fit(
+            f"Temperature predictions for the next {forecast_days} days, including today:\n"\
             + '\n'.join(
                 f"{dtime.strftime('%Y-%m-%d')}: min: {row['daily_min']:.2f} °C, max: {row['daily_max']:.2f} °C, mean: {row['daily_mean']:.2f} °C"
                 for dtime, row in df_daily.iterrows()
-            )
\ No newline at end of file
+            ),
+            lambda: f"Temperature predictions for the next {forecast_days} days, including today:\n"\
+                + f"Mean: {df_daily['daily_mean'].mean():.1f} °C\n"\
+                + f"Lowest: {df_daily.loc[coldest, 'daily_min']:.1f} °C ({coldest.strftime('%Y-%m-%d')})\n"\
+                + f"Highest: {df_daily.loc[warmest, 'daily_max']:.1f} °C ({warmest.strftime('%Y-%m-%d')})\n"\
+                + f"Daily means: " + ", ".join(f"{t:.1f}" for t in df_daily['daily_mean']),
+            artifact=Artifact(
+                "forecast",
+                arrays={
+                    "time": df_daily.index.astype("int64").to_numpy() // 10**9,
+                    **{column: df_daily[column].to_numpy(dtype=np.float32) for column in df_daily.columns},
+                },
+                meta={"resolution": "daily", "variables": list(df_daily.columns)},
+            ),
+        )
\ No newline at end of file
@@ -1,26 +1,30 @@
 from typing import Optional, Type
 
+import numpy as np
 import pandas as pd
-from langchain_core.tools import BaseTool
 from pydantic import BaseModel
 
+from tools.base_tool import BudgetedTool
 from tools.input_schemas.base_schemas import BaseGeomInput
 from schemas.geometry import BoundingBox
+from utils.artifact_store import Artifact
+from utils.instrumentation import traced_tool_run
 from utils.tool_utils import get_region_tourism_data
 
 
-class TourismTool(BaseTool):
+class TourismTool(BudgetedTool):
     name: str = "get_tourism_data"
     description: str = "Get historical tourism data for regions based on given coordinates."
     args_schema: Optional[Type[BaseModel]] = BaseGeomInput
 
+    @traced_tool_run
     def _run(self, bounding_box: BoundingBox):
         data, region_name = get_region_tourism_data(bounding_box)
     
         if data is None:
             if region_name is None:
-                return "There is no existing tourism data for the selected region"
-            return f"There is no existing tourism data for region {region_name}"
+                return self.fit("There is no existing tourism data for the selected region")
+            return self.fit(f"There is no existing tourism data for region {region_name}")
 
         pds = pd.DataFrame.from_dict(data, orient="index").loc[:, 'all_guests'].astype(float).astype(int)
         pds.index = pds.index.astype(int)
@@ -28,4 +32,11 @@ class TourismTool(BaseTool):
         tourism_data_string = f"Tourism data for region {region_name}:\n\n"\
             + "Number of all guests for recent years:\n"\
             + "\n".join([f"{k}: {v}" for k,v in pds.items()])
-        return tourism_data_string
+        return self.fit(
+            tourism_data_string,
+            artifact=Artifact(
+                "series",
+                arrays={"x": pds.index.to_numpy(dtype=np.int64), "y": pds.to_numpy(dtype=np.int64)},
+                meta={"x": "year", "y": "all_guests", "region": str(region_name)},
+            ),
+        )
@@ -1,48 +1,114 @@
 import configparser
+from functools import lru_cache
+import time
+import uuid
 
-from langchain_openai import ChatOpenAI
-from langchain_ollama import ChatOllama
-from langchain_groq import ChatGroq
-from langchain_core.chat_history import InMemoryChatMessageHistory
 from langchain_core.language_models import BaseChatModel
-import streamlit as st
+from langchain_core.runnables import RunnableConfig
 
 from paths import PROJECT_ROOT
+from utils.artifact_store import Artifact, SQLiteArtifactStore
+from utils.chat_history_store import SQLiteChatMessageHistory
+from utils.deadline import ANSWER_RESERVE_S, DeadlineExceeded, deadline_scope, get_deadline
+from utils.session_store import SessionStore, StreamlitSessionStore, get_session_store
 
 cfg = configparser.ConfigParser()
 cfg.read(f'{PROJECT_ROOT}/config.ini')
 
-# TODO - Add session id key for history, if we will store all the conversations during a session
-def get_chat_history() -> InMemoryChatMessageHistory:
-    if f'chat_history' not in st.session_state:
-        st.session_state[f'chat_history'] = InMemoryChatMessageHistory()
-    return st.session_state[f'chat_history']
+def get_chat_history(session: SessionStore | None = None) -> SQLiteChatMessageHistory:
+    """
+    Persistent chat history of the session, identified by its `session_id` (a new id is assigned if missing).
+    """
+    session = session if session is not None else StreamlitSessionStore()
+    if 'chat_history' not in session:
+        session_id = session.setdefault('session_id', uuid.uuid4().hex)
+        session['chat_history'] = SQLiteChatMessageHistory(session_id)
+    return session['chat_history']
+
+def clear_chat_history(session: SessionStore | None = None):
+    get_chat_history(session).clear()
+    get_artifact_store(session).clear()
+
+def get_artifact_store(session: SessionStore | None = None) -> SQLiteArtifactStore:
+    """Store of tool artifacts of the session, shares the session id with the chat history."""
+    session = session if session is not None else StreamlitSessionStore()
+    if 'artifact_store' not in session:
+        session['artifact_store'] = SQLiteArtifactStore(get_chat_history(session).session_id)
+    return session['artifact_store']
+
+def create_tool_node():
+    """
+    Graph node running the geo tools within the question deadline. Artifacts returned by the tools are moved
+    to the session artifact store, tool messages keep only a reference to them.
+    """
+    import requests
+    from langgraph.prebuilt import ToolNode
+    from langgraph.prebuilt.tool_node import ToolInvocationError
+    from tools import get_all_tools
+    from utils.upstream_guard import UpstreamUnavailable
 
-def clear_chat_history():
-    st.session_state[f'chat_history'] = InMemoryChatMessageHistory()
+    def handle_tool_error(e: Exception) -> str:
+        # Tool errors are returned to the model instead of failing the whole question
+        if isinstance(e, (DeadlineExceeded, UpstreamUnavailable, requests.Timeout)):
+            return f"The data could not be retrieved in time ({e}). Answer without it and say which data is missing."
+        if isinstance(e, ToolInvocationError):
+            return e.message
+        return f"Error: {e!r}, please fix your mistakes."
 
+    tool_node = ToolNode(get_all_tools(), handle_tool_errors=handle_tool_error)
+
+    def call_tools(state, config: RunnableConfig):
+        with deadline_scope(get_deadline(config)):
+            output = tool_node.invoke(state, config)
+        artifacts = get_artifact_store(get_session_store(config))
+        for message in output["messages"]:
+            if isinstance(getattr(message, "artifact", None), Artifact):
+                message.artifact = artifacts.put(message.artifact)
+        return output
+    return call_tools
+
+def get_llm_within_deadline(config: RunnableConfig) -> BaseChatModel:
+    """Model with the geo tools, or without them once only the time for the final answer is left."""
+    deadline = get_deadline(config)
+    if deadline is not None and deadline - time.monotonic() < ANSWER_RESERVE_S:
+        return get_llm()
+    return get_llm_with_tools()
+
+@lru_cache(maxsize=1)
 def get_llm() -> BaseChatModel:
     """
     Returns the LLM model based on project configuration. Currently supports OpenAI, Ollama and Groq.
+    Only the configured provider package is imported.
     """
     provider = cfg['DEFAULT']['llm_provider']
 
     if provider == 'openai':
+        from langchain_openai import ChatOpenAI
         return ChatOpenAI(
                     model=cfg['OPENAI']['model_id'],
                     temperature=0,
                     max_retries=2,
                 )
     if provider == 'ollama':
+        from langchain_ollama import ChatOllama
         return ChatOllama(
                     model=cfg['OLLAMA']['model_id'],
                     temperature=0,
                     max_retries=2,
                 )
     if provider == 'groq':
+        from langchain_groq import ChatGroq
         return ChatGroq(
                     model=cfg['GROQ']['model_id'],
                     temperature=0,
                     max_retries=2,
                 )
-    raise ValueError(f"Unknown LLM provider: {provider}")
\ No newline at end of file
+    raise ValueError(f"Unknown LLM provider: {provider}")
+
+@lru_cache(maxsize=1)
+def get_llm_with_tools():
+    """
+    Returns the configured LLM with all geo tools bound. Shared by both agents.
+    """
+    from tools import get_all_tools
+    return get_llm().bind_tools(get_all_tools())
@@ -0,0 +1,69 @@
+from dataclasses import dataclass, field
+from io import BytesIO
+import json
+import uuid
+
+import numpy as np
+
+from utils.chat_history_store import ChatHistoryDatabase, get_chat_history_database
+from utils.instrumentation import span
+
+# Largest side of raster artifacts, rasters are downsampled by striding
+MAX_RASTER_SIDE = 256
+
+
+@dataclass
+class Artifact:
+    """
+    Structured data behind a tool output, reusable by the UI without fetching it again.
+
+    Attributes:
+        kind: How to render the data, e.g. "class_counts", "raster", "forecast", "points", "series" or "text"
+        arrays: Numeric data, stored as compressed numpy arrays
+        meta: JSON serializable description (names, units, bounds, ...)
+    """
+    kind: str
+    arrays: dict[str, np.ndarray] = field(default_factory=dict)
+    meta: dict = field(default_factory=dict)
+
+    def to_bytes(self) -> bytes:
+        buffer = BytesIO()
+        np.savez_compressed(buffer, **self.arrays)
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, kind: str, meta: str, data: bytes) -> "Artifact":
+        with np.load(BytesIO(data), allow_pickle=False) as npz:
+            arrays = {name: npz[name] for name in npz.files}
+        return cls(kind, arrays, json.loads(meta))
+
+def downsample_raster(raster: np.ndarray, max_side: int = MAX_RASTER_SIDE) -> np.ndarray:
+    step = max(1, -(-max(raster.shape[:2]) // max_side))
+    return np.ascontiguousarray(raster[::step, ::step])
+
+
+class SQLiteArtifactStore:
+    """Artifacts of one session, stored in the chat history database and referenced from tool messages by id."""
+    def __init__(self, session_id: str, db: ChatHistoryDatabase | None = None):
+        self.session_id = session_id
+        self.db = db if db is not None else get_chat_history_database()
+
+    def put(self, artifact: Artifact) -> dict:
+        """Stores the artifact, returns the reference kept in the tool message."""
+        id = uuid.uuid4().hex
+        with span("io.artifacts.put", bytes=sum(a.nbytes for a in artifact.arrays.values())), self.db.connection as conn:
+            conn.execute(
+                "INSERT INTO artifacts (session_id, id, kind, meta, data) VALUES (?, ?, ?, ?, ?)",
+                (self.session_id, id, artifact.kind, json.dumps(artifact.meta, ensure_ascii=False, default=str), artifact.to_bytes()),
+            )
+        return {"artifact_id": id, "kind": artifact.kind}
+
+    def get(self, id: str) -> Artifact | None:
+        row = self.db.connection.execute(
+            "SELECT kind, meta, data FROM artifacts WHERE session_id = ? AND id = ?", (self.session_id, id)
+        ).fetchone()
+        return Artifact.from_bytes(*row) if row else None
+
+    def clear(self):
+        with self.db.connection as conn:
+            conn.execute("DELETE FROM artifacts WHERE session_id = ?", (self.session_id,))
@@ -0,0 +1,185 @@
+import configparser
+from functools import lru_cache
+import json
+import os
+import sqlite3
+import threading
+from typing import Sequence
+import uuid
+import zlib
+
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import AIMessage, AnyMessage, HumanMessage, SystemMessage, ToolMessage
+
+from paths import PROJECT_ROOT
+from utils.instrumentation import span
+
+cfg = configparser.ConfigParser()
+cfg.read(f'{PROJECT_ROOT}/config.ini')
+
+CHAT_HISTORY_PATH = os.path.join(PROJECT_ROOT, cfg.get('CHAT_HISTORY', 'path', fallback='data/chat_history.sqlite'))
+# Serialized messages above this size are stored zlib compressed
+COMPRESS_MIN_BYTES = cfg.getint('CHAT_HISTORY', 'compress_min_bytes', fallback=512)
+
+MESSAGE_TYPES = {
+    "human": HumanMessage,
+    "ai": AIMessage,
+    "tool": ToolMessage,
+    "system": SystemMessage,
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    session_id TEXT NOT NULL,
+    id TEXT NOT NULL,
+    seq INTEGER,
+    type TEXT NOT NULL,
+    compressed INTEGER NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (session_id, id)
+) WITHOUT ROWID;
+CREATE UNIQUE INDEX IF NOT EXISTS messages_seq ON messages (session_id, seq);
+CREATE TABLE IF NOT EXISTS artifacts (
+    session_id TEXT NOT NULL,
+    id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    meta TEXT NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (session_id, id)
+) WITHOUT ROWID;
+"""
+
+def dump_message(message: AnyMessage) -> tuple[str, int, bytes]:
+    """
+    Compact form of a message: fields with default values are left out, extra attributes set by the agents
+    and the UI (run_id, alternative_id, timings, ...) are kept. Returns (type, compressed, data).
+    """
+    fields = message.model_dump(exclude_defaults=True, exclude={"id", "type"})
+    data = json.dumps(fields, ensure_ascii=False, separators=(",", ":"), default=str).encode()
+    if len(data) >= COMPRESS_MIN_BYTES:
+        return message.type, 1, zlib.compress(data)
+    return message.type, 0, data
+
+def load_message(id: str, type: str, compressed: int, data: bytes) -> AnyMessage:
+    fields = json.loads(zlib.decompress(data) if compressed else data)
+    return MESSAGE_TYPES[type](id=id, **fields)
+
+
+class ChatHistoryDatabase:
+    """
+    SQLite database with the messages and tool artifacts of all sessions. Messages in the history of a session have
+    a sequence number, alternative responses not shown in the history are stored without one. Every thread uses its own connection.
+    """
+    def __init__(self, path: str = CHAT_HISTORY_PATH):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self.connection as conn:
+            conn.executescript(SCHEMA)
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+
+class SQLiteChatMessageHistory(BaseChatMessageHistory):
+    """
+    Chat history of one session persisted in the chat history database. Messages are not kept in memory,
+    they are loaded on access: all of them for the model, only the tail for display.
+    """
+    def __init__(self, session_id: str, db: ChatHistoryDatabase | None = None):
+        self.session_id = session_id
+        self.db = db if db is not None else get_chat_history_database()
+
+    @property
+    def messages(self) -> list[AnyMessage]:
+        with span("io.chat_history.load"):
+            rows = self.db.connection.execute(
+                "SELECT id, type, compressed, data FROM messages WHERE session_id = ? AND seq IS NOT NULL ORDER BY seq",
+                (self.session_id,),
+            ).fetchall()
+        return [load_message(*row) for row in rows]
+
+    def tail(self, limit: int) -> list[AnyMessage]:
+        """Last `limit` messages of the history, oldest first."""
+        rows = self.db.connection.execute(
+            "SELECT id, type, compressed, data FROM messages WHERE session_id = ? AND seq IS NOT NULL ORDER BY seq DESC LIMIT ?",
+            (self.session_id, limit),
+        ).fetchall()
+        return [load_message(*row) for row in reversed(rows)]
+
+    def __len__(self) -> int:
+        return self.db.connection.execute(
+            "SELECT COUNT(*) FROM messages WHERE session_id = ? AND seq IS NOT NULL", (self.session_id,)
+        ).fetchone()[0]
+
+    def get_message(self, id: str) -> AnyMessage | None:
+        """Message of the history or an alternative response by id."""
+        row = self.db.connection.execute(
+            "SELECT id, type, compressed, data FROM messages WHERE session_id = ? AND id = ?", (self.session_id, id)
+        ).fetchone()
+        return load_message(*row) if row else None
+
+    def add_messages(self, messages: Sequence[AnyMessage]) -> None:
+        """Appends messages to the history, messages already stored under the same id are updated in place."""
+        with span("io.chat_history.add"), self.db.connection as conn:
+            next_seq = conn.execute(
+                "SELECT COALESCE(MAX(seq), -1) + 1 FROM messages WHERE session_id = ?", (self.session_id,)
+            ).fetchone()[0]
+            for seq, message in enumerate(messages, start=next_seq):
+                self._upsert(conn, message, seq)
+
+    def add_alternative(self, message: AnyMessage):
+        """Stores a message outside the history, it can be looked up by id or swapped in later."""
+        with self.db.connection as conn:
+            self._upsert(conn, message, None)
+
+    def update_message(self, message: AnyMessage):
+        """Persists changed attributes of a stored message."""
+        with self.db.connection as conn:
+            conn.execute(
+                "UPDATE messages SET type = ?, compressed = ?, data = ? WHERE session_id = ? AND id = ?",
+                (*dump_message(message), self.session_id, message.id),
+            )
+
+    def swap(self, history_id: str, alternative_id: str):
+        """
+        Replaces a message of the history by an alternative one, which takes over its position.
+        Raises KeyError if either message is not stored in the session, e.g. after the history was cleared.
+        """
+        with self.db.connection as conn:
+            row = conn.execute(
+                "SELECT seq FROM messages WHERE session_id = ? AND id = ?", (self.session_id, history_id)
+            ).fetchone()
+            if row is None or row[0] is None:
+                raise KeyError(f"Message {history_id} is not in the history of session {self.session_id}")
+            if conn.execute(
+                "SELECT 1 FROM messages WHERE session_id = ? AND id = ?", (self.session_id, alternative_id)
+            ).fetchone() is None:
+                raise KeyError(f"Alternative message {alternative_id} is not stored in session {self.session_id}")
+            (seq,) = row
+            conn.execute("UPDATE messages SET seq = NULL WHERE session_id = ? AND id = ?", (self.session_id, history_id))
+            conn.execute("UPDATE messages SET seq = ? WHERE session_id = ? AND id = ?", (seq, self.session_id, alternative_id))
+
+    def clear(self) -> None:
+        with self.db.connection as conn:
+            conn.execute("DELETE FROM messages WHERE session_id = ?", (self.session_id,))
+
+    def _upsert(self, conn: sqlite3.Connection, message: AnyMessage, seq: int | None):
+        if message.id is None:
+            message.id = str(uuid.uuid4())
+        conn.execute(
+            "INSERT INTO messages (session_id, id, seq, type, compressed, data) VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (session_id, id) DO UPDATE SET type = excluded.type, compressed = excluded.compressed, data = excluded.data",
+            (self.session_id, message.id, seq, *dump_message(message)),
+        )
+
+@lru_cache(maxsize=1)
+def get_chat_history_database() -> ChatHistoryDatabase:
+    return ChatHistoryDatabase()
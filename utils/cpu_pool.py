@@ -0,0 +1,93 @@
+import configparser
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+from multiprocessing import shared_memory
+import os
+import threading
+
+import numpy as np
+
+from paths import PROJECT_ROOT
+
+cfg = configparser.ConfigParser()
+cfg.read(f'{PROJECT_ROOT}/config.ini')
+
+_offload_enabled = cfg.getboolean('PROCESSING', 'cpu_offload', fallback=True)
+# Worker processes, 0 sizes the pool from the CPU count leaving one core to the server
+CPU_WORKERS = cfg.getint('PROCESSING', 'cpu_workers', fallback=0) or max(1, (os.cpu_count() or 2) - 1)
+# Tasks submitted or running at once, further callers wait for a free slot
+CPU_QUEUE = cfg.getint('PROCESSING', 'cpu_queue', fallback=0) or 2 * CPU_WORKERS
+# Smaller arrays are processed in the calling thread, the transfer would cost more than it saves
+OFFLOAD_MIN_BYTES = cfg.getint('PROCESSING', 'cpu_offload_min_kb', fallback=512) * 1024
+
+_pool = None
+_pool_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(CPU_QUEUE)
+
+def get_cpu_pool() -> ProcessPoolExecutor:
+    """
+    Process pool shared by all sessions. Workers are started by a fork server, so they do not inherit
+    the threads of the web server.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+            _pool = ProcessPoolExecutor(max_workers=CPU_WORKERS, mp_context=context, initializer=_init_worker)
+        return _pool
+
+def set_offload_enabled(enabled: bool):
+    """Switches offloading off, e.g. in processes that are already workers of another pool."""
+    global _offload_enabled
+    _offload_enabled = enabled
+
+def shutdown_cpu_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(cancel_futures=True)
+            _pool = None
+
+def start_cpu_workers():
+    """Starts all workers of the pool ahead of the first task, does nothing when offloading is disabled."""
+    if _offload_enabled:
+        list(get_cpu_pool().map(_worker_pid, range(CPU_WORKERS)))
+
+def _worker_pid(_) -> int:
+    return os.getpid()
+
+def _init_worker():
+    # Import the raster helpers and build the palette lookup once per worker instead of on the first task
+    from utils.tool_utils import LU_PALETTE, get_palette_lookup
+    get_palette_lookup(LU_PALETTE.tobytes())
+
+def _run_shared(func, name: str, shape: tuple, dtype: str, args: tuple):
+    # Workers share the resource tracker of the parent, which owns and unlinks the block
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        array = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+        result = func(array, *args)
+        del array
+        return result
+    finally:
+        block.close()
+
+def run_cpu_task(func, array: np.ndarray, *args):
+    """
+    Returns `func(array, *args)` computed in the worker pool. The array is copied once into shared memory
+    instead of being pickled, the (small) result is pickled back. `func` must be a module level function.
+    Small arrays, or all arrays when offloading is disabled, are processed in the calling thread.
+    """
+    if not _offload_enabled or array.nbytes < OFFLOAD_MIN_BYTES:
+        return func(array, *args)
+
+    with _slots:
+        block = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+        try:
+            np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+            future = get_cpu_pool().submit(_run_shared, func, block.name, array.shape, array.dtype.str, args)
+            return future.result()
+        finally:
+            block.close()
+            block.unlink()
@@ -0,0 +1,87 @@
+import configparser
+from contextlib import contextmanager
+from contextvars import ContextVar
+import time
+
+from langchain_core.runnables import RunnableConfig
+
+from paths import PROJECT_ROOT
+
+cfg = configparser.ConfigParser()
+cfg.read(f'{PROJECT_ROOT}/config.ini')
+
+# Time budget of one question, from the question to the final answer
+QUESTION_BUDGET_S = cfg.getfloat('DEADLINES', 'question_s', fallback=90)
+# Time kept for the final answer, tools are not offered to the model once less is left
+ANSWER_RESERVE_S = cfg.getfloat('DEADLINES', 'answer_reserve_s', fallback=10)
+# With less time left, maps are requested at a resolution reduced in proportion, down to min_raster_size
+DEGRADE_BELOW_S = cfg.getfloat('DEADLINES', 'degrade_below_s', fallback=30)
+MIN_RASTER_SIZE = cfg.getint('DEADLINES', 'min_raster_size', fallback=300)
+
+_deadline: ContextVar[float | None] = ContextVar("deadline", default=None)
+_degradations: ContextVar[list[str] | None] = ContextVar("degradations", default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    """The time budget of the question is used up."""
+
+
+def new_deadline(budget_s: float = QUESTION_BUDGET_S) -> float:
+    """Deadline of a question, passed to the graph as `configurable.deadline`."""
+    return time.monotonic() + budget_s
+
+def get_deadline(config: RunnableConfig) -> float | None:
+    return config.get("configurable", {}).get("deadline")
+
+@contextmanager
+def deadline_scope(deadline: float | None):
+    """Makes the deadline apply to all tools and fetches run inside the block, including their worker threads."""
+    token = _deadline.set(deadline)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+def remaining() -> float:
+    """Seconds left until the deadline, infinite without one."""
+    deadline = _deadline.get()
+    return float("inf") if deadline is None else deadline - time.monotonic()
+
+def check_deadline():
+    if remaining() <= 0:
+        raise DeadlineExceeded("The time budget of the question is used up")
+
+def request_timeout(timeout: tuple[float, float]) -> tuple[float, float]:
+    """(connect, read) timeout of a request capped by the time left."""
+    check_deadline()
+    left = remaining()
+    return min(timeout[0], left), min(timeout[1], left)
+
+def degraded_size(width: int, height: int) -> tuple[int, int]:
+    """Raster size fitting the time left: the full size, or a coarser one close to the deadline."""
+    scale = remaining() / DEGRADE_BELOW_S
+    if scale >= 1:
+        return width, height
+    scale = max(scale, MIN_RASTER_SIZE / max(width, height))
+    if scale >= 1:
+        return width, height
+    size = max(1, int(width * scale)), max(1, int(height * scale))
+    note_degradation(f"Maps were processed at a reduced resolution of {size[0]}x{size[1]} pixels to answer in time, small zones may be missing.")
+    return size
+
+@contextmanager
+def collect_degradations():
+    """Collects notes on results degraded inside the block, e.g. by one tool call."""
+    token = _degradations.set([])
+    try:
+        yield
+    finally:
+        _degradations.reset(token)
+
+def note_degradation(note: str):
+    notes = _degradations.get()
+    if notes is not None and note not in notes:
+        notes.append(note)
+
+def get_degradations() -> list[str]:
+    return list(_degradations.get() or [])
@@ -0,0 +1,174 @@
+import atexit
+from collections import OrderedDict
+import configparser
+from dataclasses import dataclass, field
+import logging
+import threading
+import time
+import uuid
+
+from paths import PROJECT_ROOT
+
+cfg = configparser.ConfigParser()
+cfg.read(f'{PROJECT_ROOT}/config.ini')
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = cfg.getint('FEEDBACK', 'batch_size', fallback=20)
+# Pending feedback is sent at most this often, repeated changes of one score in between are sent once
+FLUSH_INTERVAL_S = cfg.getfloat('FEEDBACK', 'flush_interval_s', fallback=1.0)
+MAX_RETRIES = cfg.getint('FEEDBACK', 'max_retries', fallback=5)
+MAX_PENDING = cfg.getint('FEEDBACK', 'max_pending', fallback=1000)
+# Feedback ids remembered in memory, the least recently submitted are forgotten first
+MAX_TRACKED = cfg.getint('FEEDBACK', 'max_tracked', fallback=10000)
+
+
+@dataclass
+class Feedback:
+    run_id: str
+    key: str
+    score: float | None = None
+    value: str | None = None
+    comment: str | None = None
+    correction: dict | None = None
+    # Fixed id of the feedback, e.g. stored with the chat message, generated by the queue if missing
+    feedback_id: uuid.UUID | None = None
+    attempts: int = 0
+    not_before: float = field(default=0.0)
+
+
+class FeedbackQueue:
+    """
+    Sends LangSmith feedback from a background thread with one shared client.
+    Feedback is deduplicated by (run_id, key): only the latest pending submission is sent, and every
+    (run_id, key) gets a fixed feedback id, so later changes update the same feedback instead of adding one.
+    Only the last MAX_TRACKED ids are kept in memory, callers that keep the id themselves
+    (`Feedback.feedback_id`) update their feedback also after it is forgotten or after a restart.
+    Failed submissions are retried with exponential backoff.
+    """
+    def __init__(self, client=None):
+        self._client = client
+        self._pending: dict[tuple[str, str], Feedback] = {}
+        # (run_id, key) -> (feedback id, whether the feedback was created)
+        self._feedback_ids: OrderedDict[tuple[str, str], tuple[uuid.UUID, bool]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._worker = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            from langsmith import Client
+            self._client = Client()
+        return self._client
+
+    def submit(self, feedback: Feedback):
+        """Queues the feedback and returns immediately."""
+        with self._lock:
+            key = (str(feedback.run_id), feedback.key)
+            if key not in self._pending and len(self._pending) >= MAX_PENDING:
+                logger.warning("Feedback queue is full, dropping feedback for run %s", feedback.run_id)
+                return
+            self._pending[key] = feedback
+            self._track(key, feedback)
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="feedback-queue", daemon=True)
+                self._worker.start()
+
+    def _track(self, key: tuple[str, str], feedback: Feedback):
+        """Fixes the feedback id of the (run_id, key), must be called with the lock held."""
+        feedback_id, created = self._feedback_ids.pop(key, (None, False))
+        if feedback.feedback_id is not None and uuid.UUID(str(feedback.feedback_id)) != feedback_id:
+            # Ids stored with chat messages are read back as strings
+            feedback_id, created = uuid.UUID(str(feedback.feedback_id)), False
+        feedback.feedback_id = feedback_id or uuid.uuid4()
+        self._feedback_ids[key] = (feedback.feedback_id, created)
+        while len(self._feedback_ids) > MAX_TRACKED:
+            self._feedback_ids.popitem(last=False)
+
+    def _run(self):
+        while not self._stopped:
+            self._wakeup.wait(FLUSH_INTERVAL_S)
+            self._wakeup.clear()
+            self.flush_once()
+
+    def flush_once(self) -> int:
+        """Sends one batch of due feedback, returns the number of feedback items still pending."""
+        now = time.monotonic()
+        with self._lock:
+            due = [key for key, feedback in self._pending.items() if feedback.not_before <= now][:BATCH_SIZE]
+            batch = [(key, self._pending.pop(key)) for key in due]
+
+        for key, feedback in batch:
+            try:
+                self._send(key, feedback)
+            except Exception as e:
+                feedback.attempts += 1
+                if feedback.attempts > MAX_RETRIES:
+                    logger.error("Dropping feedback for run %s after %d attempts: %s", feedback.run_id, feedback.attempts, e)
+                    continue
+                feedback.not_before = time.monotonic() + min(60.0, 2 ** feedback.attempts)
+                with self._lock:
+                    # A newer submission of the same feedback wins over the retry
+                    self._pending.setdefault(key, feedback)
+
+        with self._lock:
+            return len(self._pending)
+
+    def _send(self, key: tuple[str, str], feedback: Feedback):
+        from langsmith.utils import LangSmithConflictError
+
+        with self._lock:
+            created = self._feedback_ids.get(key) == (feedback.feedback_id, True)
+        if not created:
+            try:
+                self.client.create_feedback(
+                    run_id=feedback.run_id,
+                    key=feedback.key,
+                    score=feedback.score,
+                    value=feedback.value,
+                    comment=feedback.comment,
+                    correction=feedback.correction,
+                    feedback_id=feedback.feedback_id,
+                )
+            except LangSmithConflictError:
+                # Created before the id was forgotten or by an earlier process
+                created = True
+        if created:
+            self.client.update_feedback(
+                feedback_id=feedback.feedback_id,
+                score=feedback.score,
+                value=feedback.value,
+                comment=feedback.comment,
+                correction=feedback.correction,
+            )
+        with self._lock:
+            if key in self._feedback_ids:
+                self._feedback_ids[key] = (feedback.feedback_id, True)
+
+    def flush(self, timeout: float = 5.0):
+        """Sends everything that is due, used at shutdown."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._lock:
+                due = any(feedback.not_before <= time.monotonic() for feedback in self._pending.values())
+            if not due or self.flush_once() == 0:
+                return
+
+    def stop(self):
+        self._stopped = True
+        self._wakeup.set()
+        self.flush()
+
+_queue = None
+_queue_lock = threading.Lock()
+
+def get_feedback_queue() -> FeedbackQueue:
+    """Process-wide feedback queue, flushed at interpreter exit."""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = FeedbackQueue()
+            atexit.register(_queue.stop)
+        return _queue
@@ -0,0 +1,223 @@
+import configparser
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+import time
+import uuid
+
+from paths import PROJECT_ROOT
+
+try:
+    import resource
+except ImportError: # Not available on Windows
+    resource = None
+
+cfg = configparser.ConfigParser()
+cfg.read(f'{PROJECT_ROOT}/config.ini')
+
+ENABLED = cfg.getboolean('INSTRUMENTATION', 'enabled', fallback=True)
+JSONL_PATH = cfg.get('INSTRUMENTATION', 'jsonl_path', fallback='')
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Spans of the currently traced request (e.g. one question) and the innermost open span
+_current_trace: ContextVar[list | None] = ContextVar("current_trace", default=None)
+_current_span: ContextVar[dict | None] = ContextVar("current_span", default=None)
+
+
+class _Metrics:
+    """Process-wide aggregates of finished spans, rendered in Prometheus text format."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = defaultdict(int)
+        self.errors = defaultdict(int)
+        self.sums = defaultdict(float)
+        self.buckets = defaultdict(lambda: [0] * len(DURATION_BUCKETS))
+        self.http_bytes = defaultdict(int)
+        self.cache_hits = defaultdict(int)
+
+    def observe(self, record: dict):
+        name = record["name"]
+        seconds = record["duration_ms"] / 1000
+        with self.lock:
+            self.counts[name] += 1
+            self.sums[name] += seconds
+            if record.get("error"):
+                self.errors[name] += 1
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if seconds <= bound:
+                    self.buckets[name][i] += 1
+            if "bytes" in record:
+                self.http_bytes[record.get("host", "")] += record["bytes"] or 0
+            if record.get("cache_hit"):
+                self.cache_hits[name] += 1
+
+    def render(self) -> str:
+        lines = ["# TYPE geo_span_duration_seconds histogram"]
+        with self.lock:
+            for name in sorted(self.counts):
+                label = f'name="{name}"'
+                for bound, count in zip(DURATION_BUCKETS, self.buckets[name]):
+                    lines.append(f'geo_span_duration_seconds_bucket{{{label},le="{bound}"}} {count}')
+                lines.append(f'geo_span_duration_seconds_bucket{{{label},le="+Inf"}} {self.counts[name]}')
+                lines.append(f'geo_span_duration_seconds_sum{{{label}}} {self.sums[name]:.6f}')
+                lines.append(f'geo_span_duration_seconds_count{{{label}}} {self.counts[name]}')
+            lines.append("# TYPE geo_span_errors_total counter")
+            lines += [f'geo_span_errors_total{{name="{name}"}} {count}' for name, count in sorted(self.errors.items())]
+            lines.append("# TYPE geo_span_cache_hits_total counter")
+            lines += [f'geo_span_cache_hits_total{{name="{name}"}} {count}' for name, count in sorted(self.cache_hits.items())]
+            lines.append("# TYPE geo_http_received_bytes_total counter")
+            lines += [f'geo_http_received_bytes_total{{host="{host}"}} {count}' for host, count in sorted(self.http_bytes.items())]
+        if resource is not None:
+            lines.append("# TYPE geo_process_max_rss_bytes gauge")
+            lines.append(f"geo_process_max_rss_bytes {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024}")
+        return "\n".join(lines) + "\n"
+
+
+class _JsonlSink:
+    def __init__(self, path: str):
+        self.path = PROJECT_ROOT / path
+        self.lock = threading.Lock()
+        self.file = None
+
+    def write(self, record: dict):
+        with self.lock:
+            if self.file is None:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                self.file = open(self.path, "a", encoding="utf-8", buffering=1)
+            self.file.write(json.dumps(record, default=str) + "\n")
+
+
+metrics = _Metrics()
+_sink = _JsonlSink(JSONL_PATH) if ENABLED and JSONL_PATH else None
+
+@contextmanager
+def trace(trace_id=None):
+    """
+    Collects all spans finished inside the block (including tool threads started from it) into the yielded list.
+    """
+    spans = []
+    trace_token = _current_trace.set(spans)
+    span_token = _current_span.set({"trace_id": str(trace_id or uuid.uuid4()), "span_id": None})
+    try:
+        yield spans
+    finally:
+        _current_span.reset(span_token)
+        _current_trace.reset(trace_token)
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Times the block and records it as a span. The yielded record can be updated with further attributes,
+    e.g. the number of downloaded bytes.
+    """
+    if not ENABLED:
+        yield {}
+        return
+
+    parent = _current_span.get()
+    record = {
+        "name": name,
+        "trace_id": parent["trace_id"] if parent else None,
+        "span_id": uuid.uuid4().hex[:16],
+        "parent_id": parent["span_id"] if parent else None,
+        "start": time.time(),
+        **attributes,
+    }
+    token = _current_span.set(record)
+    start = time.perf_counter()
+    cpu_start = time.thread_time()
+    try:
+        yield record
+    except Exception as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current_span.reset(token)
+        record["duration_ms"] = round((time.perf_counter() - start) * 1000, 3)
+        record["cpu_ms"] = round((time.thread_time() - cpu_start) * 1000, 3)
+        if resource is not None:
+            record["max_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+        _finish(record)
+
+def set_enabled(enabled: bool):
+    """Turns span recording on or off for the whole process, e.g. to keep benchmarks free of overhead."""
+    global ENABLED
+    ENABLED = enabled
+
+def _finish(record: dict):
+    spans = _current_trace.get()
+    if spans is not None:
+        spans.append(record)
+    metrics.observe(record)
+    if _sink is not None:
+        _sink.write(record)
+
+def traced(name: str):
+    """Decorator recording every call of the function as a span."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def traced_tool_run(func):
+    """Decorator for `BaseTool._run`, records the call as a `tool.<tool name>` span."""
+    @wraps(func)
+    def wrapper(self, *args, **kwargs):
+        with span(f"tool.{self.name}"):
+            return func(self, *args, **kwargs)
+    return wrapper
+
+def get_trace_summary() -> list[dict] | None:
+    """
+    Compact breakdown of the spans finished so far in the current trace, in start order.
+    Returns None outside of a trace.
+    """
+    spans = _current_trace.get()
+    if spans is None:
+        return None
+    summary = []
+    for record in sorted(list(spans), key=lambda r: r["start"]):
+        item = {"name": record["name"], "ms": record["duration_ms"], "cpu_ms": record["cpu_ms"]}
+        for key in ("host", "status", "bytes", "cache_hit", "error"):
+            if key in record:
+                item[key] = record[key]
+        summary.append(item)
+    return summary
+
+def render_prometheus() -> str:
+    return metrics.render()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+_metrics_server = None
+_metrics_server_lock = threading.Lock()
+
+def start_metrics_server(port: int):
+    """Serves `/metrics` on a daemon thread. Starting it again in the same process is a no-op."""
+    global _metrics_server
+    with _metrics_server_lock:
+        if _metrics_server is not None or port <= 0:
+            return
+        _metrics_server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+        threading.Thread(target=_metrics_server.serve_forever, name="metrics-server", daemon=True).start()
@@ -1,40 +1,59 @@
 import datetime
+import os
 
 import numpy as np
 
+OLU_MAPSERV_URL = 'https://olu.lesprojekt.cz/cgi-bin/mapserv'
+GIS_MAPSERV_URL = 'https://gis.lesprojekt.cz/cgi-bin/mapserv'
+OPENMETEO_URL = 'https://api.open-meteo.com/v1/forecast'
+
+# Environment variables overriding the upstream base URLs, e.g. to point the tools at a local stub server
+upstream_url_overrides = {
+    OLU_MAPSERV_URL: 'OLU_MAPSERV_URL',
+    GIS_MAPSERV_URL: 'GIS_MAPSERV_URL',
+    OPENMETEO_URL: 'OPENMETEO_URL',
+}
+
+def resolve_upstream_url(url: str) -> str:
+    """Returns the overridden base URL if the matching environment variable is set."""
+    env_var = upstream_url_overrides.get(url)
+    if env_var is None:
+        return url
+    return os.getenv(env_var) or url
+
 map_config={ 
     'climate_era5_temperature_last_5yrs_month_avg':
-        {'wms_root_url':'https://olu.lesprojekt.cz/cgi-bin/mapserv', 
+        {'wms_root_url':OLU_MAPSERV_URL, 
         'data':{'map':'/data/maps/thematic_maps.map', 'service':'WMS', 'version':'1.3.0', 'request':'GetMap', 'bbox':'49.3,12.7,49.4,12.8', 'crs':'EPSG:4326', 'width':'1562', 'height':'680', 'layers':'t2m_2020', 'TIME':'20200101','styles':'', 'format':'gtiff' }, 
         'alternatives':{'TIME':[datetime.date(2020,i,1).strftime('%Y%m%d') for i in range(1,13)]}
         }, 
     'climate_ipcc_rcp45_temperature_2050s_month_avg':
-        {'wms_root_url':'https://olu.lesprojekt.cz/cgi-bin/mapserv', 
+        {'wms_root_url':OLU_MAPSERV_URL, 
         'data':{'map':'/data/maps/thematic_maps.map', 'service':'WMS', 'version':'1.3.0', 'request':'GetMap', 'bbox':'49.3,12.7,49.4,12.8', 'crs':'EPSG:4326', 'width':'1562', 'height':'680', 'layers':'tas_2030', 'TIME':'20300101','styles':'', 'format':'gtiff' }, 
         'alternatives':{'TIME':[datetime.date(2030,i,1).strftime('%Y%m%d') for i in range(1,13)]}
         }, 
     'OLU_EU':
-        {'wms_root_url':'https://olu.lesprojekt.cz/cgi-bin/mapserv', 
+        {'wms_root_url':OLU_MAPSERV_URL, 
         'data':{'map':'/data/maps/olu_europe.map', 'service':'WMS', 'version':'1.3.0', 'request':'GetMap', 'bbox':'49.3,12.7,49.4,12.8', 'crs':'EPSG:4326', 'width':'1562', 'height':'680', 'layers':'olu_obj_lu', 'styles':'', 'format':'png' }, 
         'alternatives':{'layers':['olu_obj_lu', 'olu_obj_lc']}
         }, 
     'OLU_CZ':
-        {'wms_root_url':'https://olu.lesprojekt.cz/cgi-bin/mapserv', 
+        {'wms_root_url':OLU_MAPSERV_URL, 
         'data':{'map':'/data/maps/olu_europe.map', 'service':'WMS', 'version':'1.3.0', 'request':'GetMap', 'bbox':'49.3,12.7,49.4,12.8', 'crs':'EPSG:4326', 'width':'3000', 'height':'3000', 'layers':'olu_bbox_ts', 'styles':'', 'format':'png' }, 
         'alternatives':{'TIME':[datetime.date(i,12,31).strftime('%Y-%m-%d') for i in range(2015,2024)]}
         }, 
     'EUROSTAT_2021':
-        {'wms_root_url':'https://olu.lesprojekt.cz/cgi-bin/mapserv', 
+        {'wms_root_url':OLU_MAPSERV_URL, 
         'data':{'map':'/data/maps/thematic_maps.map', 'service':'WMS', 'version':'1.3.0', 'request':'GetMap', 'bbox':'49.3,12.7,49.4,12.8', 'crs':'EPSG:4326', 'width':'1562', 'height':'680', 'layers':'total_population_eurostat_griddata_2021', 'styles':'', 'format':'gtiff' }, 
         'alternatives':{'layers':['total_population_eurostat_griddata_2021', 'employed_population_eurostat_griddata_2021']}
         }, 
     'DEM_color':
-        {'wms_root_url':'https://gis.lesprojekt.cz/cgi-bin/mapserv', 
+        {'wms_root_url':GIS_MAPSERV_URL, 
         'data':{'map':'/home/dima/maps/foodie/dem.map', 'service':'WMS', 'version':'1.3.0', 'request':'GetMap', 'bbox':'49.3,12.7,49.4,12.8', 'crs':'EPSG:4326', 'width':'1562', 'height':'680', 'layers':'DEM', 'styles':'', 'format':'png' }, 
         'alternatives':{}
         },
     'DEM_MASL':
-        {'wms_root_url':'https://gis.lesprojekt.cz/cgi-bin/mapserv', 
+        {'wms_root_url':GIS_MAPSERV_URL, 
         'data':{'map':'/home/dima/maps/foodie/dem.map', 'service':'WMS', 'version':'1.3.0', 'request':'GetMap', 'bbox':'49.3,12.7,49.4,12.8', 'crs':'EPSG:4326', 'width':'1562', 'height':'680', 'layers':'DEM_ORIG', 'styles':'', 'format':'gtiff' }, 
         'alternatives':{}
         },
@@ -42,7 +61,7 @@ map_config={
 
 wfs_config={
     'SPOI':
-        {'wfs_root_url':'https://gis.lesprojekt.cz/cgi-bin/mapserv',
+        {'wfs_root_url':GIS_MAPSERV_URL,
         'data':{'map':'/home/dima/maps/spoiky.map', 'service':'WFS', 'version':'1.1.0', 'request':'GetFeature', 'srsname':'EPSG:4326', 'typename':'spoi', 'outputformat':'geojson'}
         }
 }
@@ -0,0 +1,90 @@
+import configparser
+from functools import lru_cache
+
+import numpy as np
+
+from paths import PROJECT_ROOT
+from schemas.geometry import BoundingBox
+from utils.instrumentation import span
+
+cfg = configparser.ConfigParser()
+cfg.read(f'{PROJECT_ROOT}/config.ini')
+
+MUNICIPALITY_TABLE_PATH = PROJECT_ROOT / cfg.get('MUNICIPALITY_TABLE', 'path', fallback='data/municipality_summary.parquet')
+# Minimal intersection over union of the bounding box and a municipality envelope to answer from the table
+MATCH_IOU = cfg.getfloat('MUNICIPALITY_TABLE', 'match_iou', fallback=0.8)
+# Absolute totals (population) are not shares, they are only answered from the table for a much tighter match
+TOTAL_MATCH_IOU = cfg.getfloat('MUNICIPALITY_TABLE', 'total_match_iou', fallback=0.98)
+
+_enabled = cfg.getboolean('MUNICIPALITY_TABLE', 'enabled', fallback=True)
+
+def set_enabled(enabled: bool):
+    """Switches table lookups off, e.g. while the table itself is being rebuilt."""
+    global _enabled
+    _enabled = enabled
+
+def color_column(prefix: str, rgb) -> str:
+    """Column of the pixel count of a palette color, e.g. lu_220_160_220."""
+    return f"{prefix}_{'_'.join(str(int(c)) for c in rgb)}"
+
+@lru_cache(maxsize=1)
+def load_municipality_table():
+    """Summary table built by `scripts.build_municipality_table`, None if it was not built."""
+    if not MUNICIPALITY_TABLE_PATH.exists():
+        return None
+    import pandas as pd
+
+    return pd.read_parquet(MUNICIPALITY_TABLE_PATH)
+
+def find_municipality(bounding_box: BoundingBox, min_iou: float = MATCH_IOU):
+    """
+    Table row of the municipality whose envelope matches the bounding box, the best match by
+    intersection over union if it reaches `min_iou`, otherwise None.
+    """
+    table = load_municipality_table() if _enabled else None
+    if table is None or table.empty:
+        return None
+    with span("cpu.lookup.municipality"):
+        minx, miny, maxx, maxy = bounding_box.bounds_lonlat()
+        inter_w = np.clip(np.minimum(maxx, table["maxx"].to_numpy()) - np.maximum(minx, table["minx"].to_numpy()), 0, None)
+        inter_h = np.clip(np.minimum(maxy, table["maxy"].to_numpy()) - np.maximum(miny, table["miny"].to_numpy()), 0, None)
+        intersection = inter_w * inter_h
+        envelopes = (table["maxx"] - table["minx"]).to_numpy() * (table["maxy"] - table["miny"]).to_numpy()
+        iou = intersection / ((maxx - minx) * (maxy - miny) + envelopes - intersection)
+        best = int(np.argmax(iou))
+        if iou[best] < min_iou:
+            return None
+        return table.iloc[best]
+
+def get_municipality_land_counts(bounding_box: BoundingBox, prefix: str, rgb_mapping):
+    """Land use ("lu") or land cover ("lc") counts of a matching municipality like `get_land_counts`, or None."""
+    row = find_municipality(bounding_box)
+    if row is None:
+        return None
+    counts = [
+        (tuple(rgb), int(row[color_column(prefix, rgb)]))
+        for rgb in sorted(set(rgb_mapping.values()))
+        if color_column(prefix, rgb) in row.index and row[color_column(prefix, rgb)] > 0
+    ]
+    return sorted(counts, reverse=True, key=lambda x: x[1]), int(row[f"{prefix}_n_pixels"])
+
+def get_municipality_elevation_stats(bounding_box: BoundingBox, elevation_ranges):
+    """Elevation stats of a matching municipality like `get_elevation_stats`, or None."""
+    row = find_municipality(bounding_box)
+    if row is None:
+        return None
+    return {
+        "mean": float(row["elevation_mean"]),
+        "min": float(row["elevation_min"]),
+        "max": float(row["elevation_max"]),
+        "zone_counts": {name: int(row[f"zone_{i}"]) for i, (_, _, name) in enumerate(elevation_ranges)},
+        "n_pixels": int(row["elevation_n_pixels"]),
+    }
+
+def get_municipality_population(bounding_box: BoundingBox):
+    """
+    Total population of the municipality whose envelope nearly equals the bounding box, or None.
+    The total of a looser match would be off by the area of the bounding box the envelope does not share.
+    """
+    row = find_municipality(bounding_box, TOTAL_MATCH_IOU)
+    return None if row is None else int(row["population"])
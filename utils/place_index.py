@@ -0,0 +1,145 @@
+from bisect import bisect_left
+from collections import defaultdict
+from difflib import SequenceMatcher
+from functools import lru_cache
+import re
+from typing import NamedTuple
+import unicodedata
+
+from schemas.geometry import BoundingBox
+from utils.instrumentation import span
+
+# Longest place name in words looked up in a question
+MAX_NAME_WORDS = 5
+# Minimal similarity of a fuzzy match
+MIN_FUZZY_SCORE = 0.8
+
+
+class Place(NamedTuple):
+    name: str
+    code: int
+    # minx, miny, maxx, maxy in EPSG:4326
+    bounds: tuple[float, float, float, float]
+
+    @property
+    def bounding_box(self) -> BoundingBox:
+        return BoundingBox.from_bounds(*self.bounds)
+
+    @property
+    def area(self) -> float:
+        return (self.bounds[2] - self.bounds[0]) * (self.bounds[3] - self.bounds[1])
+
+def normalize_name(text: str) -> str:
+    """Lowercase without diacritics and punctuation, e.g. 'Ústí nad Labem' -> 'usti nad labem'."""
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(c for c in text if not unicodedata.combining(c)).casefold()
+    return " ".join(re.findall(r"\w+", text))
+
+def _trigrams(name: str) -> set[str]:
+    padded = f"  {name} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class PlaceIndex:
+    """
+    In-memory index of place names: exact and prefix lookups over the sorted normalized names,
+    fuzzy lookups over a trigram index. Places sharing a name are ordered by area, largest first.
+    """
+    def __init__(self, places: list[Place]):
+        self.by_name: dict[str, list[Place]] = defaultdict(list)
+        for place in places:
+            self.by_name[normalize_name(place.name)].append(place)
+        for same_name in self.by_name.values():
+            same_name.sort(key=lambda place: place.area, reverse=True)
+        self.names = sorted(self.by_name)
+        self.trigrams: dict[str, list[str]] = defaultdict(list)
+        for name in self.names:
+            for trigram in _trigrams(name):
+                self.trigrams[trigram].append(name)
+
+    def __len__(self):
+        return len(self.names)
+
+    def exact(self, query: str) -> list[Place]:
+        return self.by_name.get(normalize_name(query), [])
+
+    def prefix(self, query: str, limit: int = 10) -> list[Place]:
+        query = normalize_name(query)
+        matches = []
+        for name in self.names[bisect_left(self.names, query):]:
+            if not name.startswith(query) or len(matches) >= limit:
+                break
+            matches.extend(self.by_name[name])
+        return matches[:limit]
+
+    def fuzzy(self, query: str, limit: int = 5, min_score: float = MIN_FUZZY_SCORE) -> list[tuple[Place, float]]:
+        """Places with names similar to the query, candidates share trigrams and are ranked by edit similarity."""
+        query = normalize_name(query)
+        query_trigrams = _trigrams(query)
+        shared = defaultdict(int)
+        for trigram in query_trigrams:
+            for name in self.trigrams.get(trigram, ()):
+                shared[name] += 1
+        # Names sharing too few trigrams cannot reach the minimal score
+        candidates = [name for name, count in shared.items() if count >= len(query_trigrams) * min_score / 2]
+        scored = sorted(
+            ((name, SequenceMatcher(None, query, name).ratio()) for name in candidates),
+            key=lambda item: item[1], reverse=True,
+        )
+        return [(self.by_name[name][0], score) for name, score in scored[:limit] if score >= min_score]
+
+    def lookup(self, query: str) -> Place | None:
+        """Best place for a name: exact match, else the only prefix match, else the best fuzzy match."""
+        if places := self.exact(query):
+            return places[0]
+        if len(places := self.prefix(query, limit=2)) == 1:
+            return places[0]
+        if matches := self.fuzzy(query, limit=1):
+            return matches[0][0]
+        return None
+
+    def find_in_text(self, text: str) -> Place | None:
+        """
+        Place mentioned in a question. Only word sequences starting with a capital letter are considered,
+        longest first and exact matches before fuzzy ones. Sentence-initial words are used only as a last resort.
+        """
+        matches = list(re.finditer(r"\w+", text))
+        words = [m.group() for m in matches]
+        normalized = [normalize_name(word) for word in words]
+        sentence_start = [i == 0 or text[:m.start()].rstrip()[-1:] in ".!?" for i, m in enumerate(matches)]
+        starts = [i for i, word in enumerate(words) if word[0].isupper()]
+        starts = [i for i in starts if not sentence_start[i]] + [i for i in starts if sentence_start[i]]
+
+        with span("cpu.lookup.place_name"):
+            for use_fuzzy in (False, True):
+                for i in starts:
+                    for n in range(min(MAX_NAME_WORDS, len(words) - i), 0, -1):
+                        name = " ".join(normalized[i:i + n])
+                        if not use_fuzzy and (places := self.by_name.get(name)):
+                            return places[0]
+                        if use_fuzzy and len(name) >= 4 and (fuzzy_matches := self.fuzzy(name, limit=1)):
+                            return fuzzy_matches[0][0]
+        return None
+
+def load_places() -> list[Place]:
+    """
+    Regions of the tourism data (`get_region_tourism_data`) with the envelope of their geometry. The regions are
+    identified by municipality codes and named by the codelist, as in the tourism lookup, so region and municipality
+    names are the same index entries. Regions split into several features get the envelope of all of them.
+    Codelist municipalities without a region geometry have no area to select and are left out.
+    """
+    from utils.tool_utils import load_tourism_data
+
+    gdf, df = load_tourism_data()
+    bounds = gdf.bounds.assign(fid=gdf["fid"].astype(int))
+    envelopes = bounds.groupby("fid").agg({"minx": "min", "miny": "min", "maxx": "max", "maxy": "max"})
+    return [
+        Place(str(df.loc[fid].text), fid, (minx, miny, maxx, maxy))
+        for fid, (minx, miny, maxx, maxy) in zip(envelopes.index, envelopes.itertuples(index=False))
+        if fid in df.index
+    ]
+
+@lru_cache(maxsize=1)
+def get_place_index() -> PlaceIndex:
+    with span("io.load_place_index"):
+        return PlaceIndex(load_places())
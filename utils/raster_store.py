@@ -0,0 +1,428 @@
+import configparser
+from functools import lru_cache
+import json
+import math
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from paths import PROJECT_ROOT
+from schemas.geometry import BoundingBox
+from utils.instrumentation import span
+from utils.map_service_utils import map_config
+
+cfg = configparser.ConfigParser()
+cfg.read(f'{PROJECT_ROOT}/config.ini')
+
+def layer_key(endpoint: str, alt_params: dict = {}) -> str:
+    """
+    Identifies a stored layer by the endpoint and the effective WMS layer and time,
+    so e.g. `("OLU_EU", {})` and `("OLU_EU", {"layers": "olu_obj_lu"})` share one layer.
+    """
+    params = {**map_config[endpoint]["data"], **alt_params}
+    key = f"{endpoint}__{params['layers']}"
+    if "TIME" in params:
+        key += f"__{params['TIME']}"
+    return key
+
+
+class RasterLayer:
+    """
+    One layer of the store: level 0 at full resolution plus 2x downsampled overviews.
+    Every level is a memory-mapped array of square tiles with shape (tiles_y, tiles_x, tile, tile, bands),
+    so reading a window touches only the tiles it overlaps.
+    """
+    def __init__(self, path: Path, mode: str = "r"):
+        self.path = path
+        self.meta = json.loads((path / "meta.json").read_text())
+        self.tile_size = self.meta["tile_size"]
+        self.bounds = tuple(self.meta["bounds"])
+        self.levels = [
+            np.load(path / f"level_{i}.npy", mmap_mode=mode)
+            for i in range(len(self.meta["levels"]))
+        ]
+
+    @classmethod
+    def create(cls, path: Path, endpoint: str, alt_params: dict, bounds, shape, bands: int, dtype: str, tile_size: int) -> "RasterLayer":
+        """Creates an empty writable layer with level 0 only, overviews are added by `build_overviews`."""
+        path.mkdir(parents=True, exist_ok=True)
+        meta = {
+            "key": layer_key(endpoint, alt_params),
+            "endpoint": endpoint,
+            "alt_params": alt_params,
+            "bounds": list(bounds),
+            "bands": bands,
+            "dtype": dtype,
+            "tile_size": tile_size,
+            # Class rasters must not be interpolated
+            "resampling": "nearest" if bands == 3 else "mean",
+            "levels": [{"shape": list(shape)}],
+        }
+        cls._allocate(path, 0, shape, bands, dtype, tile_size)
+        (path / "meta.json").write_text(json.dumps(meta, indent=2))
+        return cls(path, mode="r+")
+
+    @staticmethod
+    def _allocate(path: Path, level: int, shape, bands: int, dtype: str, tile_size: int):
+        tiles_y, tiles_x = math.ceil(shape[0] / tile_size), math.ceil(shape[1] / tile_size)
+        array = np.lib.format.open_memmap(
+            path / f"level_{level}.npy", mode="w+", dtype=dtype,
+            shape=(tiles_y, tiles_x, tile_size, tile_size, bands),
+        )
+        del array
+
+    def shape(self, level: int = 0) -> tuple[int, int]:
+        return tuple(self.meta["levels"][level]["shape"])
+
+    def pixel_size(self, level: int = 0) -> tuple[float, float]:
+        """Pixel width and height in degrees."""
+        minx, miny, maxx, maxy = self.bounds
+        height, width = self.shape(0)
+        return (maxx - minx) / width * 2 ** level, (maxy - miny) / height * 2 ** level
+
+    def covers(self, bounding_box: BoundingBox) -> bool:
+        minx, miny, maxx, maxy = bounding_box.bounds_lonlat()
+        return minx >= self.bounds[0] and miny >= self.bounds[1] and maxx <= self.bounds[2] and maxy <= self.bounds[3]
+
+    def read_window(self, level: int, r0: int, r1: int, c0: int, c1: int) -> np.ndarray:
+        """Reads pixel rows r0:r1 and columns c0:c1 of the level as an (rows, cols, bands) array."""
+        tiles = self.levels[level]
+        t = self.tile_size
+        out = np.empty((r1 - r0, c1 - c0, tiles.shape[-1]), dtype=tiles.dtype)
+        for ty in range(r0 // t, (r1 - 1) // t + 1):
+            ys, ye = max(r0, ty * t), min(r1, (ty + 1) * t)
+            for tx in range(c0 // t, (c1 - 1) // t + 1):
+                xs, xe = max(c0, tx * t), min(c1, (tx + 1) * t)
+                out[ys - r0:ye - r0, xs - c0:xe - c0] = tiles[ty, tx, ys - ty * t:ye - ty * t, xs - tx * t:xe - tx * t]
+        return out
+
+    def write_window(self, r0: int, c0: int, data: np.ndarray, level: int = 0):
+        """Writes an (rows, cols, bands) array to the level at pixel offset (r0, c0)."""
+        tiles = self.levels[level]
+        t = self.tile_size
+        r1, c1 = r0 + data.shape[0], c0 + data.shape[1]
+        for ty in range(r0 // t, (r1 - 1) // t + 1):
+            ys, ye = max(r0, ty * t), min(r1, (ty + 1) * t)
+            for tx in range(c0 // t, (c1 - 1) // t + 1):
+                xs, xe = max(c0, tx * t), min(c1, (tx + 1) * t)
+                tiles[ty, tx, ys - ty * t:ye - ty * t, xs - tx * t:xe - tx * t] = data[ys - r0:ye - r0, xs - c0:xe - c0]
+
+    def build_overviews(self, min_size: int = 256):
+        """Adds 2x downsampled levels until the level fits into `min_size` pixels."""
+        self.meta["levels"] = self.meta["levels"][:1]
+        self.levels = self.levels[:1]
+        level = 0
+        while max(self.shape(level)) > min_size:
+            height, width = self.shape(level)
+            shape = (math.ceil(height / 2), math.ceil(width / 2))
+            self._allocate(self.path, level + 1, shape, self.meta["bands"], self.meta["dtype"], self.tile_size)
+            self.meta["levels"].append({"shape": list(shape)})
+            self.levels.append(np.load(self.path / f"level_{level + 1}.npy", mmap_mode="r+"))
+            # One row of output tiles at a time keeps memory bounded
+            rows = 2 * self.tile_size
+            for r0 in range(0, height, rows):
+                window = self.read_window(level, r0, min(height, r0 + rows), 0, width)
+                self.write_window(r0 // 2, 0, self._downsample(window), level + 1)
+            level += 1
+        for array in self.levels:
+            array.flush()
+        (self.path / "meta.json").write_text(json.dumps(self.meta, indent=2))
+
+    def _downsample(self, window: np.ndarray) -> np.ndarray:
+        if self.meta["resampling"] == "nearest":
+            return window[::2, ::2]
+        # Mean of 2x2 blocks, odd edges are padded by repeating the last row/column
+        pad = ((0, window.shape[0] % 2), (0, window.shape[1] % 2), (0, 0))
+        window = np.pad(window, pad, mode="edge").astype(np.float64)
+        blocks = window.reshape(window.shape[0] // 2, 2, window.shape[1] // 2, 2, window.shape[2])
+        return blocks.mean(axis=(1, 3)).astype(self.meta["dtype"])
+
+    def choose_level(self, bounding_box: BoundingBox, width: int, height: int) -> int:
+        """Coarsest level that still has at least the requested resolution."""
+        minx, miny, maxx, maxy = bounding_box.bounds_lonlat()
+        requested_x, requested_y = (maxx - minx) / width, (maxy - miny) / height
+        level = 0
+        while level + 1 < len(self.levels):
+            px, py = self.pixel_size(level + 1)
+            if px > requested_x or py > requested_y:
+                break
+            level += 1
+        return level
+
+    def read_map(self, bounding_box: BoundingBox, width: int, height: int) -> Image.Image:
+        """
+        Renders the bounding box like a WMS GetMap: nearest neighbour resampled to width x height,
+        RGB image for class layers and float ('F') image for single band layers.
+        """
+        level = self.choose_level(bounding_box, width, height)
+        px, py = self.pixel_size(level)
+        level_height, level_width = self.shape(level)
+        minx, miny, maxx, maxy = bounding_box.bounds_lonlat()
+        # Fractional pixel coordinates of the bounding box within the level
+        x0, x1 = (minx - self.bounds[0]) / px, (maxx - self.bounds[0]) / px
+        y0, y1 = (self.bounds[3] - maxy) / py, (self.bounds[3] - miny) / py
+        c0, c1 = max(0, math.floor(x0)), min(level_width, max(math.ceil(x1), math.floor(x0) + 1))
+        r0, r1 = max(0, math.floor(y0)), min(level_height, max(math.ceil(y1), math.floor(y0) + 1))
+
+        window = self.read_window(level, r0, r1, c0, c1)
+        if self.meta["bands"] == 3:
+            image = Image.fromarray(window, mode="RGB")
+        else:
+            image = Image.fromarray(window[..., 0].astype(np.float32), mode="F")
+        return image.resize((width, height), Image.Resampling.NEAREST, box=(x0 - c0, y0 - r0, x1 - c0, y1 - r0))
+
+
+    def build_summed_area_table(self, cell_area_km2: float | None = None):
+        """
+        Integral image of level 0 with shape (height + 1, width + 1), built strip by strip.
+        With `cell_area_km2` the layer is a per-cell total (e.g. population of 1 km2 grid cells) and every pixel
+        is weighted by its share of the cell area, so window sums are totals. Otherwise window sums give means.
+        Non-finite values are counted as 0.
+        """
+        height, width = self.shape(0)
+        px, py = self.pixel_size(0)
+        table = np.lib.format.open_memmap(self.path / "summed_area.npy", mode="w+", dtype=np.float64, shape=(height + 1, width + 1))
+        table[0] = 0
+        table[:, 0] = 0
+        rows = max(1, self.tile_size)
+        for r0 in range(0, height, rows):
+            r1 = min(height, r0 + rows)
+            values = np.nan_to_num(self.read_window(0, r0, r1, 0, width)[..., 0].astype(np.float64), nan=0.0, posinf=0.0, neginf=0.0)
+            if cell_area_km2 is not None:
+                # Pixel area shrinks with the cosine of the latitude of the row center
+                lats = self.bounds[3] - (np.arange(r0, r1) + 0.5) * py
+                pixel_area_km2 = (px * 111.32 * np.cos(np.radians(lats))) * (py * 110.57)
+                values *= (pixel_area_km2 / cell_area_km2)[:, np.newaxis]
+            table[r0 + 1:r1 + 1, 1:] = values.cumsum(axis=1).cumsum(axis=0) + table[r0, 1:]
+        table.flush()
+        del table
+        self.meta["summed_area"] = {"aggregation": "mean" if cell_area_km2 is None else "sum", "cell_area_km2": cell_area_km2}
+        (self.path / "meta.json").write_text(json.dumps(self.meta, indent=2))
+
+    def window_sum(self, bounding_box: BoundingBox) -> tuple[float, float] | None:
+        """
+        Sum of level 0 values over the bounding box and its area in pixels, edge pixels are weighted by
+        the fraction covered by the bounding box. None if the layer has no summed area table.
+        """
+        if "summed_area" not in self.meta:
+            return None
+        table = np.load(self.path / "summed_area.npy", mmap_mode="r")
+        height, width = self.shape(0)
+        px, py = self.pixel_size(0)
+        minx, miny, maxx, maxy = bounding_box.bounds_lonlat()
+        x0, x1 = np.clip([(minx - self.bounds[0]) / px, (maxx - self.bounds[0]) / px], 0, width)
+        y0, y1 = np.clip([(self.bounds[3] - maxy) / py, (self.bounds[3] - miny) / py], 0, height)
+
+        def integral(x, y):
+            # The integral of a piecewise constant image is bilinear within every pixel
+            i, j = min(int(x), width - 1), min(int(y), height - 1)
+            fx, fy = x - i, y - j
+            top = (1 - fx) * table[j, i] + fx * table[j, i + 1]
+            bottom = (1 - fx) * table[j + 1, i] + fx * table[j + 1, i + 1]
+            return (1 - fy) * top + fy * bottom
+
+        total = integral(x1, y1) - integral(x0, y1) - integral(x1, y0) + integral(x0, y0)
+        return float(total), float((x1 - x0) * (y1 - y0))
+
+    def build_class_histograms(self, palette: np.ndarray):
+        """
+        Counts the palette classes of every level 0 tile, pixels off the palette (e.g. anti-aliased edges)
+        are assigned to the closest palette color. The counts are stored cumulated over tile rows and columns,
+        so the histogram of any block of whole tiles is a sum of four entries.
+        """
+        tiles = self.levels[0]
+        t = self.tile_size
+        height, width = self.shape(0)
+        histograms = np.zeros((tiles.shape[0] + 1, tiles.shape[1] + 1, len(palette)), dtype=np.int64)
+        for ty in range(tiles.shape[0]):
+            for tx in range(tiles.shape[1]):
+                tile = tiles[ty, tx, :min(t, height - ty * t), :min(t, width - tx * t)]
+                histograms[ty + 1, tx + 1] = palette_counts(tile, palette)
+        histograms = histograms.cumsum(axis=0).cumsum(axis=1)
+        np.save(self.path / "class_histograms.npy", histograms)
+        self.meta["palette"] = palette.tolist()
+        (self.path / "meta.json").write_text(json.dumps(self.meta, indent=2))
+
+    def _pixel_window(self, bounding_box: BoundingBox) -> tuple[int, int, int, int]:
+        """Level 0 rows r0:r1 and columns c0:c1 of the pixels with their centers inside of the bounding box."""
+        height, width = self.shape(0)
+        px, py = self.pixel_size(0)
+        minx, miny, maxx, maxy = bounding_box.bounds_lonlat()
+        c0 = min(width, max(0, round((minx - self.bounds[0]) / px)))
+        c1 = min(width, max(c0, round((maxx - self.bounds[0]) / px)))
+        r0 = min(height, max(0, round((self.bounds[3] - maxy) / py)))
+        r1 = min(height, max(r0, round((self.bounds[3] - miny) / py)))
+        return r0, r1, c0, c1
+
+    def _split_window(self, r0: int, r1: int, c0: int, c1: int):
+        """
+        Splits a pixel window into the block of whole tiles inside of it, as (ty0, ty1, tx0, tx1),
+        and the pixel windows of the partial tiles along its edges. The block is None if there are no
+        whole tiles, the last partial tile of the layer counts as whole.
+        """
+        t = self.tile_size
+        height, width = self.shape(0)
+        tx0, ty0 = -(-c0 // t), -(-r0 // t)
+        tx1 = (c1 // t) if c1 < width else -(-width // t)
+        ty1 = (r1 // t) if r1 < height else -(-height // t)
+        if tx0 >= tx1 or ty0 >= ty1:
+            return None, [(r0, r1, c0, c1)] if r1 > r0 and c1 > c0 else []
+
+        inner_r0, inner_r1 = ty0 * t, min(height, ty1 * t)
+        inner_c0, inner_c1 = tx0 * t, min(width, tx1 * t)
+        edges = [
+            (r0, inner_r0, c0, c1),  # top
+            (inner_r1, r1, c0, c1),  # bottom
+            (inner_r0, inner_r1, c0, inner_c0),  # left
+            (inner_r0, inner_r1, inner_c1, c1),  # right
+        ]
+        return (ty0, ty1, tx0, tx1), [(e_r0, e_r1, e_c0, e_c1) for e_r0, e_r1, e_c0, e_c1 in edges if e_r1 > e_r0 and e_c1 > e_c0]
+
+    def class_counts(self, bounding_box: BoundingBox) -> tuple[np.ndarray, np.ndarray] | None:
+        """
+        Palette colors and level 0 pixel counts of the bounding box. Whole interior tiles come from
+        the tile histograms, only the partial tiles along the edges are read and counted.
+        None if the layer has no class histograms.
+        """
+        if "palette" not in self.meta:
+            return None
+        histograms = np.load(self.path / "class_histograms.npy", mmap_mode="r")
+        palette = np.array(self.meta["palette"], dtype=np.uint8)
+        tiles, edges = self._split_window(*self._pixel_window(bounding_box))
+
+        counts = np.zeros(len(palette), dtype=np.int64)
+        if tiles is not None:
+            ty0, ty1, tx0, tx1 = tiles
+            counts += (histograms[ty1, tx1] - histograms[ty0, tx1] - histograms[ty1, tx0] + histograms[ty0, tx0]).astype(np.int64)
+        for e_r0, e_r1, e_c0, e_c1 in edges:
+            counts += palette_counts(self.read_window(0, e_r0, e_r1, e_c0, e_c1), palette)
+        return palette, counts
+
+    def build_value_histograms(self, edges: np.ndarray):
+        """
+        Counts the values of every level 0 tile in the bins between `edges`, values outside of all bins
+        are not counted. Like the class histograms, the counts are stored cumulated over tile rows and columns.
+        The min and max of every tile are stored alongside.
+        """
+        tiles = self.levels[0]
+        t = self.tile_size
+        height, width = self.shape(0)
+        histograms = np.zeros((tiles.shape[0] + 1, tiles.shape[1] + 1, len(edges) - 1), dtype=np.int64)
+        ranges = np.zeros((tiles.shape[0], tiles.shape[1], 2), dtype=np.float64)
+        for ty in range(tiles.shape[0]):
+            for tx in range(tiles.shape[1]):
+                tile = tiles[ty, tx, :min(t, height - ty * t), :min(t, width - tx * t), 0]
+                histograms[ty + 1, tx + 1] = bin_counts(tile, edges)
+                ranges[ty, tx] = tile.min(), tile.max()
+        np.save(self.path / "value_histograms.npy", histograms.cumsum(axis=0).cumsum(axis=1))
+        np.save(self.path / "tile_ranges.npy", ranges)
+        self.meta["value_edges"] = np.asarray(edges, dtype=np.float64).tolist()
+        (self.path / "meta.json").write_text(json.dumps(self.meta, indent=2))
+
+    def value_stats(self, bounding_box: BoundingBox, edges: np.ndarray) -> tuple[float, float, np.ndarray, int] | None:
+        """
+        Min, max, bin counts and the number of level 0 pixels of the bounding box, from the tile histograms
+        and ranges plus the partial tiles along the edges. None if the layer has no value histograms
+        with these `edges` or the bounding box holds no pixel.
+        """
+        if not np.array_equal(self.meta.get("value_edges", []), np.asarray(edges, dtype=np.float64)):
+            return None
+        r0, r1, c0, c1 = self._pixel_window(bounding_box)
+        if r1 == r0 or c1 == c0:
+            return None
+        tiles, edge_windows = self._split_window(r0, r1, c0, c1)
+
+        counts = np.zeros(len(edges) - 1, dtype=np.int64)
+        mins, maxs = [], []
+        if tiles is not None:
+            ty0, ty1, tx0, tx1 = tiles
+            histograms = np.load(self.path / "value_histograms.npy", mmap_mode="r")
+            ranges = np.load(self.path / "tile_ranges.npy", mmap_mode="r")[ty0:ty1, tx0:tx1]
+            counts += (histograms[ty1, tx1] - histograms[ty0, tx1] - histograms[ty1, tx0] + histograms[ty0, tx0]).astype(np.int64)
+            mins.append(ranges[..., 0].min())
+            maxs.append(ranges[..., 1].max())
+        for e_r0, e_r1, e_c0, e_c1 in edge_windows:
+            values = self.read_window(0, e_r0, e_r1, e_c0, e_c1)[..., 0]
+            counts += bin_counts(values, edges)
+            mins.append(values.min())
+            maxs.append(values.max())
+        return float(min(mins)), float(max(maxs)), counts, (r1 - r0) * (c1 - c0)
+
+
+class RasterStore:
+    def __init__(self, root: Path):
+        self.root = root
+        self.layers = {}
+        if root.exists():
+            for meta_path in root.glob("*/meta.json"):
+                layer = RasterLayer(meta_path.parent)
+                self.layers[layer.meta["key"]] = layer
+
+    def get_layer(self, endpoint: str, alt_params: dict = {}) -> RasterLayer | None:
+        return self.layers.get(layer_key(endpoint, alt_params))
+
+    def class_counts(self, bounding_box: BoundingBox, endpoint: str, alt_params: dict) -> tuple[np.ndarray, np.ndarray] | None:
+        """Palette colors and pixel counts from the tile histograms, None if not available for the area."""
+        layer = self.get_layer(endpoint, alt_params)
+        if layer is None or not layer.covers(bounding_box):
+            return None
+        with span("store.class_counts", layer=layer.meta["key"], cache_hit=True):
+            return layer.class_counts(bounding_box)
+
+    def aggregate(self, bounding_box: BoundingBox, endpoint: str, alt_params: dict = {}) -> float | None:
+        """
+        Mean (or total for per-cell layers) of the layer over the bounding box from its summed area table,
+        None if not available for the area.
+        """
+        layer = self.get_layer(endpoint, alt_params)
+        if layer is None or not layer.covers(bounding_box):
+            return None
+        with span("store.aggregate", layer=layer.meta["key"], cache_hit=True):
+            result = layer.window_sum(bounding_box)
+            if result is None or result[1] == 0:
+                return None
+            total, area = result
+            return total if layer.meta["summed_area"]["aggregation"] == "sum" else total / area
+
+    def value_stats(self, bounding_box: BoundingBox, endpoint: str, edges: np.ndarray, alt_params: dict = {}) -> tuple[float, float, np.ndarray, int] | None:
+        """Min, max, bin counts and pixel count from the tile histograms, None if not available for the area."""
+        layer = self.get_layer(endpoint, alt_params)
+        if layer is None or not layer.covers(bounding_box):
+            return None
+        with span("store.value_stats", layer=layer.meta["key"], cache_hit=True):
+            return layer.value_stats(bounding_box, edges)
+
+    def read_map(self, bounding_box: BoundingBox, endpoint: str, alt_params: dict, width: int, height: int) -> Image.Image | None:
+        """Returns the map from the store, or None if the layer is not stored or does not cover the area."""
+        layer = self.get_layer(endpoint, alt_params)
+        if layer is None or not layer.covers(bounding_box):
+            return None
+        with span("store.read_map", layer=layer.meta["key"], cache_hit=True):
+            return layer.read_map(bounding_box, width, height)
+
+def palette_counts(pixels: np.ndarray, palette: np.ndarray) -> np.ndarray:
+    """Pixel count of every palette color, colors off the palette are counted for the closest palette color."""
+    from scipy.spatial import KDTree
+
+    pixels = pixels.reshape(-1, pixels.shape[-1]).astype(np.uint32)
+    codes = (pixels[:, 0] << 16) | (pixels[:, 1] << 8) | pixels[:, 2]
+    unique_codes, counts = np.unique(codes, return_counts=True)
+    unique_rgb = np.stack([(unique_codes >> 16) & 0xFF, (unique_codes >> 8) & 0xFF, unique_codes & 0xFF], axis=-1)
+    _, indices = KDTree(palette.astype(np.float64)).query(unique_rgb)
+    return np.bincount(indices, weights=counts, minlength=len(palette)).astype(np.int64)
+
+def bin_counts(values: np.ndarray, edges: np.ndarray) -> np.ndarray:
+    """Count of values in every bin between `edges`, values outside of all bins are not counted."""
+    bins = np.searchsorted(edges, values.ravel(), side="right") - 1
+    return np.bincount(bins[(bins >= 0) & (bins < len(edges) - 1)], minlength=len(edges) - 1).astype(np.int64)
+
+def get_store_root() -> Path:
+    return PROJECT_ROOT / cfg.get('RASTER_STORE', 'path', fallback='data/raster_store')
+
+@lru_cache(maxsize=1)
+def get_raster_store() -> RasterStore | None:
+    """Process-wide store of locally ingested layers, None when disabled."""
+    if not cfg.getboolean('RASTER_STORE', 'enabled', fallback=True):
+        return None
+    return RasterStore(get_store_root())
@@ -0,0 +1,115 @@
+from collections import OrderedDict
+from collections.abc import MutableMapping
+import threading
+
+from langchain_core.runnables import RunnableConfig
+
+
+class SessionStore(MutableMapping):
+    """
+    Key-value state of a single chat session (chat history, all generated messages, ...).
+    Agents access the session only through this interface, so they can run outside Streamlit.
+    """
+
+
+class InMemorySessionStore(SessionStore):
+    """Plain dictionary backed session, used by headless runners."""
+    def __init__(self, **initial):
+        self._data = dict(initial)
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __setitem__(self, key, value):
+        self._data[key] = value
+
+    def __delitem__(self, key):
+        del self._data[key]
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class StreamlitSessionStore(SessionStore):
+    """Proxy to `st.session_state` of the current Streamlit script run."""
+    @property
+    def _state(self):
+        import streamlit as st
+        return st.session_state
+
+    def __getitem__(self, key):
+        return self._state[key]
+
+    def __setitem__(self, key, value):
+        self._state[key] = value
+
+    def __delitem__(self, key):
+        del self._state[key]
+
+    def __iter__(self):
+        return iter(list(self._state.keys()))
+
+    def __len__(self):
+        return len(self._state)
+
+
+def get_session_store(config: RunnableConfig | None = None) -> SessionStore:
+    """
+    Returns the session store passed in `config["configurable"]["session_store"]`,
+    falling back to the Streamlit session state.
+    """
+    if config is not None:
+        session = config.get("configurable", {}).get("session_store")
+        if session is not None:
+            return session
+    return StreamlitSessionStore()
+
+
+class SessionBackend:
+    """
+    Pluggable storage of sessions keyed by session id, used by services hosting many sessions at once.
+    """
+    def get(self, session_id: str) -> SessionStore:
+        """Returns the session with given id, creating an empty one if it does not exist."""
+        raise NotImplementedError
+
+    def delete(self, session_id: str):
+        raise NotImplementedError
+
+    def __contains__(self, session_id: str) -> bool:
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+
+class InMemorySessionBackend(SessionBackend):
+    """Keeps sessions in process memory, evicting the least recently used one above `max_sessions`."""
+    def __init__(self, max_sessions: int = 1000):
+        self.max_sessions = max_sessions
+        self._sessions: OrderedDict[str, InMemorySessionStore] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id: str) -> SessionStore:
+        with self._lock:
+            if session_id in self._sessions:
+                self._sessions.move_to_end(session_id)
+                return self._sessions[session_id]
+            session = InMemorySessionStore(session_id=session_id)
+            self._sessions[session_id] = session
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+            return session
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def __contains__(self, session_id: str) -> bool:
+        return session_id in self._sessions
+
+    def __len__(self) -> int:
+        return len(self._sessions)
@@ -0,0 +1,115 @@
+from functools import lru_cache
+
+import numpy as np
+
+from schemas.geometry import BoundingBox, PointMarker
+from utils.instrumentation import span, traced
+from utils.tool_utils import get_spoi_data
+
+# ETRS89 Lambert Azimuthal Equal Area, metric coordinates valid over all of Europe
+PROJECTED_CRS = "EPSG:3035"
+
+@lru_cache(maxsize=1)
+def _get_transformer():
+    from pyproj import Transformer
+
+    return Transformer.from_crs("EPSG:4326", PROJECTED_CRS, always_xy=True)
+
+def project_lonlat(lon, lat) -> np.ndarray:
+    """Projects lon/lat degrees to (N, 2) metres."""
+    x, y = _get_transformer().transform(np.asarray(lon, dtype=np.float64), np.asarray(lat, dtype=np.float64))
+    return np.column_stack([np.atleast_1d(x), np.atleast_1d(y)])
+
+
+class SpoiIndex:
+    """
+    KD-trees over the points of interest of one area in projected metres, one over all points
+    and one per category built on first use.
+    """
+    def __init__(self, spoi: dict):
+        from scipy.spatial import KDTree
+
+        self.spoi = spoi
+        self.categories = spoi["categories"]
+        self.category_ids = spoi["category_ids"]
+        self.labels = spoi["labels"]
+        valid = ~np.isnan(spoi["coords"]).any(axis=1)
+        self.indices = np.flatnonzero(valid)
+        self.points = project_lonlat(spoi["coords"][valid, 0], spoi["coords"][valid, 1]) if valid.any() else np.empty((0, 2))
+        self.tree = KDTree(self.points)
+        self._category_trees = {}
+
+    def _category_tree(self, category: str):
+        from scipy.spatial import KDTree
+
+        if category not in self._category_trees:
+            if category not in self.categories:
+                self._category_trees[category] = (None, None)
+            else:
+                mask = self.category_ids[self.indices] == self.categories.index(category)
+                self._category_trees[category] = (KDTree(self.points[mask]), self.indices[mask]) if mask.any() else (None, None)
+        return self._category_trees[category]
+
+    def _tree(self, category: str | None):
+        if category is None:
+            return (self.tree, self.indices) if len(self.indices) else (None, None)
+        return self._category_tree(category)
+
+    def nearest(self, marker: PointMarker, k: int = 5, category: str | None = None) -> list[tuple[str, str, float]]:
+        """k nearest points of interest as (category, label, distance in metres)."""
+        tree, indices = self._tree(category)
+        if tree is None:
+            return []
+        point = self.project_marker(marker)
+        k = min(k, len(indices))
+        distances, positions = tree.query(point, k=k)
+        distances, positions = np.atleast_1d(distances), np.atleast_1d(positions)
+        return [
+            (self.categories[self.category_ids[indices[p]]], self.labels[indices[p]], float(d))
+            for d, p in zip(distances, positions)
+        ]
+
+    def count_within(self, marker: PointMarker, radius_m: float) -> dict[str, int]:
+        """Number of points of interest per category within the radius."""
+        if not len(self.indices):
+            return {}
+        positions = self.tree.query_ball_point(self.project_marker(marker), r=radius_m)
+        counts = np.bincount(self.category_ids[self.indices[positions]], minlength=len(self.categories))
+        return {self.categories[i]: int(counts[i]) for i in np.argsort(-counts, kind="stable") if counts[i] > 0}
+
+    def distance_to_nearest(self, marker: PointMarker, categories: list[str] | None = None) -> dict[str, float]:
+        """Distance in metres to the nearest point of interest of every category present in the area."""
+        point = self.project_marker(marker)
+        distances = {}
+        for category in categories or self.categories:
+            tree, _ = self._category_tree(category)
+            if tree is not None:
+                distances[category] = float(tree.query(point)[0])
+        return dict(sorted(distances.items(), key=lambda item: item[1]))
+
+    @staticmethod
+    def project_marker(marker: PointMarker) -> np.ndarray:
+        point = marker.as_point()
+        return project_lonlat(point.x, point.y)[0]
+
+@lru_cache(maxsize=16)
+def get_spoi_index(bounding_box_wkt: str) -> SpoiIndex:
+    """SPOI of the area with its spatial index, cached per area so repeated queries reuse one fetch."""
+    spoi = get_spoi_data(BoundingBox(wkt=bounding_box_wkt))
+    with span("cpu.index.spoi", features=len(spoi["labels"])):
+        return SpoiIndex(spoi)
+
+@traced("cpu.lookup.spoi_proximity")
+def get_proximity_features(bounding_box: BoundingBox, marker: PointMarker, radius_m: float = 500) -> dict:
+    """
+    Marker context used next to the hotel model: number of points of interest within the radius
+    and distance to the nearest point of every category.
+    """
+    index = get_spoi_index(bounding_box.wkt)
+    within = index.count_within(marker, radius_m)
+    return {
+        "radius_m": radius_m,
+        "total_within_radius": sum(within.values()),
+        "within_radius": within,
+        "nearest_m": index.distance_to_nearest(marker),
+    }
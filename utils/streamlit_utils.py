@@ -1,15 +1,27 @@
+import configparser
 import json
 import re
 import time
 
+import numpy as np
+import pandas as pd
 import streamlit as st
 
 from langchain_core.messages import AnyMessage
-from langsmith import Client
 from shapely.geometry import shape
 from streamlit.components.v1 import html
 
-from utils.agent_utils import get_chat_history
+from paths import PROJECT_ROOT
+from utils.agent_utils import get_artifact_store, get_chat_history
+from utils.artifact_store import Artifact
+from utils.feedback_queue import Feedback, get_feedback_queue
+from utils.warmup import get_warmup
+
+cfg = configparser.ConfigParser()
+cfg.read(f'{PROJECT_ROOT}/config.ini')
+
+# Messages of the conversation rendered at once, more are loaded on request
+VISIBLE_MESSAGES = cfg.getint('CHAT_HISTORY', 'visible_messages', fallback=50)
 
 def parse_drawing_geometry(map_data: dict, drawing_type: str) -> str:
     if not map_data["all_drawings"]:
@@ -26,38 +38,26 @@ def parse_drawing_geometry(map_data: dict, drawing_type: str) -> str:
 
 def post_message_feedback(message: AnyMessage, key: str, correction: dict | None = None):
     # Every st widget with a defined key will be stored in the session state
-    score = st.session_state.get(f"{message.run_id}_{getattr(message, "alternative_id", None)}")
-    if score is None:
+    score = st.session_state.get(f"{message.run_id}_{getattr(message, 'alternative_id', None)}")
+    if score is None or score == getattr(message, "feedback_score", None):
         return
-
-    client = Client()
-    if getattr(message, "feedback_score", None) is not None:
-        if (score == message.feedback_score):
-            return
-        client.update_feedback(
-            feedback_id=message.feedback_id,
-            score=score
-        )
-    else:
-        fb = client.create_feedback(
-            run_id=message.run_id,
-            key=key,
-            score=score,
-            correction=correction
-        )
-        message.feedback_id = fb.id
+    # Sent in the background, repeated changes of the score update the same feedback,
+    # its id is stored with the message so the feedback is updated also after a restart
+    feedback = Feedback(run_id=message.run_id, key=key, score=score, correction=correction, feedback_id=getattr(message, "feedback_id", None))
+    get_feedback_queue().submit(feedback)
+    message.feedback_id = feedback.feedback_id
     message.feedback_score = score
+    get_chat_history().update_message(message)
 
 def post_ab_feedback(run_id, value, comment, context_response_first):
-    client = Client()
-    client.create_feedback(
+    get_feedback_queue().submit(Feedback(
         run_id=run_id,
         key="ab",
         score=0 if value == "Option A" else 1,
         comment=comment,
         value=value,
         correction={"context_response": "Option A" if context_response_first else "Option B"}
-    )
+    ))
 
 def print_tool_calls(tool_calls):
     texts = []
@@ -67,6 +67,13 @@ def print_tool_calls(tool_calls):
         )
     return "\n".join(texts)
 
+def print_timings(timings):
+    rows = ["| Step | Time [ms] | CPU [ms] | Details |", "| --- | ---: | ---: | --- |"]
+    for t in timings:
+        details = ", ".join(f"{k}: {t[k]}" for k in ("host", "status", "bytes", "cache_hit", "error") if k in t)
+        rows.append(f"| {t['name']} | {t['ms']:.1f} | {t['cpu_ms']:.1f} | {details} |")
+    return "\n".join(rows)
+
 def write_message(message: AnyMessage):
     if message.type == "human":
         st.chat_message("human").write(message.content)
@@ -81,9 +88,14 @@ def write_message(message: AnyMessage):
             ai_msg.feedback(
                 "stars",
                 key=f"{run_id}_{getattr(message, "alternative_id", None)}",
-                on_change=post_message_feedback(message, "stars"),
+                on_change=post_message_feedback,
+                args=(message, "stars"),
                 disabled=st.session_state["inputs_disabled"]
             )
+        timings = getattr(message, "timings", None)
+        if timings and st.session_state["show_tool_calls"]:
+            with ai_msg.expander("Timing breakdown"):
+                st.markdown(print_timings(timings))
 
     if st.session_state["show_tool_calls"]:
         if "tool_calls" in message.additional_kwargs:
@@ -94,13 +106,71 @@ def write_message(message: AnyMessage):
             tool_msg = st.chat_message("tool", avatar="🛠️")
             with tool_msg.expander(message.name):
                 st.markdown(message.content.replace("\n", "  \n"), unsafe_allow_html=True)
+                artifact_ref = getattr(message, "artifact", None)
+                if isinstance(artifact_ref, dict) and "artifact_id" in artifact_ref:
+                    artifact = get_artifact_store().get(artifact_ref["artifact_id"])
+                    if artifact is not None:
+                        write_artifact(artifact, key=message.id)
+
+def write_artifact(artifact: Artifact, key: str):
+    """Renders the data loaded by a tool from its artifact, without fetching it again."""
+    arrays, meta = artifact.arrays, artifact.meta
+    if artifact.kind == "class_counts":
+        shares = pd.Series(arrays["counts"] / max(meta["n_pixels"], 1) * 100, index=meta["names"], name="Share [%]")
+        st.bar_chart(shares.sort_values(ascending=False), horizontal=True)
+    elif artifact.kind == "raster":
+        rgb = arrays["palette"][arrays["classes"]]
+        st.image(rgb, caption=f"Land use {meta['years'][-1]}", width="stretch")
+    elif artifact.kind == "forecast":
+        data = pd.DataFrame(
+            {v: arrays[v] for v in meta["variables"]},
+            index=pd.to_datetime(arrays["time"], unit="s", utc=True),
+        )
+        variable = st.selectbox("Variable", meta["variables"], key=f"artifact_{key}")
+        st.line_chart(data[variable])
+    elif artifact.kind == "points":
+        coords = arrays["coords"].astype(np.float64)
+        points = pd.DataFrame({"lon": coords[:, 0], "lat": coords[:, 1]})
+        st.map(points, latitude="lat", longitude="lon", size=20)
+    elif artifact.kind == "series":
+        st.line_chart(pd.Series(arrays["y"], index=arrays["x"], name=meta["y"]))
+    elif artifact.kind == "text":
+        st.text(meta["full_output"])
+
+def show_earlier_messages():
+    st.session_state["visible_messages"] += VISIBLE_MESSAGES
+
+def show_warmup_status():
+    """Readiness of the preloaded models and indexes, refreshed until the warmup finished."""
+    warmup = get_warmup()
+    polling = not warmup.ready
+
+    @st.fragment(run_every=2 if polling else None)
+    def status():
+        report = warmup.report()
+        steps = report["steps"]
+        if not report["ready"]:
+            finished = sum(step["state"] in ("done", "failed") for step in steps.values())
+            st.info(f"Warming up ({finished}/{len(steps)}), the first answer may take longer.", icon="⏳")
+            return
+        if polling:
+            # Rerun the whole app once, so the status stops refreshing
+            st.rerun()
+        failed = [name for name, step in steps.items() if step["state"] == "failed"]
+        st.caption("✅ Ready" + (f" (loaded on first use: {', '.join(failed)})" if failed else ""))
+    status()
 
 def write_conversation():
     chat_history = get_chat_history()
-    for m in chat_history.messages:
+    # Only the tail of long conversations is loaded and rendered
+    visible = st.session_state.setdefault("visible_messages", VISIBLE_MESSAGES)
+    messages = chat_history.tail(visible)
+    if len(messages) == visible and len(chat_history) > visible:
+        st.button("Show earlier messages", on_click=show_earlier_messages)
+    for m in messages:
         alternative_id = getattr(m, "alternative_id", None)
-        if alternative_id:
-            alt_msg = st.session_state["all_messages"][alternative_id]
+        alt_msg = chat_history.get_message(alternative_id) if alternative_id else None
+        if alt_msg is not None:
             write_comparison_messages(m, alt_msg)
         else:
             write_message(m)
@@ -140,10 +210,16 @@ def write_comparison_messages(main_msg, alt_msg):
                 key=f"swap_btn_{element_id}"
             )
             st.markdown(main_msg.content.replace("\n", "  \n"), unsafe_allow_html=True)
+            timings = getattr(main_msg, "timings", None)
+            if timings and st.session_state["show_tool_calls"]:
+                with st.expander("Timing breakdown"):
+                    st.markdown(print_timings(timings))
             st.feedback(
                 "stars",
                 key=f"{main_msg.run_id}_{getattr(main_msg, 'alternative_id', None)}",
-                on_change=post_message_feedback(main_msg, "stars", correction={"original_position": "Option A" if main_msg.id == msg_A.id else "Option B"}),
+                on_change=post_message_feedback,
+                args=(main_msg, "stars"),
+                kwargs={"correction": {"original_position": "Option A" if main_msg.id == msg_A.id else "Option B"}},
                 disabled=st.session_state["inputs_disabled"]
             )
         else:
@@ -205,15 +281,18 @@ def choose_preferred_message(main_msg, alt_msg, preferred_option):
     msg_A, _ = sorted([main_msg, alt_msg], key=lambda x: x.id.split('-')[1][0])
     main_msg.choice_clicked = True
     alt_msg.choice_clicked = True
+    chat_history = get_chat_history()
+    chat_history.update_message(main_msg)
+    chat_history.update_message(alt_msg)
 
     if (preferred_option == "Option A" and msg_A.id != main_msg.id)\
         or (preferred_option == "Option B" and msg_A.id == main_msg.id):
         swap_preferred_message(main_msg, alt_msg)
 
-# TODO - preserve original message ids and other metadata after content swap?
 def swap_preferred_message(main_msg, alt_msg):
-    chat_history = get_chat_history()
-    for i, m in enumerate(chat_history.messages):
-        if m.id == main_msg.id:
-            chat_history.messages[i] = alt_msg
+    try:
+        get_chat_history().swap(main_msg.id, alt_msg.id)
+    except KeyError:
+        # A stale rerun, e.g. the chat history was cleared meanwhile
+        st.toast("The compared answers are no longer in the chat history.", icon="⚠️")
     
\ No newline at end of file
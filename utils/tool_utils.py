@@ -1,63 +1,284 @@
+from array import array
+import configparser
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+from functools import lru_cache
 from io import BytesIO
 
-import geopandas as gpd
 import json
+
 import numpy as np
 import requests
 import pandas as pd
 from PIL import Image
-from scipy.spatial import KDTree
 import streamlit as st
 
-from paths import DATA_DIR
+from paths import DATA_DIR, PROJECT_ROOT
 from schemas.geometry import BoundingBox, PointMarker
+from utils.cpu_pool import run_cpu_task
+from utils.deadline import degraded_size, request_timeout
+from utils.instrumentation import span, traced
 from utils.map_service_utils import *
+from utils.municipality_table import (
+    get_municipality_elevation_stats, get_municipality_land_counts, get_municipality_population
+)
+from utils.raster_store import get_raster_store
+from utils.upstream_guard import RASTER_FRESH_S, call_hedged, fetch_guarded, get_upstream
+
+cfg = configparser.ConfigParser()
+cfg.read(f'{PROJECT_ROOT}/config.ini')
+
+RASTER_SIZE = 1500
+# Peak memory of one raster reduction, larger rasters are fetched and reduced in row strips
+MAX_RASTER_BYTES = cfg.getint('PROCESSING', 'max_raster_mb', fallback=96) * 1024 * 1024
+# Estimated working memory per pixel: decoded image, array copy and reduction temporaries
+WORKING_BYTES_PER_PIXEL = {"png": 24, "gtiff": 32}
+# WFS paging of SPOI requests and the maximum number of features read for one area
+SPOI_PAGE_SIZE = cfg.getint('PROCESSING', 'spoi_page_size', fallback=2000)
+SPOI_MAX_FEATURES = cfg.getint('PROCESSING', 'spoi_max_features', fallback=20000)
+# Upstream requests of one tool call issued in parallel
+MAX_FETCH_WORKERS = cfg.getint('PROCESSING', 'max_fetch_workers', fallback=6)
 
 # DEM
-def count_elevation_zones(elevation_array):
-    zone_counts = {name: 0 for _, _, name in elevation_ranges}  # Initialize counts
+# Bin edges of the elevation zones
+ELEVATION_EDGES = np.array([min_val for min_val, _, _ in elevation_ranges] + [elevation_ranges[-1][1]])
+
+def reduce_elevation_strip(strip, edges, with_sum=True):
+    """
+    Sum, min, max and zone pixel counts of one DEM strip, values outside of all zones are not counted.
+    The sum is None without `with_sum`, e.g. when the mean comes from the local store.
+    """
+    zones = np.searchsorted(edges, strip.ravel(), side="right") - 1
+    zones = zones[(zones >= 0) & (zones < len(edges) - 1)]
+    total = float(strip.sum(dtype=np.float64)) if with_sum else None
+    return total, strip.min(), strip.max(), np.bincount(zones, minlength=len(edges) - 1)
+
+def get_elevation_stats(bounding_box: BoundingBox):
+    """
+    Mean, min, max and elevation zone pixel counts of the DEM, reduced strip by strip.
+    Areas covered by the local store are answered from its summed area table and tile histograms.
+    """
+    municipality_stats = get_municipality_elevation_stats(bounding_box, elevation_ranges)
+    if municipality_stats is not None:
+        return municipality_stats
+
+    # Exact area weighted mean from the local store, if the area is covered
+    store = get_raster_store()
+    stored_mean = store.aggregate(bounding_box, "DEM_MASL") if store is not None else None
+    if stored_mean is not None:
+        stored_stats = store.value_stats(bounding_box, "DEM_MASL", ELEVATION_EDGES)
+        if stored_stats is not None:
+            min_elevation, max_elevation, zone_counts, n_pixels = stored_stats
+            return {
+                "mean": stored_mean,
+                "min": min_elevation,
+                "max": max_elevation,
+                "zone_counts": {name: int(cnt) for (_, _, name), cnt in zip(elevation_ranges, zone_counts)},
+                "n_pixels": n_pixels,
+            }
 
-    for min_val, max_val, zone_name in elevation_ranges:
-        # Count values in the current range
-        count = np.sum((elevation_array >= min_val) & (elevation_array < max_val))
-        zone_counts[zone_name] += count
+    zone_counts = np.zeros(len(elevation_ranges), dtype=np.int64)
+    total, n_pixels = 0.0, 0
+    min_elevation, max_elevation = None, None
 
-    return zone_counts
+    for strip in iter_map_strips(bounding_box, "DEM_MASL"):
+        with span("cpu.aggregate.elevation_zones"):
+            strip_total, strip_min, strip_max, strip_zone_counts = run_cpu_task(
+                reduce_elevation_strip, strip, ELEVATION_EDGES, stored_mean is None
+            )
+            if strip_total is not None:
+                total += strip_total
+            n_pixels += strip.size
+            min_elevation = strip_min if min_elevation is None else min(min_elevation, strip_min)
+            max_elevation = strip_max if max_elevation is None else max(max_elevation, strip_max)
+            zone_counts += strip_zone_counts
+
+    return {
+        "mean": total / n_pixels if stored_mean is None else stored_mean,
+        "min": min_elevation,
+        "max": max_elevation,
+        "zone_counts": {name: int(cnt) for (_, _, name), cnt in zip(elevation_ranges, zone_counts)},
+        "n_pixels": n_pixels,
+    }
 
 # OLU
-def get_color_counts(image, rgb_mapping, n_colors=None):
-    pixels = np.array(image)
-    pixels = pixels.reshape(-1, 3)
+def count_unique_colors(pixels):
+    """
+    Returns unique RGB colors (N x 3 uint8) of the pixel array and their counts.
+    """
+    unique_codes, counts = np.unique(_rgb_to_codes(pixels.reshape(-1, 3)), return_counts=True)
+    return _codes_to_rgb(unique_codes), counts
+
+def merge_color_counts(colors_a, counts_a, colors_b, counts_b):
+    """Merges two (colors, counts) results of `count_unique_colors`."""
+    codes = _rgb_to_codes(np.concatenate([colors_a, colors_b]))
+    unique_codes, inverse = np.unique(codes, return_inverse=True)
+    counts = np.bincount(inverse, weights=np.concatenate([counts_a, counts_b]), minlength=len(unique_codes))
+    return _codes_to_rgb(unique_codes), counts.astype(np.int64)
+
+def _rgb_to_codes(rgb):
+    """Packs RGB triplets into single uint32 codes, so colors can be counted and compared as scalars."""
+    rgb = rgb.astype(np.uint32)
+    return (rgb[..., 0] << 16) | (rgb[..., 1] << 8) | rgb[..., 2]
 
-    pixels_view = pixels.view(np.dtype((np.void, pixels.dtype.itemsize * pixels.shape[1])))
-    unique_pixels, counts = np.unique(pixels_view, return_counts=True)
+def _codes_to_rgb(codes):
+    return np.stack([(codes >> 16) & 0xFF, (codes >> 8) & 0xFF, codes & 0xFF], axis=-1).astype(np.uint8)
+
+def map_color_counts(unique_pixels, counts, rgb_mapping, n_colors=None):
+    """
+    Assigns counts of colors missing in the mapping (e.g. anti-aliased edges) to the closest matched color.
+    Returns [(rgb, count)] sorted by count.
+    """
+    from scipy.spatial import KDTree
 
-    # Convert back to normal RGB tuples
-    unique_pixels = unique_pixels.view(pixels.dtype).reshape(-1, 3)
-    # Combine pixels and their counts
-    pixel_counts = zip(map(tuple, unique_pixels), counts)
     # Prepare KDTree for color mapping using only directly matched colors
-    matched_colors = [clr for clr in map(tuple, unique_pixels) if clr in list(rgb_mapping.values())]
-
-    rgb_counts = {tuple(rgb): 0 for rgb in matched_colors}
-    kdtree = KDTree(matched_colors)
-    # Get color counts for LU colors
-    for rgb, cnt in pixel_counts:
-        if rgb in rgb_counts:
-            rgb_counts[rgb] += cnt
-        else:
-            # Map missing colors using KDTree and add the count
-            _, index = kdtree.query(rgb)
-            closest_color = tuple(matched_colors[index])
-            rgb_counts[closest_color] += cnt
+    mapping_colors = np.array(list(set(rgb_mapping.values())), dtype=np.uint8)
+    matched_mask = np.isin(_rgb_to_codes(unique_pixels), _rgb_to_codes(mapping_colors))
+    matched_colors = unique_pixels[matched_mask]
+    rgb_counts = counts[matched_mask].astype(np.int64)
+
+    # Map missing colors using KDTree and add the count
+    if (~matched_mask).any():
+        kdtree = KDTree(matched_colors)
+        _, indices = kdtree.query(unique_pixels[~matched_mask])
+        np.add.at(rgb_counts, indices, counts[~matched_mask])
     # Sort by counts
-    sorted_pixel_counts = sorted([(k,v) for k,v in rgb_counts.items() if v != 0], reverse=True, key=lambda x: x[1])
+    sorted_pixel_counts = sorted([(tuple(k),int(v)) for k,v in zip(matched_colors.tolist(), rgb_counts) if v != 0], reverse=True, key=lambda x: x[1])
     # Get the top n colors
     return sorted_pixel_counts[:n_colors]
 
+def get_land_counts(bounding_box: BoundingBox, endpoint, alt_params, rgb_mapping):
+    """
+    Color counts of a land use/cover map reduced strip by strip.
+    Returns ([(rgb, count)] sorted by count, number of pixels).
+    Areas matching a municipality are answered from the municipality table,
+    areas covered by the local raster store from its per-tile class histograms.
+    """
+    if endpoint == "OLU_EU":
+        prefix = "lc" if {**map_config[endpoint]["data"], **alt_params}["layers"] == "olu_obj_lc" else "lu"
+        municipality_counts = get_municipality_land_counts(bounding_box, prefix, rgb_mapping)
+        if municipality_counts is not None:
+            return municipality_counts
+
+    store = get_raster_store()
+    class_counts = store.class_counts(bounding_box, endpoint, alt_params) if store is not None else None
+    if class_counts is not None and class_counts[1].sum() > 0:
+        colors, counts = class_counts
+        return map_color_counts(colors, counts, rgb_mapping), int(counts.sum())
+
+    colors = np.empty((0, 3), dtype=np.uint8)
+    counts = np.empty(0, dtype=np.int64)
+    n_pixels = 0
+    for strip in iter_map_strips(bounding_box, endpoint, alt_params):
+        with span("cpu.classify.color_counts"):
+            strip_colors, strip_counts = run_cpu_task(count_unique_colors, strip)
+            colors, counts = merge_color_counts(colors, counts, strip_colors, strip_counts)
+            n_pixels += strip.shape[0] * strip.shape[1]
+    with span("cpu.classify.map_colors"):
+        return map_color_counts(colors, counts, rgb_mapping), n_pixels
+
+# OLU time series
+OLU_CZ_YEARS = {int(time[:4]): time for time in map_config["OLU_CZ"]["alternatives"]["TIME"]}
+# Distinct land use colors, the index of a color is its class index
+LU_PALETTE = np.array(sorted(set(LU_rgb_mapping.values())), dtype=np.uint8)
+
+@lru_cache(maxsize=8)
+def get_palette_lookup(palette_bytes: bytes):
+    """
+    Color codes of an RGB palette with their sort order, and a KD-tree over its colors,
+    built once per process (and palette) instead of for every map strip.
+    """
+    from scipy.spatial import KDTree
+
+    palette = np.frombuffer(palette_bytes, dtype=np.uint8).reshape(-1, 3)
+    palette_codes = _rgb_to_codes(palette)
+    return palette_codes, np.argsort(palette_codes), KDTree(palette.astype(np.float64))
+
+def classify_pixels(pixels, palette):
+    """
+    Palette index (uint8) of every RGB pixel. The lookup table is built over the distinct colors only,
+    colors off the palette get the index of the closest palette color.
+    """
+    palette_codes, order, tree = get_palette_lookup(np.ascontiguousarray(palette, dtype=np.uint8).tobytes())
+    codes = _rgb_to_codes(pixels)
+    unique_codes, inverse = np.unique(codes, return_inverse=True)
+    lut = order[np.searchsorted(palette_codes[order], unique_codes).clip(max=len(palette_codes) - 1)]
+    unmatched = palette_codes[lut] != unique_codes
+    if unmatched.any():
+        _, lut[unmatched] = tree.query(_codes_to_rgb(unique_codes[unmatched]))
+    return lut.astype(np.uint8)[inverse].reshape(codes.shape)
+
+@lru_cache(maxsize=32)
+def get_land_use_classes(bounding_box_wkt: str, year: int, width=RASTER_SIZE, height=RASTER_SIZE):
+    """
+    Land use class indices of the OLU_CZ snapshot of the year, cached as read-only arrays.
+    The size is fixed by the caller, so that all years of a series match.
+    """
+    bounding_box = BoundingBox(wkt=bounding_box_wkt)
+    strips = []
+    for strip in iter_map_strips(bounding_box, "OLU_CZ", {"TIME": OLU_CZ_YEARS[year]}, width, height, degradable=False):
+        with span("cpu.classify.palette_lookup", layer="OLU_CZ"):
+            strips.append(run_cpu_task(classify_pixels, strip, LU_PALETTE))
+    classes = np.concatenate(strips)
+    classes.flags.writeable = False
+    return classes
+
+@traced("cpu.aggregate.land_use_change")
+def get_land_use_change(series, years):
+    """
+    Class counts per year, first to last year transition matrix (from class x to class)
+    and the per-class trend of the area share in share points per year.
+    """
+    n_classes = len(LU_PALETTE)
+    counts = np.stack([np.bincount(classes.ravel(), minlength=n_classes) for classes in series])
+    pairs = series[0].ravel().astype(np.int64) * n_classes + series[-1].ravel()
+    transitions = np.bincount(pairs, minlength=n_classes * n_classes).reshape(n_classes, n_classes)
+    shares = counts / series[0].size
+    trends = np.polyfit(years, shares, 1)[0] if len(years) > 1 else np.zeros(n_classes)
+    return counts, transitions, trends
+
+# Eurostat
+def sum_population_strips(strips):
+    """
+    Sums distinct pixel values, as the WMS raster repeats every population grid cell value over many pixels.
+    The distinct values are collected strip by strip.
+    """
+    values = np.empty(0, dtype=np.float64)
+    for strip in strips:
+        with span("cpu.aggregate.population"):
+            values = np.union1d(values, run_cpu_task(np.unique, strip))
+    return int(np.sum(values))
+
+def get_population(bounding_box: BoundingBox, layer="total_population_eurostat_griddata_2021"):
+    """
+    Population total of the Eurostat grid, streamed strip by strip from the WMS.
+    Areas covered by the local store are answered with an area weighted sum of the grid cells.
+    """
+    if layer == "total_population_eurostat_griddata_2021":
+        municipality_population = get_municipality_population(bounding_box)
+        if municipality_population is not None:
+            return municipality_population
+    alt_params = {"layers": layer}
+    store = get_raster_store()
+    stored_total = store.aggregate(bounding_box, "EUROSTAT_2021", alt_params) if store is not None else None
+    if stored_total is not None:
+        return int(round(stored_total))
+    return sum_population_strips(iter_map_strips(bounding_box, "EUROSTAT_2021", alt_params))
+
+# Continuous rasters
+def get_raster_mean(bounding_box: BoundingBox, endpoint, alt_params={}):
+    """Mean of a single band raster, from the summed area table of the local store if available."""
+    store = get_raster_store()
+    stored_mean = store.aggregate(bounding_box, endpoint, alt_params) if store is not None else None
+    if stored_mean is not None:
+        return stored_mean
+    width, height = degraded_size(RASTER_SIZE, RASTER_SIZE)
+    return float(np.asarray(get_map(bounding_box, endpoint, alt_params, width, height)).mean())
+
 def find_square_for_marker(square_list, marker_point: PointMarker):
-    m_lon = marker_point.x
-    m_lat = marker_point.y
+    point = marker_point.as_point()
+    m_lon = point.x
+    m_lat = point.y
     for square in square_list:
         lat1, lon1, lat2, lon2 = map(float, square.split('_'))
 
@@ -66,23 +287,79 @@ def find_square_for_marker(square_list, marker_point: PointMarker):
     return None
 
 # SPOI
-def get_spoi_data(bounding_box: BoundingBox):
+def get_spoi_data(bounding_box: BoundingBox, page_size=SPOI_PAGE_SIZE, max_features=SPOI_MAX_FEATURES):
+    """
+    Points of interest of the area as compact arrays. The GeoJSON is parsed incrementally while it is
+    downloaded and large areas are requested in pages, so neither the payload nor the features are held whole.
+    Returns {"categories": [name], "category_ids": (N,) int16, "labels": [label], "coords": (N, 2) lon/lat, "truncated": bool}.
+    """
+    import ijson
+
     # SPOI endpoint expects lon1, lat1, lon2, lat2
-    response = requests.get(
-        wfs_config["SPOI"]["wfs_root_url"],
-        params={**wfs_config["SPOI"]["data"], **{"bbox": bounding_box.to_string_lonlat()}},
-        stream=True
-    )
-    return response.json()
+    url = resolve_upstream_url(wfs_config["SPOI"]["wfs_root_url"])
+    upstream = get_upstream(url)
+    categories = {}
+    category_ids, coords, labels = array("h"), array("d"), []
+    start = 0
+    while start < max_features:
+        n_page = min(page_size, max_features - start)
+        with upstream.guard(), span("http.get_feature", host=upstream.host, layer="SPOI", start_index=start) as record:
+            response = requests.get(
+                url,
+                params={**wfs_config["SPOI"]["data"], **{"bbox": bounding_box.to_string_lonlat(), "maxFeatures": n_page, "startIndex": start}},
+                stream=True,
+                timeout=request_timeout(upstream.timeout),
+            )
+            response.raise_for_status()
+            response.raw.decode_content = True
+            n_read = 0
+            for feature in ijson.items(response.raw, "features.item", use_float=True):
+                properties = feature.get("properties") or {}
+                category = properties.get("cat") or ""
+                category_ids.append(categories.setdefault(category[category.rfind("#") + 1:], len(categories)))
+                labels.append(properties.get("label") or "")
+                point = (feature.get("geometry") or {}).get("coordinates") or [np.nan, np.nan]
+                coords.extend(point[:2])
+                n_read += 1
+            record.update(status=response.status_code, bytes=response.raw.tell(), cache_hit=False, features=n_read)
+        start += n_read
+        if n_read < n_page:
+            break
+
+    return {
+        "categories": list(categories),
+        "category_ids": np.frombuffer(category_ids, dtype=np.int16),
+        "labels": labels,
+        "coords": np.frombuffer(coords, dtype=np.float64).reshape(-1, 2),
+        "truncated": start >= max_features,
+    }
 
 # Tourism
-def get_region_tourism_data(bounding_box: BoundingBox):
+@lru_cache(maxsize=1)
+def load_tourism_data():
     """
-    Currently works only with Czech Republic region data.
+    Loads region geometries with visitor statistics and the municipality codelist used for region names,
+    once per process. The spatial index of the regions is built right away.
     """
+    import geopandas as gpd
+
     gdf = gpd.GeoDataFrame.from_file(f'{DATA_DIR}/visitors.geojson')
+    gdf.sindex
     df = pd.read_csv(f'{DATA_DIR}/ciselnik_obci.csv', index_col='chodnota')
-    regions = gdf[gdf.intersects(bounding_box.geom)]
+    return gdf, df
+
+def get_region_tourism_data(bounding_box: BoundingBox):
+    """
+    Currently works only with Czech Republic region data.
+    """
+    with span("io.load_tourism_data"):
+        gdf, df = load_tourism_data()
+    return find_region_tourism_data(bounding_box, gdf, df)
+
+@traced("cpu.lookup.tourism_region")
+def find_region_tourism_data(bounding_box: BoundingBox, gdf, df):
+    # Positions are sorted, so the first region is the same as with a full scan
+    regions = gdf.iloc[np.sort(gdf.sindex.query(bounding_box.geom, predicate="intersects"))]
     # No regions found
     if regions.empty:
         return None, None
@@ -107,11 +384,88 @@ def is_number(s):
     except ValueError:
         return False
 
-def get_map(bounding_box: BoundingBox, endpoint, alt_params={}):
+def map_concurrently(func, items, max_workers=MAX_FETCH_WORKERS):
+    """
+    Calls `func` on every item in a thread pool and returns the results in order.
+    Every call runs in a copy of the caller's context, so its spans end up in the current trace.
+    """
+    items = list(items)
+    if len(items) <= 1:
+        return [func(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        futures = [executor.submit(contextvars.copy_context().run, func, item) for item in items]
+        return [future.result() for future in futures]
+
+def get_map(bounding_box: BoundingBox, endpoint, alt_params={}, width=RASTER_SIZE, height=RASTER_SIZE):
+    """
+    Returns the map from the local raster store if the layer was ingested for the area, otherwise from the WMS.
+    """
+    store = get_raster_store()
+    if store is not None:
+        image = store.read_map(bounding_box, endpoint, alt_params, width, height)
+        if image is not None:
+            return image
+    return get_wms_map(bounding_box, endpoint, alt_params, width, height)
+
+def get_wms_map(bounding_box: BoundingBox, endpoint, alt_params={}, width=RASTER_SIZE, height=RASTER_SIZE):
+    """
+    Requests the map from the WMS under the limits of its host, with a hedged duplicate for requests in the latency tail.
+    The encoded map is cached, so the last successful response is still served while the WMS is slow or unavailable.
+    """
     api_setup = map_config[endpoint]
-    response = requests.get(
-        api_setup["wms_root_url"],
-        params={**api_setup["data"], **{"bbox": bounding_box.to_string_latlon(), "height":"1500", "width":"1500"}, **alt_params},
-        stream=True
+    url = resolve_upstream_url(api_setup["wms_root_url"])
+    params = {**api_setup["data"], **{"bbox": bounding_box.to_string_latlon(), "height":str(height), "width":str(width)}, **alt_params}
+    upstream = get_upstream(url)
+
+    def request():
+        with span("http.get_map", host=upstream.host, layer=endpoint) as record:
+            response = requests.get(url, params=params, stream=True, timeout=request_timeout(upstream.timeout))
+            response.raise_for_status()
+            content = response.content
+            record.update(status=response.status_code, bytes=len(content), cache_hit=False)
+        # WMS errors come as service exception documents with status 200, they must not be cached
+        if "xml" in response.headers.get("Content-Type", ""):
+            raise ValueError(f"{endpoint} WMS error: {content[:200].decode(errors='replace')}")
+        return content
+
+    content = fetch_guarded(
+        url, (url, tuple(sorted(params.items()))), lambda: call_hedged(upstream, request), fresh_s=RASTER_FRESH_S, nbytes=len
     )
-    return Image.open(BytesIO(response.content))
\ No newline at end of file
+    with span("cpu.decode.image", layer=endpoint):
+        image = Image.open(BytesIO(content))
+        image.load()
+    return image
+
+def get_strip_rows(endpoint, width=RASTER_SIZE, max_bytes=None):
+    """
+    Number of raster rows that fit into the memory ceiling, including the decoded image,
+    its array copy and the reduction temporaries.
+    """
+    max_bytes = max_bytes or MAX_RASTER_BYTES
+    bytes_per_pixel = WORKING_BYTES_PER_PIXEL[map_config[endpoint]["data"]["format"]]
+    return max(1, max_bytes // (bytes_per_pixel * width))
+
+def iter_map_strips(bounding_box: BoundingBox, endpoint, alt_params={}, width=RASTER_SIZE, height=RASTER_SIZE, degradable=True):
+    """
+    Yields the map of the bounding box as numpy row strips from north to south. Each strip is requested
+    as a separate latitude band, so only one strip is held in memory at a time.
+    RGB maps are yielded as (rows, width, 3) uint8 arrays, GeoTIFF maps as (rows, width) arrays.
+    Close to the question deadline a degradable map is requested at a coarser resolution.
+    """
+    if degradable:
+        width, height = degraded_size(width, height)
+    rows = min(height, get_strip_rows(endpoint, width))
+    minx, miny, maxx, maxy = bounding_box.bounds_lonlat()
+    lat_step = (maxy - miny) / height
+    for top in range(0, height, rows):
+        strip_height = min(rows, height - top)
+        if strip_height == height:
+            band = bounding_box
+        else:
+            band = BoundingBox.from_bounds(minx, maxy - (top + strip_height) * lat_step, maxx, maxy - top * lat_step)
+        image = get_map(band, endpoint, alt_params, width=width, height=strip_height)
+        if map_config[endpoint]["data"]["format"] == "png" and image.mode != "RGB":
+            image = image.convert("RGB")
+        strip = np.asarray(image)
+        del image
+        yield strip
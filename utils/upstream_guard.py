@@ -0,0 +1,334 @@
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, TimeoutError as FutureTimeout, wait
+import configparser
+from contextlib import contextmanager
+import contextvars
+import logging
+import sys
+import threading
+import time
+from typing import Any, Callable, Hashable
+from urllib.parse import urlparse
+
+from paths import PROJECT_ROOT
+from utils.deadline import check_deadline, deadline_scope
+from utils.instrumentation import span
+
+cfg = configparser.ConfigParser()
+cfg.read(f'{PROJECT_ROOT}/config.ini')
+
+logger = logging.getLogger(__name__)
+
+# Cached upstream responses (encoded rasters, forecasts) kept for the stale fallback
+CACHE_MAX_BYTES = cfg.getint('UPSTREAMS', 'cache_max_mb', fallback=256) * 1024 * 1024
+# Cached responses younger than this are used without calling the upstream
+RASTER_FRESH_S = cfg.getfloat('UPSTREAMS', 'raster_fresh_s', fallback=86400)
+FORECAST_FRESH_S = cfg.getfloat('UPSTREAMS', 'forecast_fresh_s', fallback=900)
+# Older forecasts are neither served while revalidating nor used as a fallback
+FORECAST_MAX_STALE_S = cfg.getfloat('UPSTREAMS', 'forecast_max_stale_s', fallback=21600)
+# A request still running after this latency quantile of its host gets a duplicate, 0 disables hedging
+HEDGE_QUANTILE = cfg.getfloat('UPSTREAMS', 'hedge_quantile', fallback=0.95)
+HEDGE_MIN_DELAY_S = cfg.getfloat('UPSTREAMS', 'hedge_min_delay_s', fallback=0.5)
+# Successful calls needed before the latency quantile is trusted
+HEDGE_MIN_SAMPLES = 20
+
+
+class UpstreamUnavailable(RuntimeError):
+    """The upstream is not called: its circuit is open or the request could not get a slot in time."""
+
+
+def _host_config(host: str) -> dict:
+    # A [UPSTREAM <host>] section overrides the [UPSTREAMS] defaults for one host
+    section = f"UPSTREAM {host}" if cfg.has_section(f"UPSTREAM {host}") else "UPSTREAMS"
+    def get(key, fallback):
+        return cfg.getfloat(section, key, fallback=cfg.getfloat('UPSTREAMS', key, fallback=fallback))
+    return {
+        "max_concurrency": int(get("max_concurrency", 4)),
+        "rate_per_s": get("rate_per_s", 8),
+        "burst": get("burst", 8),
+        "queue_timeout_s": get("queue_timeout_s", 10),
+        "connect_timeout_s": get("connect_timeout_s", 5),
+        "read_timeout_s": get("read_timeout_s", 30),
+        "window": int(get("window", 20)),
+        "min_calls": int(get("min_calls", 5)),
+        "failure_ratio": get("failure_ratio", 0.5),
+        "slow_call_s": get("slow_call_s", 15),
+        "open_s": get("open_s", 30),
+    }
+
+
+class TokenBucket:
+    """Allows `rate` requests per second on average with bursts of up to `burst` requests."""
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.capacity = max(1.0, burst)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = (1 - self.tokens) / self.rate
+            if now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+class CircuitBreaker:
+    """
+    Opens when too many of the recent calls failed or were slow, rejects calls for `open_s` seconds,
+    then lets a single probe through (half-open) and closes again if it succeeds.
+    """
+    def __init__(self, window: int, min_calls: int, failure_ratio: float, slow_call_s: float, open_s: float):
+        self.outcomes = deque(maxlen=window)
+        self.min_calls = min_calls
+        self.failure_ratio = failure_ratio
+        self.slow_call_s = slow_call_s
+        self.open_s = open_s
+        self.opened_at = None
+        self.probing = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "open" if time.monotonic() - self.opened_at < self.open_s else "half_open"
+
+    def allow(self) -> bool:
+        with self.lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half_open" and not self.probing:
+                self.probing = True
+                return True
+            return False
+
+    def cancel_probe(self):
+        # A probe that was not sent must not keep the circuit half-open forever
+        with self.lock:
+            self.probing = False
+
+    def record(self, ok: bool, seconds: float):
+        with self.lock:
+            bad = not ok or seconds > self.slow_call_s
+            if self.probing:
+                self.probing = False
+                self.outcomes.clear()
+                self.opened_at = time.monotonic() if bad else None
+                return
+            self.outcomes.append(bad)
+            if len(self.outcomes) >= self.min_calls and sum(self.outcomes) / len(self.outcomes) >= self.failure_ratio:
+                self.opened_at = time.monotonic()
+                self.outcomes.clear()
+
+
+class _Slot:
+    """Concurrency slot held by a guarded call, a request still running in the background can take over its release."""
+    def __init__(self, semaphore: threading.BoundedSemaphore):
+        self.semaphore = semaphore
+        self.handed_over = False
+
+    def release_when_done(self, future: Future):
+        self.handed_over = True
+        future.add_done_callback(lambda _: self.semaphore.release())
+
+_held_slot: contextvars.ContextVar[_Slot | None] = contextvars.ContextVar("held_slot", default=None)
+
+
+class Upstream:
+    """Concurrency limit, rate limit and circuit breaker shared by all requests to one host."""
+    def __init__(self, host: str):
+        self.host = host
+        self.config = _host_config(host)
+        self.slots = threading.BoundedSemaphore(self.config["max_concurrency"])
+        self.bucket = TokenBucket(self.config["rate_per_s"], self.config["burst"])
+        self.breaker = CircuitBreaker(
+            self.config["window"], self.config["min_calls"], self.config["failure_ratio"],
+            self.config["slow_call_s"], self.config["open_s"],
+        )
+        self.latencies = deque(maxlen=200)
+
+    @property
+    def timeout(self) -> tuple[float, float]:
+        """(connect, read) timeout of a single request."""
+        return self.config["connect_timeout_s"], self.config["read_timeout_s"]
+
+    def hedge_delay(self) -> float | None:
+        """Tail latency of recent successful calls, None until there are enough of them."""
+        latencies = sorted(self.latencies)
+        if not HEDGE_QUANTILE or len(latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        return max(HEDGE_MIN_DELAY_S, latencies[min(len(latencies) - 1, int(HEDGE_QUANTILE * len(latencies)))])
+
+    @contextmanager
+    def guard(self, queue_timeout: float | None = None):
+        """Runs the block as one upstream call, raises `UpstreamUnavailable` instead of calling an unhealthy host."""
+        if not self.breaker.allow():
+            raise UpstreamUnavailable(f"Circuit of {self.host} is open")
+        queue_timeout = self.config["queue_timeout_s"] if queue_timeout is None else queue_timeout
+        if not self.bucket.acquire(queue_timeout) or not self.slots.acquire(timeout=queue_timeout):
+            self.breaker.cancel_probe()
+            raise UpstreamUnavailable(f"No free slot for {self.host} within {queue_timeout} s")
+        slot = _Slot(self.slots)
+        token = _held_slot.set(slot)
+        start = time.monotonic()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            _held_slot.reset(token)
+            if not slot.handed_over:
+                self.slots.release()
+            seconds = time.monotonic() - start
+            self.breaker.record(ok, seconds)
+            if ok:
+                self.latencies.append(seconds)
+
+_upstreams: dict[str, Upstream] = {}
+_upstreams_lock = threading.Lock()
+
+def get_upstream(url: str) -> Upstream:
+    host = urlparse(url).netloc
+    with _upstreams_lock:
+        if host not in _upstreams:
+            _upstreams[host] = Upstream(host)
+        return _upstreams[host]
+
+def get_upstream_status() -> dict[str, str]:
+    """Circuit state per host, e.g. for health checks."""
+    with _upstreams_lock:
+        return {host: upstream.breaker.state for host, upstream in _upstreams.items()}
+
+
+class StaleCache:
+    """Last successful response per request, bounded by total size, least recently used entries are evicted first."""
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.entries: OrderedDict[Hashable, tuple[float, Any, int]] = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, key: Hashable) -> tuple[float, Any] | None:
+        """Returns (age in seconds, value)."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            self.entries.move_to_end(key)
+            return time.monotonic() - entry[0], entry[1]
+
+    def put(self, key: Hashable, value: Any, nbytes: int):
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.entries.pop(key)[2]
+            if nbytes > self.max_bytes:
+                return
+            self.entries[key] = (time.monotonic(), value, nbytes)
+            self.size += nbytes
+            while self.size > self.max_bytes:
+                self.size -= self.entries.popitem(last=False)[1][2]
+
+_cache = StaleCache(CACHE_MAX_BYTES)
+_revalidating: set[Hashable] = set()
+_revalidating_lock = threading.Lock()
+_revalidation_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="revalidate")
+
+def _call(upstream: Upstream, key: Hashable, fetch: Callable[[], Any], nbytes: Callable[[Any], int]) -> Any:
+    with upstream.guard():
+        value = fetch()
+    _cache.put(key, value, nbytes(value))
+    return value
+
+def _revalidate(upstream: Upstream, key: Hashable, fetch: Callable[[], Any], nbytes: Callable[[Any], int]):
+    with _revalidating_lock:
+        if key in _revalidating:
+            return
+        _revalidating.add(key)
+
+    def run():
+        try:
+            # The refresh outlives the question that triggered it
+            with deadline_scope(None):
+                _call(upstream, key, fetch, nbytes)
+        except Exception as e:
+            logger.info("Revalidation of a cached %s response failed: %s", upstream.host, e)
+        finally:
+            with _revalidating_lock:
+                _revalidating.discard(key)
+    _revalidation_executor.submit(contextvars.copy_context().run, run)
+
+def fetch_guarded(
+    url: str,
+    key: Hashable,
+    fetch: Callable[[], Any],
+    fresh_s: float,
+    max_stale_s: float = float("inf"),
+    nbytes: Callable[[Any], int] = sys.getsizeof,
+) -> Any:
+    """
+    Calls `fetch` for a request to the upstream at `url`, protected by the limits of its host.
+    Responses younger than `fresh_s` are served from the cache. Older ones, up to `max_stale_s`, are served right away
+    and refreshed in the background, and they are the fallback whenever the upstream is unavailable or fails.
+    """
+    upstream = get_upstream(url)
+    cached = _cache.get(key)
+    if cached is not None and cached[0] < max_stale_s:
+        age, value = cached
+        with span("cache.upstream", host=upstream.host, cache_hit=True, stale=age >= fresh_s):
+            if age >= fresh_s and upstream.breaker.state != "open":
+                _revalidate(upstream, key, fetch, nbytes)
+            return value
+    try:
+        check_deadline()
+        return _call(upstream, key, fetch, nbytes)
+    except Exception as e:
+        # Another request may have filled the cache meanwhile
+        cached = _cache.get(key)
+        if cached is None or cached[0] >= max_stale_s:
+            raise
+        logger.warning("Upstream %s failed (%s), serving a cached response", upstream.host, e)
+        return cached[1]
+
+_hedge_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="hedge")
+
+def call_hedged(upstream: Upstream, request: Callable[[], Any]) -> Any:
+    """
+    Runs `request` of a caller already holding a slot of the upstream. If it is still running after the tail latency
+    of the host, the same request is sent again when a slot is free right away, and the first successful response wins.
+    The caller's slot is released only once the first request finished, also if the hedge won.
+    """
+    delay = upstream.hedge_delay()
+    if delay is None:
+        return request()
+    primary = _hedge_executor.submit(contextvars.copy_context().run, request)
+    slot = _held_slot.get()
+    if slot is not None:
+        slot.release_when_done(primary)
+    try:
+        return primary.result(timeout=delay)
+    except FutureTimeout:
+        pass
+
+    def duplicate():
+        with upstream.guard(queue_timeout=0):
+            return request()
+    with span("http.hedge", host=upstream.host, delay_ms=round(delay * 1000, 1)) as record:
+        pending = {primary, _hedge_executor.submit(contextvars.copy_context().run, duplicate)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    record["winner"] = "primary" if future is primary else "hedge"
+                    return future.result()
+    return primary.result()
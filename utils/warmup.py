@@ -0,0 +1,146 @@
+import configparser
+import logging
+import threading
+import time
+from typing import Callable
+
+from paths import PROJECT_ROOT
+from utils.instrumentation import span
+
+cfg = configparser.ConfigParser()
+cfg.read(f'{PROJECT_ROOT}/config.ini')
+
+logger = logging.getLogger(__name__)
+
+WARMUP_ENABLED = cfg.getboolean('WARMUP', 'enabled', fallback=True)
+
+def _warm_agents():
+    from agents.comparison_geo_agent import get_comparison_geo_agent
+    from agents.geo_agent import get_geo_agent
+
+    get_geo_agent()
+    get_comparison_geo_agent()
+
+def _warm_llm():
+    from utils.agent_utils import get_llm_with_tools
+
+    get_llm_with_tools()
+
+def _warm_palette_lookups():
+    from utils.tool_utils import LU_PALETTE, get_palette_lookup
+
+    get_palette_lookup(LU_PALETTE.tobytes())
+
+def _warm_geometry():
+    # The first area computation imports geopandas and loads the CRS database
+    from schemas.geometry import BoundingBox
+    from utils.spoi_index import project_lonlat
+
+    BoundingBox.from_bounds(14.3, 50.0, 14.5, 50.1).area
+    project_lonlat(14.4, 50.05)
+
+def _warm_place_index():
+    from utils.place_index import get_place_index
+
+    get_place_index()
+
+def _warm_municipality_table():
+    from utils.municipality_table import load_municipality_table
+
+    load_municipality_table()
+
+def _warm_raster_store():
+    from utils.raster_store import get_raster_store
+
+    get_raster_store()
+
+def _warm_tourism_index():
+    from utils.tool_utils import load_tourism_data
+
+    load_tourism_data()
+
+def _warm_hotel_features():
+    from models import hotels_model
+
+    hotels_model.load_features()
+
+def _warm_hotels_model():
+    # Trains and saves the model if it is missing
+    from models import hotels_model
+
+    hotels_model.load_model()
+
+def _warm_cpu_pool():
+    from utils.cpu_pool import start_cpu_workers
+
+    start_cpu_workers()
+
+# Run in this order, the resources every question needs first
+WARMUP_STEPS: dict[str, Callable[[], None]] = {
+    "agent_graphs": _warm_agents,
+    "llm": _warm_llm,
+    "palette_lookups": _warm_palette_lookups,
+    "geometry": _warm_geometry,
+    "tourism_index": _warm_tourism_index,
+    "place_index": _warm_place_index,
+    "municipality_table": _warm_municipality_table,
+    "raster_store": _warm_raster_store,
+    "hotel_features": _warm_hotel_features,
+    "hotels_model": _warm_hotels_model,
+    "cpu_pool": _warm_cpu_pool,
+}
+
+
+class Warmup:
+    """
+    Loads the shared models, indexes and lookup tables of the process on a background thread, so the first
+    question does not pay for them. A failed step is reported and its resource is loaded on first use as before.
+    """
+    def __init__(self, steps: dict[str, Callable[[], None]]):
+        self.steps = steps
+        self.status = {name: {"state": "pending"} for name in steps}
+        self.finished = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="warmup", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        for name, step in self.steps.items():
+            self.status[name] = {"state": "running"}
+            start = time.perf_counter()
+            try:
+                with span(f"warmup.{name}"):
+                    step()
+                self.status[name] = {"state": "done", "ms": round((time.perf_counter() - start) * 1000, 1)}
+            except Exception as e:
+                logger.warning("Warmup step %s failed: %s", name, e)
+                self.status[name] = {"state": "failed", "ms": round((time.perf_counter() - start) * 1000, 1), "error": str(e)}
+        self.finished.set()
+
+    @property
+    def ready(self) -> bool:
+        return self.finished.is_set()
+
+    def report(self) -> dict:
+        """Readiness and the state of every step, e.g. for health checks."""
+        return {"ready": self.ready, "steps": dict(self.status)}
+
+_warmup = Warmup(WARMUP_STEPS)
+
+def start_warmup() -> Warmup:
+    """Starts the warmup of the process once, later calls return the running or finished one."""
+    if WARMUP_ENABLED:
+        _warmup.start()
+    elif not _warmup.ready:
+        _warmup.status = {name: {"state": "skipped"} for name in _warmup.steps}
+        _warmup.finished.set()
+    return _warmup
+
+def get_warmup() -> Warmup:
+    return _warmup